@@ -0,0 +1,44 @@
+import { getPythonServiceUrl } from "@/app/config"
+
+// Never cache or pre-render the event stream
+export const dynamic = "force-dynamic"
+
+export async function GET(request: Request) {
+  // Get the Python service URL from our config
+  const PYTHON_SERVICE_URL = getPythonServiceUrl()
+
+  // Resume where the browser left off (EventSource sends Last-Event-ID on reconnect)
+  const headers: Record<string, string> = { Accept: "text/event-stream" }
+  const lastEventId = request.headers.get("last-event-id")
+  if (lastEventId) {
+    headers["Last-Event-ID"] = lastEventId
+  }
+
+  const { search } = new URL(request.url)
+
+  // No timeout here: the stream stays open, and closing the page aborts it
+  const response = await fetch(`${PYTHON_SERVICE_URL}/processor-events${search}`, {
+    headers,
+    signal: request.signal,
+    cache: "no-store",
+  }).catch((error) => {
+    // Handle network errors explicitly
+    console.error("Network error when connecting to processor events:", error)
+    return null
+  })
+
+  if (!response || !response.ok || !response.body) {
+    return new Response("Cannot connect to the email processor service. Make sure it's running.", {
+      status: 502,
+    })
+  }
+
+  return new Response(response.body, {
+    headers: {
+      "Content-Type": "text/event-stream",
+      "Cache-Control": "no-cache, no-transform",
+      Connection: "keep-alive",
+      "X-Accel-Buffering": "no",
+    },
+  })
+}
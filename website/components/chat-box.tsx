@@ -27,6 +27,9 @@ export function ChatBox() {
     model_loaded: boolean
     model_path: string
     transformers_available: boolean
+    state?: "unloaded" | "loading" | "loaded" | "failed"
+    load_mode?: "lazy" | "eager"
+    error?: string | null
   } | null>(null)
   const [error, setError] = useState<string | null>(null)
   const [serviceUrl, setServiceUrl] = useState<string>("")
@@ -36,6 +39,8 @@ export function ChatBox() {
   )
   const messagesEndRef = useRef<HTMLDivElement>(null)
   const abortControllerRef = useRef<AbortController | null>(null)
+  // Identifies this conversation so the service can reuse its cached context between turns
+  const sessionIdRef = useRef<string>(`${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`)
 
   // Initialize the service URL
   useEffect(() => {
@@ -209,10 +214,18 @@ export function ChatBox() {
           "Content-Type": "application/json",
           Accept: "text/event-stream, text/plain, application/json",
         },
-        body: JSON.stringify({ message: input }),
+        body: JSON.stringify({ message: input, session_id: sessionIdRef.current }),
         signal: abortControllerRef.current.signal,
       })
 
+      if (response.status === 429) {
+        // The model is busy with higher-priority work-order extraction
+        const retryAfter = response.headers.get("Retry-After")
+        throw new Error(
+          `The assistant is busy processing work orders. Please try again${retryAfter ? ` in ${retryAfter} seconds` : " shortly"}.`,
+        )
+      }
+
       if (!response.ok) {
         throw new Error(`Failed to get response: ${response.status} ${response.statusText}`)
       }
@@ -235,6 +248,8 @@ export function ChatBox() {
       }
 
       let aiResponse = ""
+      // One decoder for the whole stream so multi-byte characters split across chunks decode correctly
+      const decoder = new TextDecoder()
 
       // Read the stream
       while (true) {
@@ -245,7 +260,7 @@ export function ChatBox() {
         }
 
         // Decode the chunk and append to the AI response
-        const chunk = new TextDecoder().decode(value)
+        const chunk = decoder.decode(value, { stream: true })
         aiResponse += chunk
 
         // Update the AI message with the current response
@@ -358,16 +373,20 @@ export function ChatBox() {
               </Alert>
             )}
 
-            {modelStatus && !modelStatus.model_loaded && connectionStatus === "connected" && (
-              <Alert variant="warning" className="mb-4 bg-yellow-50 border-yellow-200">
-                <AlertCircle className="h-4 w-4 text-yellow-600" />
-                <AlertTitle className="text-yellow-600">Model Not Loaded</AlertTitle>
-                <AlertDescription className="text-yellow-700">
-                  The language model ({modelStatus.model_path}) is not loaded. Chat responses will be limited. Make sure
-                  you have the transformers package installed and the model is accessible.
-                </AlertDescription>
-              </Alert>
-            )}
+            {/* A lazily loaded model is expected to be unloaded until the first request */}
+            {modelStatus &&
+              !modelStatus.model_loaded &&
+              !(modelStatus.state === "unloaded" && modelStatus.load_mode === "lazy") &&
+              connectionStatus === "connected" && (
+                <Alert variant="warning" className="mb-4 bg-yellow-50 border-yellow-200">
+                  <AlertCircle className="h-4 w-4 text-yellow-600" />
+                  <AlertTitle className="text-yellow-600">Model Not Loaded</AlertTitle>
+                  <AlertDescription className="text-yellow-700">
+                    The language model ({modelStatus.model_path}) is not loaded. Chat responses will be limited. Make sure
+                    you have the transformers package installed and the model is accessible.
+                  </AlertDescription>
+                </Alert>
+              )}
 
             {error && connectionStatus === "connected" && (
               <Alert variant="destructive" className="mb-4">
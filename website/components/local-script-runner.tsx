@@ -160,6 +160,38 @@ export function LocalScriptRunner() {
     }
   }
 
+  // Follow the processor over its event stream while connected: "status"
+  // events carry the fields that changed and "log" events one entry each
+  useEffect(() => {
+    if (!isConnected) {
+      return
+    }
+
+    const source = new EventSource(`${serverUrl}/processor-events`)
+
+    source.addEventListener("status", (event) => {
+      const changes = JSON.parse((event as MessageEvent).data)
+      if (changes.running !== undefined) {
+        setStatus((prev) => (changes.running ? "running" : prev === "running" ? "idle" : prev))
+      }
+    })
+
+    source.addEventListener("log", (event) => {
+      const log = JSON.parse((event as MessageEvent).data)
+      setOutput((prev) => `${prev}\n[${new Date(log.timestamp).toLocaleTimeString()}] ${log.message}`)
+    })
+
+    // Dropped connections are retried by the browser; an error response
+    // means the server is gone
+    source.onerror = () => {
+      if (source.readyState === EventSource.CLOSED) {
+        setIsConnected(false)
+      }
+    }
+
+    return () => source.close()
+  }, [isConnected, serverUrl])
+
   // Update server URL when port changes
   useEffect(() => {
     setServerUrl(`http://localhost:${port}`)
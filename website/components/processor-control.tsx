@@ -1,23 +1,45 @@
 "use client"
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { Button } from "@/components/ui/button"
 import { Card, CardContent, CardDescription, CardFooter, CardHeader, CardTitle } from "@/components/ui/card"
 import { Play, Square, RefreshCw, AlertCircle, CheckCircle, Info } from "lucide-react"
 import { Alert, AlertDescription, AlertTitle } from "@/components/ui/alert"
 import { Badge } from "@/components/ui/badge"
 
+type ProcessorLog = {
+  id?: number
+  timestamp: string
+  message: string
+  status: "success" | "error" | "info"
+}
+
+// Per-mailbox ingestion state reported by the processor
+type MailboxStatus = {
+  name: string
+  connected: boolean
+  backlog: number
+  in_flight: number
+  processed: number
+  failed: number
+  throughput_per_min: number
+  lag_seconds: number
+  last_error: string | null
+}
+
 type ProcessorStatus = {
   running: boolean
   last_check: string | null
   emails_processed: number
-  logs: Array<{
-    timestamp: string
-    message: string
-    status: "success" | "error" | "info"
-  }>
+  mailboxes?: MailboxStatus[]
+  logs: ProcessorLog[]
 }
 
+// Logs kept in the panel
+const MAX_LOGS = 50
+// Wait before reopening the event stream after the service went away
+const RECONNECT_DELAY = 5000
+
 export function ProcessorControl() {
   const [status, setStatus] = useState<ProcessorStatus>({
     running: false,
@@ -28,7 +50,8 @@ export function ProcessorControl() {
 
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
-  const [refreshInterval, setRefreshInterval] = useState<NodeJS.Timeout | null>(null)
+  // Id of the newest log entry received, to resume the stream after a reconnect
+  const lastEventId = useRef<string | null>(null)
 
   // Update the fetchStatus function in the ProcessorControl component
   const fetchStatus = async () => {
@@ -86,12 +109,6 @@ export function ProcessorControl() {
         setError(data.message)
       } else {
         await fetchStatus()
-
-        // Set up refresh interval
-        if (refreshInterval === null) {
-          const interval = setInterval(fetchStatus, 5000)
-          setRefreshInterval(interval)
-        }
       }
     } catch (error) {
       console.error("Error starting processor:", error)
@@ -120,12 +137,6 @@ export function ProcessorControl() {
         setError(data.message)
       } else {
         await fetchStatus()
-
-        // Clear refresh interval
-        if (refreshInterval !== null) {
-          clearInterval(refreshInterval)
-          setRefreshInterval(null)
-        }
       }
     } catch (error) {
       console.error("Error stopping processor:", error)
@@ -135,28 +146,56 @@ export function ProcessorControl() {
     }
   }
 
-  // Update the useEffect hook
+  // Status changes and new log entries are pushed over one event stream
+  // instead of polling: "status" events carry the fields that changed and
+  // "log" events one entry each
   useEffect(() => {
-    // Initial fetch with error handling
-    fetchStatus().catch((err) => {
-      console.error("Initial status fetch failed:", err)
-      // Don't set error here as fetchStatus already handles it
-    })
-
-    // Set up refresh interval if processor is running
-    if (status.running && refreshInterval === null) {
-      const interval = setInterval(() => {
-        fetchStatus().catch((err) => {
-          console.error("Interval status fetch failed:", err)
-          // Don't set error here as fetchStatus already handles it
+    let source: EventSource | null = null
+    let reconnectTimer: NodeJS.Timeout | null = null
+
+    const connect = () => {
+      const query = lastEventId.current ? `?last_event_id=${encodeURIComponent(lastEventId.current)}` : ""
+      source = new EventSource(`/api/processor/events${query}`)
+
+      source.addEventListener("status", (event) => {
+        const changes = JSON.parse((event as MessageEvent).data)
+        setStatus((prev) => ({ ...prev, ...changes, logs: prev.logs }))
+        setError(null)
+      })
+
+      source.addEventListener("log", (event) => {
+        const message = event as MessageEvent
+        const log: ProcessorLog = JSON.parse(message.data)
+        if (message.lastEventId) {
+          lastEventId.current = message.lastEventId
+        }
+        setStatus((prev) => {
+          if (log.id !== undefined && prev.logs.some((entry) => entry.id === log.id)) {
+            return prev
+          }
+          return { ...prev, logs: [log, ...prev.logs].slice(0, MAX_LOGS) }
         })
-      }, 5000)
-      setRefreshInterval(interval)
+      })
+
+      // The browser retries dropped connections itself (sending Last-Event-ID);
+      // an error response closes the stream for good, so reopen it here
+      source.onerror = () => {
+        if (source && source.readyState === EventSource.CLOSED) {
+          setError("Failed to connect to the email processor service. Check if the Python service is running.")
+          source.close()
+          reconnectTimer = setTimeout(connect, RECONNECT_DELAY)
+        }
+      }
     }
 
+    connect()
+
     return () => {
-      if (refreshInterval !== null) {
-        clearInterval(refreshInterval)
+      if (reconnectTimer !== null) {
+        clearTimeout(reconnectTimer)
+      }
+      if (source) {
+        source.close()
       }
     }
   }, [])
@@ -185,6 +224,45 @@ export function ProcessorControl() {
             </div>
           </div>
 
+          {status.mailboxes && status.mailboxes.length > 0 && (
+            <div className="border rounded-md overflow-hidden mb-4">
+              <table className="w-full text-sm">
+                <thead className="bg-gray-50 text-gray-500">
+                  <tr>
+                    <th className="px-3 py-2 text-left font-medium">Mailbox</th>
+                    <th className="px-3 py-2 text-right font-medium">Backlog</th>
+                    <th className="px-3 py-2 text-right font-medium">In Flight</th>
+                    <th className="px-3 py-2 text-right font-medium">Processed</th>
+                    <th className="px-3 py-2 text-right font-medium">Per Min</th>
+                    <th className="px-3 py-2 text-right font-medium">Lag</th>
+                  </tr>
+                </thead>
+                <tbody>
+                  {status.mailboxes.map((mailbox) => (
+                    <tr key={mailbox.name} className="border-t" title={mailbox.last_error ?? undefined}>
+                      <td className="px-3 py-2">
+                        <span
+                          className={`inline-block h-2 w-2 rounded-full mr-2 ${
+                            mailbox.connected ? "bg-green-500" : "bg-gray-300"
+                          }`}
+                        />
+                        {mailbox.name}
+                      </td>
+                      <td className="px-3 py-2 text-right">{mailbox.backlog}</td>
+                      <td className="px-3 py-2 text-right">{mailbox.in_flight}</td>
+                      <td className="px-3 py-2 text-right">
+                        {mailbox.processed}
+                        {mailbox.failed > 0 && <span className="text-red-500"> ({mailbox.failed} failed)</span>}
+                      </td>
+                      <td className="px-3 py-2 text-right">{mailbox.throughput_per_min}</td>
+                      <td className="px-3 py-2 text-right">{Math.round(mailbox.lag_seconds)}s</td>
+                    </tr>
+                  ))}
+                </tbody>
+              </table>
+            </div>
+          )}
+
           {error && (
             <Alert variant="destructive" className="mb-4">
               <AlertCircle className="h-4 w-4" />
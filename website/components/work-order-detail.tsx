@@ -6,7 +6,7 @@ import { Separator } from "@/components/ui/separator"
 type WorkOrder = {
   id: number
   title: string
-  priority: "HIGH" | "NORMAL"
+  priority: "URGENT" | "HIGH" | "NORMAL" | "LOW"
   description: string
   due_date: string
   customer: string
@@ -36,7 +36,7 @@ export function WorkOrderDetail({ workOrder, open, onClose }: WorkOrderDetailPro
         <DialogHeader>
           <DialogTitle className="flex items-center justify-between">
             <span>{workOrder.title}</span>
-            <Badge variant={workOrder.priority === "HIGH" ? "destructive" : "secondary"}>{workOrder.priority}</Badge>
+            <Badge variant={workOrder.priority === "URGENT" || workOrder.priority === "HIGH" ? "destructive" : "secondary"}>{workOrder.priority}</Badge>
           </DialogTitle>
           <DialogDescription>Created on {new Date(workOrder.created_at).toLocaleDateString()}</DialogDescription>
         </DialogHeader>
@@ -11,7 +11,7 @@ import { WorkOrderDetail } from "@/components/work-order-detail"
 type WorkOrder = {
   id: number
   title: string
-  priority: "HIGH" | "NORMAL"
+  priority: "URGENT" | "HIGH" | "NORMAL" | "LOW"
   description: string
   due_date: string
   customer: string
@@ -22,26 +22,40 @@ type WorkOrder = {
   action_items: string
 }
 
+type WorkOrderPage = {
+  work_orders: WorkOrder[]
+  next_cursor: string | null
+}
+
+const PAGE_SIZE = 50
+
 export function WorkOrderList() {
   const [workOrders, setWorkOrders] = useState<WorkOrder[]>([])
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState<string | null>(null)
   const [selectedWorkOrder, setSelectedWorkOrder] = useState<WorkOrder | null>(null)
   const [detailOpen, setDetailOpen] = useState(false)
 
-  const fetchWorkOrders = async () => {
+  // Without a cursor the list starts over; with one the next page is appended
+  const fetchWorkOrders = async (cursor: string | null = null) => {
     setLoading(true)
     setError(null)
 
     try {
-      const response = await fetch("/api/work-orders")
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE) })
+      if (cursor) {
+        params.set("cursor", cursor)
+      }
+      const response = await fetch(`/api/work-orders?${params}`)
 
       if (!response.ok) {
         throw new Error(`Failed to fetch work orders: ${response.statusText}`)
       }
 
-      const data = await response.json()
-      setWorkOrders(data)
+      const data: WorkOrderPage = await response.json()
+      setWorkOrders((current) => (cursor ? [...current, ...data.work_orders] : data.work_orders))
+      setNextCursor(data.next_cursor)
     } catch (error) {
       console.error("Error fetching work orders:", error)
       setError("Failed to load work orders. The Python service might not be running.")
@@ -68,7 +82,7 @@ export function WorkOrderList() {
     <div className="p-4 h-full flex flex-col">
       <div className="flex justify-between items-center mb-4">
         <h2 className="text-xl font-semibold">Work Orders</h2>
-        <Button variant="outline" size="sm" onClick={fetchWorkOrders} disabled={loading}>
+        <Button variant="outline" size="sm" onClick={() => fetchWorkOrders()} disabled={loading}>
           <RefreshCw className={`h-4 w-4 mr-2 ${loading ? "animate-spin" : ""}`} />
           Refresh
         </Button>
@@ -110,10 +124,14 @@ export function WorkOrderList() {
                 <TableRow key={order.id}>
                   <TableCell className="font-medium">{order.title}</TableCell>
                   <TableCell>
-                    <Badge variant={order.priority === "HIGH" ? "destructive" : "secondary"}>{order.priority}</Badge>
+                    <Badge
+                      variant={order.priority === "URGENT" || order.priority === "HIGH" ? "destructive" : "secondary"}
+                    >
+                      {order.priority}
+                    </Badge>
                   </TableCell>
                   <TableCell>{order.customer}</TableCell>
-                  <TableCell>{new Date(order.due_date).toLocaleDateString()}</TableCell>
+                  <TableCell>{order.due_date ? new Date(order.due_date).toLocaleDateString() : "—"}</TableCell>
                   <TableCell>{order.trade}</TableCell>
                   <TableCell className="text-right">
                     <Button variant="ghost" size="icon" onClick={() => handleViewDetails(order)}>
@@ -125,6 +143,13 @@ export function WorkOrderList() {
             )}
           </TableBody>
         </Table>
+        {nextCursor && (
+          <div className="flex justify-center py-4">
+            <Button variant="outline" size="sm" onClick={() => fetchWorkOrders(nextCursor)} disabled={loading}>
+              {loading ? "Loading..." : "Load more"}
+            </Button>
+          </div>
+        )}
       </div>
 
       <WorkOrderDetail workOrder={selectedWorkOrder} open={detailOpen} onClose={handleCloseDetails} />
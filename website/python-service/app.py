@@ -1,14 +1,38 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import uvicorn
-import json
-import os
-import time
+import asyncio
+import queue
+import uuid
+import importlib.util
 import threading
-import sqlite3
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
+
+import email_processing
+from bulk_ingest import BulkIngest, bulk_parser_for, iter_body
+from chat_sessions import get_chat_sessions
+from config_store import get_config_store
+from email_processing import (create_pipeline, extract_work_order_async, spool_manual_attachments,
+                              save_manual_work_order, pipeline_settings_changed)
+from export_sink import get_export_sink, configure_export_sink
+from log_store import get_log_store, close_all_stores
+from mailbox_pool import MailboxPool, mailbox_settings_changed, RESTART_DELAY, SUPERVISE_INTERVAL
+from model_manager import get_model_manager
+from model_scheduler import QueueTimeout
+from mime_stream import MessageTooLarge
+from message_journal import get_message_journal
+from processing_pipeline import discard_attachments
+from processor_coordinator import get_processor_coordinator, close_processor_coordinator
+from processor_events import get_event_broker, async_event_stream, parse_event_id
+from recent_events import RecentEvents, merge_latest
+from work_order_search import get_work_order_search
+from work_order_store import get_work_order_store
 
 # Configuration for the Python service
 CONFIG_FILE = "config.json"
@@ -24,289 +48,548 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+config_store = get_config_store(CONFIG_FILE)
+
 def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {
-        # IMAP Configuration
-        "imap": {
-            "server": "localhost",
-            "port": 993,
-            "username": os.getenv('IMAP_USER') or "espocrm@localhost",
-            "password": os.getenv('IMAP_PASS') or "",
-            "folder": "INBOX"
-        },
-        # XAMPP MySQL Configuration
-        "xampp_mysql": {
-            "host": "localhost",
-            "user": os.getenv('MYSQL_USER') or "root",
-            "password": os.getenv('MYSQL_PASS') or "",
-            "database": "work_orders",
-            "port": 3306
-        },
-        # CRM Configuration
-        "crm": {  
-            "base_url": "http://localhost/espocrm",
-            "username": os.getenv('CRM_USER') or "",
-            "password": os.getenv('CRM_PASS') or "",
-            "import_endpoint": "/api/v1/Import"
-        },
-        # AI Configuration
-        "model_path": "meta-llama/Llama-3.2-1B",
-        # File Handling
-        "csv_path": "/var/data/work_orders.csv",
-        "temp_dir": "/tmp/email_attachments",
-        # Database
-        "db_path": "/var/data/processing_logs.db",
-    }
+    return config_store.get()
 
 def save_config(config):
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=2)
-
-# Sample work orders for demonstration
-SAMPLE_WORK_ORDERS = [
-    {
-        "id": 1,
-        "title": "Fix Leaking Roof",
-        "priority": "HIGH",
-        "description": "Customer reported water damage from roof leak in master bedroom",
-        "due_date": "2025-04-10",
-        "customer": "John Smith",
-        "location": "123 Main St, Anytown, USA",
-        "trade": "Roofing",
-        "created_at": "2025-04-03T12:30:00",
-        "summary": "Urgent roof repair needed due to water damage in master bedroom.",
-        "action_items": "1. Inspect roof\n2. Repair damaged shingles\n3. Check for interior water damage"
-    },
-    {
-        "id": 2,
-        "title": "HVAC Maintenance",
-        "priority": "NORMAL",
-        "description": "Annual HVAC system check and filter replacement",
-        "due_date": "2025-04-15",
-        "customer": "Jane Doe",
-        "location": "456 Oak Ave, Somewhere, USA",
-        "trade": "HVAC",
-        "created_at": "2025-04-02T09:15:00",
-        "summary": "Routine annual HVAC maintenance and filter replacement.",
-        "action_items": "1. Replace air filters\n2. Clean condenser coils\n3. Check refrigerant levels"
-    }
-]
+    return config_store.save(config)
 
 # Email processing request model
 class EmailRequest(BaseModel):
     email_content: str
+    subject: Optional[str] = None
     attachments: Optional[List[Dict[str, Any]]] = None
 
 # Config update request model
 class ConfigUpdate(BaseModel):
     imap: Dict[str, Any]
+    mailboxes: Optional[List[Dict[str, Any]]] = None
     xampp_mysql: Dict[str, Any]
     crm: Dict[str, Any]
     model_path: str
+    inference_mode: Optional[str] = None
+    model_load: Optional[str] = None
     csv_path: str
     temp_dir: str
     db_path: str
+    log_retention_days: Optional[int] = 30
+    processor: Optional[Dict[str, Any]] = None
+    max_attachment_size: Optional[int] = None
+    max_message_size: Optional[int] = None
+    attachment_store_max_bytes: Optional[int] = None
+    extraction: Optional[Dict[str, Any]] = None
+    extraction_cache: Optional[Dict[str, Any]] = None
+    chat: Optional[Dict[str, Any]] = None
+    scheduler: Optional[Dict[str, Any]] = None
+    search: Optional[Dict[str, Any]] = None
+    export: Optional[Dict[str, Any]] = None
+    service: Optional[Dict[str, Any]] = None
 
-# Email processing status
+# Email processing status. The processor runs in whichever process holds
+# the processor lease (see processor_coordinator); these describe this process.
+# It is an asyncio task on the server's event loop, and
+# email_processor_done is set once it has fully unwound (or never started).
 email_processor_running = False
+email_processor_task = None
+email_processor_done = threading.Event()
+email_processor_done.set()
+event_loop = None
 last_check_time = None
-emails_processed = 0
-processing_logs = []
+# In-memory events go to /processor-events subscribers as they happen
+# (without an id: only log store entries can be replayed on reconnect)
+processing_logs = RecentEvents(on_append=lambda event: get_event_broker().publish("log", event))
+ingestor_stop_event = None
+processing_pipeline = None
+mailbox_pool = None
+bulk_pipeline = None
+bulk_pipeline_lock = threading.Lock()
+
+# Blocking SQLite and file I/O of the endpoints and the processor task runs
+# on a dedicated executor rather than Starlette's threadpool, and CPU-bound
+# work in a process pool (see "service" in config_store)
+io_executor = None
+cpu_pool = None
+executors_lock = threading.Lock()
+
+def get_io_executor():
+    global io_executor
+    with executors_lock:
+        if io_executor is None:
+            io_executor = ThreadPoolExecutor(
+                max_workers=load_config()["service"].get("io_threads", 16), thread_name_prefix="io")
+        return io_executor
+
+def get_cpu_pool():
+    global cpu_pool
+    workers = load_config()["service"].get("cpu_workers", 2)
+    with executors_lock:
+        if cpu_pool is None and workers > 0:
+            # Spawned, not forked: this process runs threads and may hold the model
+            cpu_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return cpu_pool
+
+async def run_io(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(get_io_executor(), partial(func, *args, **kwargs))
+
+# `func` and its arguments must be picklable when there is a process pool
+async def run_cpu(func, *args, **kwargs):
+    executor = get_cpu_pool() or get_io_executor()
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+def shutdown_executors():
+    with executors_lock:
+        if cpu_pool is not None:
+            cpu_pool.shutdown(wait=False, cancel_futures=True)
+        if io_executor is not None:
+            io_executor.shutdown(wait=False)
 
 # Initialize SQLite database for logs
 def init_db():
-    db_path = load_config()["db_path"]
-    os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS processing_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            email_id TEXT,
-            status TEXT,
-            message TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    config = load_config()
+    return get_log_store(config["db_path"], config.get("log_retention_days"))
 
-# Get logs from SQLite database
-def get_logs(limit=10):
-    try:
-        db_path = load_config()["db_path"]
-        if not os.path.exists(db_path):
-            return []
-            
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, email_id, status, message 
-            FROM processing_logs 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        logs = []
-        for row in cursor.fetchall():
-            timestamp, email_id, status, message = row
-            logs.append({
-                "timestamp": timestamp,
-                "message": f"Email {email_id}: {message}" if message else f"Email {email_id} processed",
-                "status": "success" if status == "SUCCESS" else "error"
-            })
-            
-        conn.close()
-        return logs
-    except Exception as e:
-        print(f"Error getting logs: {str(e)}")
-        return []
+# Shared by every /process-emails request, apart from the IMAP processor's
+# pipeline so a backfill never waits behind (or holds up) live mail
+def get_bulk_pipeline():
+    global bulk_pipeline
+    with bulk_pipeline_lock:
+        if bulk_pipeline is None:
+            config = load_config()
+            bulk_pipeline = create_pipeline(
+                config, processing_logs.append, source="bulk", parse=bulk_parser_for(config)).start()
+        return bulk_pipeline
+
+# The bulk pipeline binds temp_dir and the size limits; after a change the
+# next request gets a new one. Emails already queued on the old one still
+# finish, while requests still feeding it get an error for the rest.
+def retire_bulk_pipeline():
+    global bulk_pipeline
+    with bulk_pipeline_lock:
+        retired, bulk_pipeline = bulk_pipeline, None
+    if retired:
+        threading.Thread(target=retired.stop, name="bulk-pipeline-retire", daemon=True).start()
+
+# The request body is still being read while results stream out, so unlike
+# StreamingResponse this must not consume receive() to watch for disconnects
+class BulkResultStream(StreamingResponse):
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        finally:
+            # Closed right away when the client goes away mid-stream, so the
+            # bulk request stops reading instead of waiting for collection
+            await self.body_iterator.aclose()
 
-def background_email_processor():
-    global email_processor_running, last_check_time, emails_processed
+async def background_email_processor():
+    global email_processor_running, ingestor_stop_event, processing_pipeline, mailbox_pool
+    
+    def mark_check(mailbox):
+        global last_check_time
+        last_check_time = datetime.now().isoformat()
+        processing_logs.append(f"Checking {mailbox} for new emails...", "info")
+    
+    def log_mailbox_event(level, message):
+        processing_logs.append(message, level)
     
-    while email_processor_running:
+    def flush_exports():
+        get_export_sink(load_config()).flush()
+    
+    try:
+        # The mailbox pool feeds a bounded queue; submit() blocks while it
+        # is full. Every message is journaled first, so a crash loses or
+        # repeats nothing.
+        journal = await run_io(get_message_journal, load_config())
+        pipeline = await run_io(lambda: create_pipeline(load_config(), processing_logs.append, journal=journal).start())
+        processing_pipeline = pipeline
+        journal.start_checkpoints(flush_exports)
+        
+        # Each pass shards the mailboxes across a pool of processes that keep
+        # one IMAP connection per mailbox waiting on IDLE; a config change
+        # stops the pool so the next pass starts one with the new settings.
+        # The task itself only wakes up to check on the pool.
         try:
-            # Simulate checking for new emails
-            last_check_time = datetime.now().isoformat()
-            
-            # Add log entry
-            processing_logs.append({
-                "timestamp": datetime.now().isoformat(),
-                "message": "Checking for new emails...",
-                "status": "info"
-            })
-            
-            # Simulate processing emails
-            time.sleep(5)  # Simulate work
-            new_emails = 2  # Simulate finding 2 new emails
-            emails_processed += new_emails
-            
-            # Add log entry
-            processing_logs.append({
-                "timestamp": datetime.now().isoformat(),
-                "message": f"Processed {new_emails} new emails",
-                "status": "success"
-            })
-            
-            # Wait before next check
-            time.sleep(10)
-        except Exception as e:
-            processing_logs.append({
-                "timestamp": datetime.now().isoformat(),
-                "message": f"Error: {str(e)}",
-                "status": "error"
-            })
-            time.sleep(30)  # Wait longer after error
+            while email_processor_running:
+                pool = MailboxPool(load_config(), pipeline.submit, log=log_mailbox_event, on_check=mark_check)
+                mailbox_pool = pool
+                ingestor_stop_event = pool.stop_event
+                # halt_processor() may have run before the event was published
+                if not email_processor_running:
+                    break
+                failed = False
+                try:
+                    await run_io(pool.start)
+                    while not pool.stop_event.is_set() and pool.check():
+                        await asyncio.sleep(SUPERVISE_INTERVAL)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    processing_logs.append(f"Error: {str(e)}", "error")
+                    failed = True
+                finally:
+                    # Everything fetched is processed and checkpointed first,
+                    # so the next pool resumes only what a crash left unfinished
+                    await run_io(pool.stop)
+                    await run_io(journal.checkpoint, flush_exports)
+                # Back off with the pool (and its IMAP connections) stopped
+                if failed:
+                    await asyncio.sleep(30)  # Wait longer after error
+                elif pool.crashed:
+                    await asyncio.sleep(RESTART_DELAY)
+        finally:
+            # Let the workers finish whatever was already fetched
+            await run_io(pipeline.stop)
+            await run_io(journal.stop_checkpoints, flush_exports)
+    except asyncio.CancelledError:
+        # How the processor is stopped; the pool and pipeline are drained above
+        processing_logs.append("Email processor stopped", "info")
+        raise
+    except Exception as e:
+        processing_logs.append(f"Error in email processor: {str(e)}", "error")
+        email_processor_running = False
+        # Without auto-restart the processor stays stopped on every worker;
+        # with it, the coordinator starts it again on its next check
+        await run_io(lambda: start_coordination().processor_failed())
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"status": "running", "service": "Email Parser API"}
 
+# Keyset-paginated work orders. priority and trade take comma-separated
+# values; fields limits the columns returned; pass next_cursor back as cursor
+# (with the same sort and order) for the next page.
 @app.get("/work-orders")
-def get_work_orders():
-    # In a real implementation, this would query the database
-    # For this example, we return sample data
-    return SAMPLE_WORK_ORDERS
+async def get_work_orders(limit: int = 50, cursor: Optional[str] = None, sort: str = "created_at",
+                    order: str = "desc", fields: Optional[str] = None, priority: Optional[str] = None,
+                    trade: Optional[str] = None, customer: Optional[str] = None, source: Optional[str] = None,
+                    email_id: Optional[str] = None, due_after: Optional[str] = None, due_before: Optional[str] = None,
+                    since: Optional[str] = None, until: Optional[str] = None):
+    try:
+        return await run_io(
+            lambda: get_work_order_store(load_config()["db_path"]).query(
+                limit=limit, cursor=cursor, sort=sort, order=order, fields=fields, priority=priority,
+                trade=trade, customer=customer, source=source, email_id=email_id, due_after=due_after,
+                due_before=due_before, since=since, until=until
+            )
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Keyword (FTS5), semantic (vector similarity) or hybrid search over work orders
+@app.get("/work-orders/search")
+async def search_work_orders(q: str, mode: str = "hybrid", limit: int = 20, fields: Optional[str] = None):
+    try:
+        results = await run_io(
+            lambda: get_work_order_search(load_config()).search(q, mode=mode, limit=limit, fields=fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"query": q, "mode": mode, "results": results}
+
+# Orders flagged as possible duplicates of this one when it was saved
+@app.get("/work-orders/{work_order_id}/duplicates")
+async def get_work_order_duplicates(work_order_id: int, fields: Optional[str] = None):
+    try:
+        duplicates = await run_io(
+            lambda: get_work_order_search(load_config()).duplicates(work_order_id, fields=fields))
+        return {"duplicates": duplicates}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Bulk processing: the body is NDJSON (one /process-email style object, or
+# {"raw": "<RFC 822 message>"}, per line) or an mbox file sent as
+# application/mbox. Emails are processed as the body arrives and one NDJSON
+# result line per email is streamed back as each completes (in completion
+# order, with its index in the body), followed by a summary line.
+@app.post("/process-emails")
+async def process_emails(request: Request):
+    config = load_config()
+    # A few body chunks at most wait between the event loop and the feeder
+    chunks = queue.Queue(maxsize=8)
+
+    # Gives up once the response is over, so a client that disconnects
+    # mid-upload does not leave an executor thread blocked on a full queue
+    def put(chunk):
+        while not bulk.stopped():
+            try:
+                chunks.put(chunk, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def pump():
+        try:
+            async for chunk in request.stream():
+                if chunk and not await run_io(put, chunk):
+                    return
+            await run_io(put, None)
+        except Exception as e:
+            await run_io(put, e)
+
+    def body_chunks():
+        while True:
+            try:
+                chunk = chunks.get(timeout=1)
+            except queue.Empty:
+                if bulk.stopped():
+                    return
+                continue
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    # Reads the body while the results stream out; both sides wait on the
+    # I/O executor, not on Starlette's threadpool
+    async def results():
+        pump_task = asyncio.ensure_future(pump())
+        try:
+            async for line in bulk.ndjson_async(run_io):
+                yield line
+        finally:
+            pump_task.cancel()
+
+    bulk = BulkIngest(await run_io(get_bulk_pipeline),
+                      iter_body(body_chunks(), request.headers.get("content-type", ""), config["max_message_size"]),
+                      uuid.uuid4().hex, config["processor"].get("bulk_max_in_flight", 32))
+    return BulkResultStream(results(), media_type="application/x-ndjson", headers={
+        "X-Batch-Id": bulk.batch_id,
+        "X-Accel-Buffering": "no",
+        "Cache-Control": "no-cache"
+    })
 
 @app.post("/process-email")
-def process_email(request: EmailRequest):
+async def process_email(request: EmailRequest):
     try:
-        # In a real implementation, this would process the email using your EmailParser
-        # For this example, we just return a success message
+        config = load_config()
+        spooled = await run_io(spool_manual_attachments, config, request.attachments or [])
+        try:
+            extracted_data = await extract_work_order_async(
+                config, request.subject or "", request.email_content, run_io, run_cpu)
+            work_order_id, stored, duplicates = await run_io(save_manual_work_order, config, extracted_data, spooled)
+        finally:
+            # Whatever was not adopted is discarded
+            discard_attachments(spooled)
         
         # Add log entry
-        processing_logs.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": f"Manually processed email",
-            "status": "success"
-        })
+        processing_logs.append(f"Manually processed email", "success")
         
         return {
             "status": "success",
             "message": "Email processed successfully",
-            "extracted_data": {
-                "title": "Sample Work Order",
-                "priority": "NORMAL",
-                "description": "This is a sample work order extracted from the email",
-                "due_date": "2025-04-20",
-                "customer": "Sample Customer",
-                "location": "Sample Location",
-                "trade": "Sample Trade",
-                "summary": "Sample work order for demonstration purposes.",
-                "action_items": "1. Complete task A\n2. Follow up with customer\n3. Schedule follow-up"
-            }
+            "attachments": [
+                {key: a[key] for key in ("filename", "content_type", "size", "sha256", "duplicate")}
+                for a in stored
+            ],
+            "extracted_data": extracted_data,
+            "work_order_id": work_order_id,
+            "possible_duplicates": duplicates
         }
+    except MessageTooLarge as e:
+        processing_logs.append(f"Error processing email: {str(e)}", "error")
+        raise HTTPException(status_code=413, detail=str(e))
+    except QueueTimeout as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
-        processing_logs.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": f"Error processing email: {str(e)}",
-            "status": "error"
-        })
+        processing_logs.append(f"Error processing email: {str(e)}", "error")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/logs")
+async def list_logs(limit: int = 50, cursor: Optional[str] = None, status: Optional[str] = None,
+                    email_id: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None):
+    try:
+        return await run_io(lambda: init_db().query_logs(limit=limit, cursor=cursor, status=status,
+                                                         email_id=email_id, since=since, until=until))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/logs/rollups")
+async def list_log_rollups(since: Optional[str] = None, until: Optional[str] = None):
+    return await run_io(lambda: init_db().get_rollups(since=since, until=until))
+
 @app.get("/config")
-def get_config():
+async def get_config():
     return load_config()
 
 @app.post("/config")
-def update_config(config: ConfigUpdate):
+async def update_config(config: ConfigUpdate):
     try:
-        save_config(config.dict())
+        await run_io(save_config, config.dict(exclude_none=True))
         return {"status": "success", "message": "Configuration updated successfully"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/start-processor")
-def start_processor(background_tasks: BackgroundTasks):
-    global email_processor_running, emails_processed
+# Run or halt the processor in this process; called by the coordinator (on
+# its own thread) when this worker gains or loses the processor lease
+def run_processor():
+    global email_processor_running, email_processor_task
     
-    if not email_processor_running:
-        email_processor_running = True
-        emails_processed = 0
-        processing_logs.clear()
-        
-        # Start the background task
-        background_tasks.add_task(background_email_processor)
-        
-        return {"status": "success", "message": "Email processor started"}
-    else:
-        return {"status": "info", "message": "Email processor is already running"}
+    if is_processor_running() or event_loop is None:
+        return
+    
+    email_processor_running = True
+    processing_logs.clear()
+    email_processor_done.clear()
+    
+    def start_task():
+        global email_processor_task
+        email_processor_task = event_loop.create_task(background_email_processor())
+        # Also runs for a task cancelled before it ever started
+        email_processor_task.add_done_callback(lambda task: email_processor_done.set())
+    
+    event_loop.call_soon_threadsafe(start_task)
 
-@app.post("/stop-processor")
-def stop_processor():
+def cancel_processor_task():
+    if email_processor_task:
+        email_processor_task.cancel()
+
+# Cancels the task and waits for it to unwind; must not run on the event
+# loop, which the task needs to get there
+def halt_processor():
     global email_processor_running
     
-    if email_processor_running:
-        email_processor_running = False
-        return {"status": "success", "message": "Email processor stopped"}
-    else:
+    email_processor_running = False
+    if ingestor_stop_event:
+        ingestor_stop_event.set()
+    if event_loop is None or email_processor_done.is_set():
+        return
+    try:
+        # Queued after any pending start, so it cancels the current task
+        event_loop.call_soon_threadsafe(cancel_processor_task)
+    except RuntimeError:
+        # The loop is closed, and the task with it
+        email_processor_done.set()
+        return
+    email_processor_done.wait(timeout=30)
+
+def is_processor_running():
+    return not email_processor_done.is_set()
+
+# This worker's counters; /processor-status adds up those of every worker
+def processor_counters():
+    return email_processing.processor_counters(
+        is_processor_running(), last_check_time, processing_pipeline, bulk_pipeline, mailbox_pool)
+
+# Join the processor election (idempotent); every worker does so on startup
+def start_coordination():
+    return get_processor_coordinator(load_config()).start(
+        run_processor, halt_processor, is_processor_running, processor_counters)
+
+# Start and stop requests only record whether the processor should run; the
+# worker holding the lease runs it, whichever worker got the request
+@app.post("/start-processor")
+async def start_processor():
+    if not await run_io(lambda: start_coordination().request_start()):
+        return {"status": "info", "message": "Email processor is already running"}
+    return {"status": "success", "message": "Email processor started"}
+
+@app.post("/stop-processor")
+async def stop_processor():
+    if not await run_io(lambda: start_coordination().request_stop()):
         return {"status": "info", "message": "Email processor is not running"}
+    # Stop at once if it runs here; elsewhere the leader stops on its next check
+    if is_processor_running():
+        await run_io(halt_processor)
+    return {"status": "success", "message": "Email processor stopped"}
+
+# Processor status without the logs, shared by /processor-status and the
+# /processor-events stream
+def processor_status():
+    return email_processing.processor_status(
+        load_config(), start_coordination(), is_processor_running(),
+        processing_pipeline, bulk_pipeline, mailbox_pool)
+
+get_event_broker().status_source = processor_status
+
+# Merge the newest in-memory events with the newest DB logs; both are
+# already newest-first, so only the top 10 of each is ever read
+def latest_logs():
+    try:
+        db_logs = init_db().query_logs(limit=10)["logs"]
+    except Exception as e:
+        print(f"Error getting logs: {str(e)}")
+        db_logs = []
+    return merge_latest(10, processing_logs.latest(10), db_logs)
 
 @app.get("/processor-status")
-def get_processor_status():
-    # Get logs from SQLite database
-    db_logs = get_logs(10)
-    
-    # Combine with in-memory logs
-    combined_logs = processing_logs + db_logs
-    combined_logs.sort(key=lambda x: x["timestamp"], reverse=True)
-    
-    return {
-        "running": email_processor_running,
-        "last_check": last_check_time,
-        "emails_processed": emails_processed,
-        "logs": combined_logs[:10]  # Return last 10 logs
-    }
-
-# Initialize the database on startup
+async def get_processor_status():
+    return await run_io(lambda: dict(processor_status(), logs=latest_logs()))
+
+# Server-Sent Events: a "status" event with the full status on connect and
+# then with just the changed fields, and a "log" event per processing log
+# entry. Log store entries carry their row id as the event id, and a
+# reconnect with Last-Event-ID (or ?last_event_id=) replays the ones written
+# since from the store.
+@app.get("/processor-events")
+async def get_processor_events(request: Request, last_event_id: Optional[str] = None):
+    resume_from = parse_event_id(request.headers.get("last-event-id") or last_event_id)
+    stream = async_event_stream(get_event_broker(), init_db(), resume_from, initial_logs=latest_logs)
+    return StreamingResponse(stream, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.get("/model-status")
+async def model_status():
+    config = load_config()
+    try:
+        status = await run_io(get_model_manager().status)
+        status.update(
+            model_loaded=status["state"] == "loaded",
+            model_path=status["model_path"] or config["model_path"],
+            load_mode=config["model_load"],
+            transformers_available=importlib.util.find_spec("transformers") is not None,
+            chat=get_chat_sessions(config).stats()
+        )
+        return status
+    except Exception as e:
+        print(f"Error in model_status endpoint: {str(e)}")
+        return {
+            "model_loaded": False,
+            "model_path": config["model_path"] if config else "unknown",
+            "transformers_available": False,
+            "error": str(e)
+        }
+
+# Re-point running components when the configuration changes
+def on_config_change(old_config, new_config):
+    get_log_store(new_config["db_path"], new_config.get("log_retention_days"))
+    get_model_manager().on_config_change(old_config, new_config)
+    configure_export_sink(new_config)
+    if pipeline_settings_changed(old_config, new_config):
+        retire_bulk_pipeline()
+    if email_processor_running and ingestor_stop_event and mailbox_settings_changed(old_config, new_config):
+        processing_logs.append("Mailbox settings changed, reconnecting", "info")
+        ingestor_stop_event.set()
+
+config_store.subscribe(on_config_change)
+
+# Initialize the database on startup. The processor task runs on this loop.
 @app.on_event("startup")
-def startup_event():
-    init_db()
+async def startup_event():
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    await run_io(init_db)
+    await run_io(start_coordination)
+    config = load_config()
+    if config["model_load"] == "eager":
+        try:
+            await run_io(get_model_manager().load, config)
+        except Exception as e:
+            print(f"Error loading model: {str(e)}")
+
+# Flush batched log writes before the process exits
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Hand the processor lease to another worker straight away; the loop
+    # keeps running meanwhile so the processor task can unwind
+    await run_io(close_processor_coordinator)
+    await run_io(close_all_stores)
+    shutdown_executors()
 
 if __name__ == "__main__":
     uvicorn.run("app:app", host="0.0.0.0", port=5000, reload=True)
@@ -0,0 +1,249 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+
+# Size cap for blobs kept under temp_dir/store before LRU eviction kicks in
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Text kept of a text attachment for its "text" artifact
+MAX_TEXT_BYTES = 64 * 1024
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_attachment_store(temp_dir, db_path, max_bytes=None):
+    key = (temp_dir, db_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = AttachmentStore(os.path.join(temp_dir, "store"), db_path)
+            _stores[key] = store
+        if max_bytes is not None:
+            store.max_bytes = max_bytes
+        return store
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# get_derived builder for the "text" artifact of a text/* attachment
+def build_text(source_path, output_path):
+    with open(source_path, "rb") as f:
+        data = f.read(MAX_TEXT_BYTES)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(data.decode("utf-8", errors="replace"))
+
+
+# Content-addressed attachment store. Each distinct attachment is kept once
+# under root/<aa>/<sha256>; attachment_refs links it to the emails (by
+# Message-ID) or manual work orders ("work_order_<id>") that carried it, and
+# an owner's references are released once it is no longer kept. Derived
+# artifacts (thumbnails, extracted text) live under root/derived/<kind>/<sha256>
+# so they are computed once per content rather than once per copy.
+class AttachmentStore:
+    def __init__(self, root, db_path, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS attachment_blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                content_type TEXT,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                last_access DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attachment_blobs_eviction
+            ON attachment_blobs (ref_count, last_access)
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS attachment_refs (
+                sha256 TEXT NOT NULL,
+                owner_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (owner_id, sha256, filename)
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_attachment_refs_sha256
+            ON attachment_refs (sha256)
+        ''')
+        self.conn.commit()
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def derived_path(self, sha256, kind):
+        return os.path.join(self.root, "derived", kind, sha256)
+
+    # Move a spooled file into the store under its content hash and link it
+    # to owner_id. Returns {"sha256", "path", "size", "duplicate"}; when
+    # duplicate is True the content was already stored and the spooled copy
+    # has been deleted, so callers can skip re-processing it.
+    def adopt(self, spooled_path, owner_id, filename, content_type=None, sha256=None):
+        sha256 = sha256 or file_sha256(spooled_path)
+        size = os.path.getsize(spooled_path)
+        path = self.blob_path(sha256)
+
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT size FROM attachment_blobs WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            duplicate = row is not None and os.path.exists(path)
+            if duplicate:
+                os.remove(spooled_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(spooled_path, path)
+
+            with self.conn:
+                self.conn.execute('''
+                    INSERT INTO attachment_blobs (sha256, size, content_type)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (sha256) DO UPDATE SET last_access = CURRENT_TIMESTAMP
+                ''', (sha256, size, content_type))
+                self.conn.execute('''
+                    INSERT OR IGNORE INTO attachment_refs (sha256, owner_id, filename)
+                    VALUES (?, ?, ?)
+                ''', (sha256, str(owner_id), filename))
+                self._recount(sha256)
+
+        if not duplicate:
+            self.evict()
+        return {"sha256": sha256, "path": path, "size": size, "duplicate": duplicate}
+
+    # Adopt every attachment dict produced by the MIME parser for one owner
+    def adopt_all(self, attachments, owner_id):
+        return [
+            dict(attachment, **self.adopt(
+                attachment["path"], owner_id, attachment["filename"],
+                attachment.get("content_type"), attachment.get("sha256")))
+            for attachment in attachments
+        ]
+
+    # Drop owner_id's references; unreferenced blobs stay cached until evicted
+    def release(self, owner_id):
+        with self._lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT sha256 FROM attachment_refs WHERE owner_id = ?", (str(owner_id),)
+            ).fetchall()
+            self.conn.execute("DELETE FROM attachment_refs WHERE owner_id = ?", (str(owner_id),))
+            for (sha256,) in rows:
+                self._recount(sha256)
+
+    # Refresh ref_count from attachment_refs so it never drifts, e.g. when a
+    # blob is evicted and later re-adopted while old references remain
+    def _recount(self, sha256):
+        self.conn.execute('''
+            UPDATE attachment_blobs
+            SET ref_count = (SELECT COUNT(*) FROM attachment_refs WHERE sha256 = ?)
+            WHERE sha256 = ?
+        ''', (sha256, sha256))
+
+    def open(self, sha256):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE attachment_blobs SET last_access = CURRENT_TIMESTAMP WHERE sha256 = ?",
+                (sha256,)
+            )
+        return open(self.blob_path(sha256), "rb")
+
+    # Return the path of a derived artifact, building it with
+    # build(source_path, output_path) only if it does not exist yet
+    def get_derived(self, sha256, kind, build):
+        path = self.derived_path(sha256, kind)
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{kind}-", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            build(self.blob_path(sha256), tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    # Text of a stored attachment (None unless it is text/*), extracted once
+    # per content however many emails carry it
+    def text(self, sha256, content_type):
+        if not (content_type or "").lower().startswith("text/"):
+            return None
+        with open(self.get_derived(sha256, "text", build_text), encoding="utf-8") as f:
+            return f.read()
+
+    def total_size(self):
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM attachment_blobs").fetchone()[0]
+
+    # Evict least-recently-used unreferenced blobs until the store fits in
+    # max_bytes. Referenced blobs are never evicted, so while they alone
+    # exceed the cap the store stays over it and says so.
+    def evict(self):
+        with self._lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM attachment_blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            candidates = self.conn.execute('''
+                SELECT sha256, size FROM attachment_blobs
+                WHERE ref_count = 0
+                ORDER BY last_access
+            ''')
+            evicted = []
+            for sha256, size in candidates:
+                if total <= self.max_bytes:
+                    break
+                evicted.append((sha256,))
+                total -= size
+
+            with self.conn:
+                self.conn.executemany("DELETE FROM attachment_blobs WHERE sha256 = ?", evicted)
+            for (sha256,) in evicted:
+                self._remove_files(sha256)
+        if total > self.max_bytes:
+            print(f"Attachment store is over its cap: {total} of {self.max_bytes} bytes are still referenced")
+        return len(evicted)
+
+    def _remove_files(self, sha256):
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(path)
+        derived_root = os.path.join(self.root, "derived")
+        if os.path.isdir(derived_root):
+            for kind in os.listdir(derived_root):
+                derived = os.path.join(derived_root, kind, sha256)
+                if os.path.isdir(derived):
+                    shutil.rmtree(derived)
+                elif os.path.exists(derived):
+                    os.remove(derived)
+
+    def stats(self):
+        with self._lock:
+            blobs, size, refs = self.conn.execute('''
+                SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(ref_count), 0)
+                FROM attachment_blobs
+            ''').fetchone()
+        return {"blobs": blobs, "bytes": size, "references": refs, "max_bytes": self.max_bytes,
+                "over_cap": size > self.max_bytes}
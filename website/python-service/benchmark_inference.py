@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Compare CPU inference modes on a fixed email corpus: throughput, latency,
+# peak memory and how often each mode extracts the same fields as fp32.
+#
+#   python benchmark_inference.py --model-path meta-llama/Llama-3.2-1B
+#   python benchmark_inference.py --modes fp32 int8 --json results.json
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from extraction_engine import (
+    EXTRACTION_FIELDS, INFERENCE_MODES, DEFAULT_MAX_NEW_TOKENS,
+    TransformersBackend, build_prompt, parse_model_output
+)
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_emails.json")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def peak_rss_bytes():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Runs in a fresh process per mode so peak RSS belongs to that mode alone
+def run_mode(model_path, mode, emails, batch_size, max_new_tokens, warmup):
+    backend = TransformersBackend(model_path, max_new_tokens, mode)
+    started = time.monotonic()
+    backend.load()
+    load_seconds = time.monotonic() - started
+
+    prompts = [build_prompt(email.get("subject", ""), email.get("body", "")) for email in emails]
+    for _ in range(warmup):
+        backend.generate_batch(prompts[:1], max_new_tokens=8)
+
+    latencies = []
+    outputs = []
+    generated_tokens = 0
+    total_started = time.monotonic()
+    for start in range(0, len(prompts), batch_size):
+        batch_started = time.monotonic()
+        texts = backend.generate_batch(prompts[start:start + batch_size])
+        latencies.append(time.monotonic() - batch_started)
+        for text in texts:
+            generated_tokens += len(backend.tokenizer(text, add_special_tokens=False)["input_ids"])
+            outputs.append(parse_model_output(text))
+    total_seconds = time.monotonic() - total_started
+
+    return {
+        "mode": mode,
+        "load_seconds": round(load_seconds, 2),
+        "emails": len(prompts),
+        "generated_tokens": generated_tokens,
+        "tokens_per_second": round(generated_tokens / total_seconds, 2) if total_seconds else None,
+        "p50_latency_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_latency_ms": round(percentile(latencies, 95) * 1000, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / (1024 * 1024), 1),
+        "parameter_mb": round(backend.parameter_bytes() / (1024 * 1024), 1),
+        "outputs": outputs
+    }
+
+
+def _normalize(value):
+    if value is None:
+        return None
+    return " ".join(str(value).split()).lower()
+
+
+# Share of emails where a mode extracted the same value as the baseline,
+# per field and over all fields
+def agreement(baseline_outputs, outputs):
+    per_field = {}
+    for field in EXTRACTION_FIELDS:
+        matches = sum(
+            _normalize(base.get(field)) == _normalize(other.get(field))
+            for base, other in zip(baseline_outputs, outputs)
+        )
+        per_field[field] = round(matches / len(outputs), 3) if outputs else None
+    scored = [value for value in per_field.values() if value is not None]
+    overall = round(sum(scored) / len(scored), 3) if scored else None
+    return overall, per_field
+
+
+def print_table(results):
+    columns = [
+        ("mode", "mode"), ("tokens/s", "tokens_per_second"), ("p50 ms", "p50_latency_ms"),
+        ("p95 ms", "p95_latency_ms"), ("peak RSS MB", "peak_rss_mb"), ("weights MB", "parameter_mb"),
+        ("load s", "load_seconds"), ("agreement", "agreement")
+    ]
+    rows = [[str(result.get(key, "")) for _, key in columns] for result in results]
+    widths = [max(len(title), *(len(row[i]) for row in rows)) for i, (title, _) in enumerate(columns)]
+    print("  ".join(title.ljust(width) for (title, _), width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+    for result in results:
+        if result["mode"] != "fp32" and result.get("field_agreement"):
+            fields = ", ".join(f"{field} {value}" for field, value in result["field_agreement"].items())
+            print(f"\n{result['mode']} vs fp32: {fields}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CPU inference modes for work-order extraction')
+    parser.add_argument('--model-path', help='Model to benchmark (defaults to model_path in config.json)')
+    parser.add_argument('--config', default='config.json', help='Configuration file to read model_path from')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='JSON list of {"subject", "body"} emails')
+    parser.add_argument('--modes', nargs='+', choices=INFERENCE_MODES, default=list(INFERENCE_MODES),
+                        help='Inference modes to compare (fp32 is always run as the baseline)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Emails per generate call')
+    parser.add_argument('--max-new-tokens', type=int, default=DEFAULT_MAX_NEW_TOKENS)
+    parser.add_argument('--warmup', type=int, default=1, help='Warmup generations before timing')
+    parser.add_argument('--json', dest='json_path', help='Also write the full results to this file')
+    args = parser.parse_args()
+
+    model_path = args.model_path
+    if not model_path:
+        from config_store import get_config_store
+        model_path = get_config_store(args.config).get()["model_path"]
+
+    with open(args.corpus) as f:
+        emails = json.load(f)
+
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"]
+    print(f"Benchmarking {model_path} on {len(emails)} emails: {', '.join(modes)}")
+
+    results = []
+    # spawn rather than fork: each mode starts from an empty process
+    context = multiprocessing.get_context("spawn")
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_mode, model_path, mode, emails, max(1, args.batch_size),
+                                 args.max_new_tokens, args.warmup).result()
+        print(f"  {mode}: {result['tokens_per_second']} tokens/s, p95 {result['p95_latency_ms']} ms")
+        results.append(result)
+
+    baseline = results[0]["outputs"]
+    for result in results:
+        result["agreement"], result["field_agreement"] = agreement(baseline, result["outputs"])
+
+    print()
+    print_table(results)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"model_path": model_path, "corpus": args.corpus, "results": results}, f, indent=2)
+        print(f"\nFull results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
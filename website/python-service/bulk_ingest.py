@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import queue
+import mailbox
+import threading
+from functools import partial
+
+from mime_stream import spool_base64_attachment, MessageTooLarge, MAX_PART_SIZE, MAX_MESSAGE_SIZE
+from processing_pipeline import parse_email, DEFAULT_TEMP_DIR
+
+READ_CHUNK_SIZE = 64 * 1024
+# Emails of one bulk request being processed or waiting to be streamed back;
+# reading the request body pauses beyond this
+DEFAULT_MAX_IN_FLIGHT = 32
+
+MBOX_CONTENT_TYPES = ("application/mbox", "application/x-mbox")
+
+_DONE = object()
+
+
+def read_chunks(stream, size=READ_CHUNK_SIZE):
+    return iter(lambda: stream.read(size), b"")
+
+
+# Split a byte stream into lines without holding more than one line (capped
+# at max_line bytes) in memory
+def iter_lines(chunks, max_line=MAX_MESSAGE_SIZE):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > max_line:
+            raise MessageTooLarge(f"Line exceeds {max_line} bytes")
+    if buffer:
+        yield bytes(buffer)
+
+
+def _mbox_message(lines):
+    # The blank line before the next "From " separator is not part of the message
+    if lines and not lines[-1].strip():
+        lines = lines[:-1]
+    return b"\n".join(lines) + b"\n"
+
+
+# Messages of an mbox stream: each starts at a "From " line, and ">From "
+# quoting in the body is undone
+def iter_mbox(chunks, max_message_size=MAX_MESSAGE_SIZE):
+    message = None
+    size = 0
+    for line in iter_lines(chunks, max_message_size):
+        if line.startswith(b"From "):
+            if message:
+                yield _mbox_message(message)
+            message, size = [], 0
+            continue
+        if message is None:
+            continue
+        if line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+            line = line[1:]
+        size += len(line) + 1
+        if size > max_message_size:
+            raise MessageTooLarge(f"Message exceeds {max_message_size} bytes")
+        message.append(line)
+    if message:
+        yield _mbox_message(message)
+
+
+# (raw message bytes or JSON item) per email of a request body: NDJSON with
+# one object per line, or an mbox file. Lines that are not valid JSON come
+# through as the ValueError describing them, so they get their own result.
+def iter_body(chunks, content_type="", max_message_size=MAX_MESSAGE_SIZE):
+    if content_type.split(";")[0].strip().lower() in MBOX_CONTENT_TYPES:
+        yield from iter_mbox(chunks, max_message_size)
+        return
+    for line in iter_lines(chunks, max_message_size):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("Each line must be a JSON object")
+        except ValueError as e:
+            yield ValueError(f"Invalid NDJSON line: {str(e)}")
+            continue
+        yield item
+
+
+# Messages of a local mbox file or Maildir directory, one at a time
+def iter_path(path, max_message_size=MAX_MESSAGE_SIZE):
+    if os.path.isdir(path):
+        maildir = mailbox.Maildir(path, factory=None, create=False)
+        for key in maildir.iterkeys():
+            yield maildir.get_bytes(key)
+        return
+    with open(path, "rb") as f:
+        yield from iter_mbox(read_chunks(f), max_message_size)
+
+
+# Pipeline parse stage for bulk items. Raw messages (mbox entries, or a JSON
+# item's "raw") go through the regular MIME parser; JSON items shaped like a
+# /process-email request are taken as they are.
+def parse_bulk_item(uid, item, temp_dir=DEFAULT_TEMP_DIR, max_part_size=MAX_PART_SIZE,
+                    max_message_size=MAX_MESSAGE_SIZE):
+    if isinstance(item, dict) and item.get("raw") is not None:
+        item = item["raw"].encode("utf-8")
+    if isinstance(item, (bytes, bytearray)):
+        return parse_email(uid, bytes(item), temp_dir, max_part_size, max_message_size)
+
+    body = item.get("email_content") or ""
+    if len(body) > max_message_size:
+        raise MessageTooLarge(f"Message exceeds {max_message_size} bytes")
+    attachments = []
+    try:
+        for attachment in item.get("attachments") or []:
+            attachments.append(spool_base64_attachment(attachment, temp_dir, max_part_size).to_dict())
+    except Exception:
+        for attachment in attachments:
+            os.remove(attachment["path"])
+        raise
+    return {
+        "uid": uid,
+        "email_id": item.get("message_id") or item.get("email_id") or f"bulk_{uid}",
+        "subject": item.get("subject") or "",
+        "sender": item.get("sender") or "",
+        "body": body,
+        "attachments": attachments
+    }
+
+
+def bulk_parser_for(config):
+    return partial(
+        parse_bulk_item,
+        temp_dir=config["temp_dir"],
+        max_part_size=config["max_attachment_size"],
+        max_message_size=config["max_message_size"]
+    )
+
+
+# One bulk request: emails from `items` are fed into the pipeline on a
+# feeder thread while results() yields one result per email as each one
+# completes, followed by a summary. At most max_in_flight emails are between
+# "read from the request" and "written to the response" at any time, so
+# neither side is ever buffered whole.
+class BulkIngest:
+    def __init__(self, pipeline, items, batch_id, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.pipeline = pipeline
+        self.items = items
+        self.batch_id = batch_id
+        self._slots = threading.Semaphore(max(1, max_in_flight))
+        self._results = queue.Queue()
+        self._stopped = threading.Event()
+
+    def _feed(self):
+        submitted = 0
+        try:
+            for index, item in enumerate(self.items):
+                self._slots.acquire()
+                if self._stopped.is_set():
+                    break
+                if isinstance(item, Exception):
+                    self._results.put({"index": index, "status": "error", "error": str(item)})
+                    submitted += 1
+                    continue
+                try:
+                    self.pipeline.submit(
+                        f"{self.batch_id}-{index}", item,
+                        callback=partial(self._on_done, index))
+                except Exception as e:
+                    # e.g. the pipeline was retired after a configuration change
+                    self._results.put({"index": index, "status": "error", "error": str(e)})
+                # Either way exactly one result comes back for this item
+                submitted += 1
+        except Exception as e:
+            # The body itself is unusable past this point (e.g. an oversized
+            # line or a dropped upload); report it and finish what was read
+            submitted += 1
+            self._results.put({"index": None, "status": "error", "error": f"Error reading request: {str(e)}"})
+        finally:
+            self._results.put((_DONE, submitted))
+
+    def _on_done(self, index, result, error):
+        if error is not None:
+            self._results.put({"index": index, "status": "error", "error": str(error)})
+        else:
+            self._results.put(dict(result, index=index, status="success"))
+
+    def results(self):
+        started = time.monotonic()
+        feeder = threading.Thread(target=self._feed, name=f"bulk-feeder-{self.batch_id[:8]}")
+        feeder.daemon = True
+        feeder.start()
+
+        total = None
+        received = succeeded = 0
+        try:
+            while total is None or received < total:
+                result = self._results.get()
+                if isinstance(result, tuple) and result[0] is _DONE:
+                    total = result[1]
+                    continue
+                received += 1
+                succeeded += result["status"] == "success"
+                self._slots.release()
+                yield result
+            yield {"summary": {
+                "batch_id": self.batch_id,
+                "total": received,
+                "succeeded": succeeded,
+                "failed": received - succeeded,
+                "seconds": round(time.monotonic() - started, 3)
+            }}
+        finally:
+            # Client went away: stop reading; emails already queued still finish
+            self.stop()
+
+    # True once the response has finished or the client has gone away
+    def stopped(self):
+        return self._stopped.is_set()
+
+    # Stop reading more emails; those already queued still finish
+    def stop(self):
+        self._stopped.set()
+        self._slots.release()
+
+    def ndjson(self):
+        for result in self.results():
+            yield json.dumps(result, default=str) + "\n"
+
+    # ndjson() for an asyncio server: each line is waited for through
+    # run_io (on its executor), never on the event loop
+    async def ndjson_async(self, run_io):
+        lines = self.ndjson()
+        try:
+            while True:
+                line = await run_io(next, lines, None)
+                if line is None:
+                    return
+                yield line
+        finally:
+            # The generator may still be running on the executor, so it is
+            # stopped through the flag rather than closed
+            self.stop()
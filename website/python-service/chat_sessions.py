@@ -0,0 +1,277 @@
+import time
+import threading
+from collections import OrderedDict
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are the concierge assistant for a property maintenance company. "
+    "Help with work orders, scheduling and maintenance questions. Be concise."
+)
+DEFAULT_MAX_NEW_TOKENS = 512
+DEFAULT_KV_BUDGET_MB = 512
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+DEFAULT_MAX_SESSIONS = 1000
+
+# Once a conversation has more messages than this, the oldest half is
+# dropped; the next turn then re-encodes once instead of on every turn
+MAX_HISTORY_MESSAGES = 40
+
+SWEEP_INTERVAL = 60
+
+
+def _cache_tensors(cache):
+    if hasattr(cache, "layers"):
+        for layer in cache.layers:
+            yield getattr(layer, "keys", None)
+            yield getattr(layer, "values", None)
+    elif hasattr(cache, "key_cache"):
+        yield from cache.key_cache
+        yield from cache.value_cache
+    else:
+        for layer in cache:
+            yield from layer
+
+
+def kv_cache_bytes(cache):
+    if cache is None:
+        return 0
+    return sum(t.numel() * t.element_size() for t in _cache_tensors(cache) if t is not None)
+
+
+def _common_prefix(a, b):
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+def _encode_conversation(tokenizer, messages):
+    if getattr(tokenizer, "chat_template", None):
+        return list(tokenizer.apply_chat_template(messages, add_generation_prompt=True))
+    # Base models without a chat template get a plain transcript
+    text = "".join(f"{m['role'].capitalize()}: {m['content']}\n" for m in messages) + "Assistant:"
+    return tokenizer(text)["input_ids"]
+
+
+# TextIteratorStreamer decodes on the generation thread; route that through
+# the backend's tokenizer lock like every other tokenizer call
+class _LockedDecoder:
+    def __init__(self, tokenizer, lock):
+        self.tokenizer = tokenizer
+        self.lock = lock
+
+    def decode(self, *args, **kwargs):
+        with self.lock:
+            return self.tokenizer.decode(*args, **kwargs)
+
+
+class ChatSession:
+    def __init__(self, session_id, system_prompt):
+        self.session_id = session_id
+        self.messages = [{"role": "system", "content": system_prompt}]
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        # KV cache for the token ids in cached_ids, valid only for `backend`
+        self.kv_cache = None
+        self.cached_ids = []
+        self.backend = None
+        self.kv_bytes = 0
+
+    def drop_cache(self):
+        self.kv_cache = None
+        self.cached_ids = []
+        self.backend = None
+        self.kv_bytes = 0
+
+    def trim_history(self):
+        history = self.messages[1:]
+        if len(history) > MAX_HISTORY_MESSAGES:
+            self.messages = self.messages[:1] + history[-(MAX_HISTORY_MESSAGES // 2):]
+
+
+# Per-conversation state for /chat. Each session keeps its message history
+# and the model's KV cache for it, so a follow-up turn only encodes the new
+# message. KV caches are the expensive part: when they exceed the memory
+# budget the least recently used are dropped (the history is kept and simply
+# re-encoded next turn); sessions idle longer than idle_timeout are removed.
+class ChatSessionStore:
+    def __init__(self, kv_budget_bytes=DEFAULT_KV_BUDGET_MB * 1024 * 1024,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.kv_budget_bytes = kv_budget_bytes
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stats = {"turns": 0, "prompt_tokens": 0, "reused_tokens": 0, "kv_evictions": 0, "expired": 0}
+
+    def get(self, session_id, system_prompt=DEFAULT_SYSTEM_PROMPT):
+        with self._lock:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="chat-session-sweeper")
+                self._sweeper.daemon = True
+                self._sweeper.start()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ChatSession(session_id, system_prompt)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            return session
+
+    # Stream the reply to `message` piece by piece as the model produces it.
+    # Closing the generator (e.g. the client disconnected) stops generation.
+    # `context` (e.g. retrieved work orders) is put in front of the message and
+    # stays in the history, so later turns can still refer to it and the KV
+    # cache keeps matching the conversation.
+    def stream_reply(self, backend, session, message, max_new_tokens=DEFAULT_MAX_NEW_TOKENS, context=None):
+        import torch
+        from transformers import TextIteratorStreamer, StoppingCriteriaList
+
+        with session.lock:
+            content = f"{context}\n\n{message}" if context else message
+            session.messages.append({"role": "user", "content": content})
+            try:
+                session.trim_history()
+                with backend.tokenizer_lock:
+                    input_ids = _encode_conversation(backend.tokenizer, session.messages)
+            except Exception:
+                # Never answered, so it must not stay in later turns
+                session.messages.pop()
+                raise
+
+            # Reuse the KV cache for the part of the conversation it already
+            # covers; at least one token has to go through the model
+            cache = session.kv_cache if session.backend is backend else None
+            reused = min(_common_prefix(session.cached_ids, input_ids), len(input_ids) - 1)
+            if cache is not None and reused > 0 and hasattr(cache, "crop"):
+                cache.crop(reused)
+            else:
+                cache, reused = None, 0
+            session.drop_cache()
+
+            stop = threading.Event()
+            streamer = TextIteratorStreamer(
+                _LockedDecoder(backend.tokenizer, backend.tokenizer_lock),
+                skip_prompt=True, skip_special_tokens=True)
+            ids = torch.tensor([input_ids])
+            result = {}
+
+            def generate():
+                try:
+                    with torch.inference_mode():
+                        result["output"] = backend.model.generate(
+                            input_ids=ids,
+                            attention_mask=torch.ones_like(ids),
+                            past_key_values=cache,
+                            max_new_tokens=max_new_tokens,
+                            do_sample=False,
+                            streamer=streamer,
+                            stopping_criteria=StoppingCriteriaList([
+                                lambda input_ids, scores, **kwargs: torch.full(
+                                    (input_ids.shape[0],), stop.is_set(), dtype=torch.bool)
+                            ]),
+                            return_dict_in_generate=True,
+                            pad_token_id=backend.tokenizer.pad_token_id
+                        )
+                except Exception as e:
+                    result["error"] = e
+                    streamer.end()
+
+            thread = threading.Thread(target=generate, name=f"chat-{session.session_id[:8]}")
+            thread.daemon = True
+            thread.start()
+
+            reply = []
+            try:
+                for text in streamer:
+                    reply.append(text)
+                    yield text
+            finally:
+                stop.set()
+                thread.join()
+                if "error" in result and not reply:
+                    # The turn never happened
+                    session.messages.pop()
+                else:
+                    # A partial reply is still part of the conversation
+                    session.messages.append({"role": "assistant", "content": "".join(reply)})
+                output = result.get("output")
+                new_cache = getattr(output, "past_key_values", None)
+                if new_cache is not None and hasattr(new_cache, "get_seq_length"):
+                    session.kv_cache = new_cache
+                    session.cached_ids = output.sequences[0].tolist()[:new_cache.get_seq_length()]
+                    session.backend = backend
+                    session.kv_bytes = kv_cache_bytes(new_cache)
+                session.last_used = time.monotonic()
+                with self._lock:
+                    self._stats["turns"] += 1
+                    self._stats["prompt_tokens"] += len(input_ids)
+                    self._stats["reused_tokens"] += reused
+                self.enforce_budget()
+
+        # Not swallowed: with nothing streamed yet the client gets a 500, and
+        # a reply cut short ends with a broken stream instead of a clean one
+        if "error" in result:
+            print(f"Error generating chat reply: {str(result['error'])}")
+            raise result["error"]
+
+    def enforce_budget(self):
+        now = time.monotonic()
+        with self._lock:
+            for session_id, session in list(self._sessions.items()):
+                if now - session.last_used > self.idle_timeout and not session.lock.locked():
+                    del self._sessions[session_id]
+                    self._stats["expired"] += 1
+
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._stats["expired"] += 1
+
+            total = sum(session.kv_bytes for session in self._sessions.values())
+            # Oldest first; sessions mid-turn are skipped
+            for session in list(self._sessions.values()):
+                if total <= self.kv_budget_bytes:
+                    break
+                if session.kv_bytes and session.lock.acquire(blocking=False):
+                    try:
+                        total -= session.kv_bytes
+                        session.drop_cache()
+                        self._stats["kv_evictions"] += 1
+                    finally:
+                        session.lock.release()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            try:
+                self.enforce_budget()
+            except Exception as e:
+                print(f"Error sweeping chat sessions: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+            stats["kv_bytes"] = sum(session.kv_bytes for session in self._sessions.values())
+        stats["kv_budget_bytes"] = self.kv_budget_bytes
+        stats["reuse_rate"] = round(stats["reused_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chat_sessions(config):
+    global _store
+    settings = config.get("chat", {})
+    with _store_lock:
+        if _store is None:
+            _store = ChatSessionStore()
+        _store.kv_budget_bytes = settings.get("kv_budget_mb", DEFAULT_KV_BUDGET_MB) * 1024 * 1024
+        _store.idle_timeout = settings.get("idle_timeout_seconds", DEFAULT_IDLE_TIMEOUT)
+        _store.max_sessions = settings.get("max_sessions", DEFAULT_MAX_SESSIONS)
+        return _store
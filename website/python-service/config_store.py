@@ -0,0 +1,370 @@
+import os
+import json
+import copy
+import time
+import queue
+import tempfile
+import threading
+
+CONFIG_FILE = "config.json"
+
+# Minimum number of seconds between mtime checks, so hot paths such as
+# /processor-status polls never touch the filesystem more than once a second
+CHECK_INTERVAL = 1.0
+
+# Default Configuration
+DEFAULT_CONFIG = {
+    # IMAP Configuration
+    "imap": {
+        "server": "localhost",
+        "port": 993,
+        "username": os.getenv('IMAP_USER') or "espocrm@localhost",
+        "password": os.getenv('IMAP_PASS') or "",
+        "folder": "INBOX",
+        "use_ssl": True,
+        # "new" only ingests mail arriving after the first start, "all" backfills the folder
+        "initial_sync": "new",
+        # Per mailbox: at most max_per_minute messages taken a minute (0 for
+        # no limit), and fetching pauses while max_in_flight are unprocessed
+        "max_per_minute": 0,
+        "max_in_flight": 20
+    },
+    # More mailboxes to ingest, e.g. regional inboxes and shared folders.
+    # Each entry overrides the "imap" settings above (just {"folder": ...}
+    # for another folder of the same account) and may have a "name" for
+    # /processor-status; when empty only the "imap" mailbox is ingested.
+    "mailboxes": [],
+
+    # XAMPP MySQL Configuration
+    "xampp_mysql": {
+        "host": "localhost",
+        "user": os.getenv('MYSQL_USER') or "root",
+        "password": os.getenv('MYSQL_PASS') or "",
+        "database": "work_orders",
+        "port": 3306
+    },
+
+    # CRM Configuration
+    "crm": {
+        "base_url": "http://localhost/espocrm",
+        "username": os.getenv('CRM_USER') or "",
+        "password": os.getenv('CRM_PASS') or "",
+        "import_endpoint": "/api/v1/Import",
+        # Takes precedence over username/password when set
+        "api_key": os.getenv('CRM_API_KEY') or "",
+        "entity_type": "Case",
+        # Work orders per import request, and requests in flight at once
+        "batch_size": 50,
+        "max_concurrency": 4,
+        "timeout_seconds": 30,
+        # Retries use jittered exponential backoff; across all batches they
+        # are limited to retry_budget_ratio per request sent
+        "max_retries": 4,
+        "retry_backoff_seconds": 0.5,
+        "retry_budget_ratio": 0.2
+    },
+
+    # Email processing pipeline
+    "processor": {
+        "workers": 4,
+        "queue_size": 100,
+        # Processes for the CPU-heavy parse stage; 0 parses on the worker threads
+        "cpu_workers": 0,
+        # Processes the mailboxes are sharded across, each holding one IMAP
+        # connection per mailbox of its shard; 0 fetches on threads instead
+        "mailbox_processes": 2,
+        # Exactly one process sharing db_path runs the processor: the holder
+        # of a lease it renews every coordination interval. Another worker
+        # takes over once the lease has not been renewed for the TTL.
+        "lease_ttl_seconds": 15,
+        "coordination_interval_seconds": 2,
+        # Every fetched email is journaled until exported, so a restart
+        # resumes unfinished ones; an email in flight during max_attempts
+        # restarts is given up on. Finished entries are kept for dedup.
+        "max_attempts": 3,
+        "journal_retention_days": 30
+    },
+
+    # AI Configuration
+    "model_path": "meta-llama/Llama-3.2-1B",
+    # CPU inference precision: "fp32", "bf16" or "int8" (dynamic quantization
+    # of Linear layers). Compare them with benchmark_inference.py.
+    "inference_mode": "fp32",
+    # "lazy" loads the model on the first extraction, "eager" at startup
+    # (before gunicorn forks its workers, when preload_app is on)
+    "model_load": "lazy",
+    "extraction": {
+        # Concurrent requests are micro-batched: a batch runs once it is full
+        # or its oldest request has waited max_wait_ms
+        "max_batch_size": 8,
+        "max_wait_ms": 25,
+        "max_new_tokens": 256,
+        "timeout_seconds": 120,
+        # Rule-based fields at or above this confidence skip the model
+        "confidence_threshold": 0.8
+    },
+    # Extraction results memoized by normalized email content: an in-memory
+    # LRU of memory_entries in front of up to max_entries rows in db_path
+    "extraction_cache": {
+        "memory_entries": 1024,
+        "max_entries": 100000,
+        "ttl_seconds": 7 * 24 * 3600
+    },
+
+    # Admission control for the shared model: at most max_concurrent
+    # extraction batches or chat generations run at once, processor before
+    # manual /process-email before chat. Requests waiting longer than their
+    # queue timeout get a 429 (null waits indefinitely).
+    "scheduler": {
+        "max_concurrent": 1,
+        "queue_timeout_seconds": {"processor": None, "manual": 30, "chat": 10}
+    },
+    # /chat sessions keep the model's KV cache between turns; caches beyond
+    # kv_budget_mb are dropped least recently used first
+    "chat": {
+        "system_prompt": (
+            "You are the concierge assistant for a property maintenance company. "
+            "Help with work orders, scheduling and maintenance questions. Be concise."
+        ),
+        "max_new_tokens": 512,
+        "kv_budget_mb": 512,
+        "idle_timeout_seconds": 30 * 60,
+        "max_sessions": 1000
+    },
+
+    # The asyncio FastAPI service (app.py): blocking SQLite and file I/O
+    # runs on io_threads threads of its own, and CPU-bound work (the
+    # rule-based extraction tier) in cpu_workers processes (0: on the I/O
+    # threads). Model inference stays on the engine's batch thread.
+    # max_event_streams caps /processor-events clients per worker of the
+    # Flask service, where each one holds a gunicorn thread (see
+    # gunicorn.conf.py); more are turned away until one disconnects.
+    "service": {
+        "io_threads": 16,
+        "cpu_workers": 2,
+        "max_event_streams": 16
+    },
+
+    # Work order search. Similarity uses feature hashing unless
+    # embedding_model names a Hugging Face sentence encoder (e.g.
+    # "sentence-transformers/all-MiniLM-L6-v2"); the thresholds are cosine
+    # similarities and depend on which one is used. New orders at or above
+    # duplicate_threshold are flagged as possible duplicates, and /chat adds
+    # up to chat_context_results matching orders to the prompt.
+    "search": {
+        "embedding_model": None,
+        "dimensions": 256,
+        "duplicate_threshold": 0.6,
+        "chat_context_results": 3,
+        "chat_min_similarity": 0.35
+    },
+
+    # Export of saved work orders to csv_path, the xampp_mysql database and/or
+    # the CRM (bulk imports, see "crm").
+    # Rows are flushed in batches of batch_size or every flush_interval_seconds;
+    # a batch that fails max_retries times is kept in a dead-letter table and
+    # retried every dead_letter_retry_seconds. mysql_driver "sqlite" writes the
+    # MySQL tables to sqlite_path instead, for local testing.
+    "export": {
+        "csv": True,
+        "csv_max_bytes": 64 * 1024 * 1024,
+        "mysql": False,
+        "mysql_driver": "mysql",
+        "crm": False,
+        "sqlite_path": "/var/data/export_test.db",
+        "table": "work_orders",
+        "pool_size": 4,
+        "batch_size": 100,
+        "flush_interval_seconds": 2.0,
+        "max_retries": 3,
+        "retry_backoff_seconds": 1.0,
+        "dead_letter_retry_seconds": 300
+    },
+
+    # File Handling
+    "csv_path": "/var/data/work_orders.csv",
+    "temp_dir": "/tmp/email_attachments",
+    "max_attachment_size": 25 * 1024 * 1024,
+    "max_message_size": 50 * 1024 * 1024,
+    # Deduplicated attachments are kept under temp_dir/store up to this size
+    "attachment_store_max_bytes": 2 * 1024 * 1024 * 1024,
+
+    # Database
+    "db_path": "/var/data/processing_logs.db",
+    "log_retention_days": 30,
+}
+
+
+def validate_config(new_config):
+    if not isinstance(new_config, dict):
+        raise ValueError("Configuration must be a JSON object")
+
+    # Fill in anything missing from the defaults, so config files written by
+    # older versions keep working as new settings are added
+    merged = copy.deepcopy(DEFAULT_CONFIG)
+    for key, value in new_config.items():
+        if isinstance(merged.get(key), dict):
+            if not isinstance(value, dict):
+                raise ValueError(f"'{key}' must be an object")
+            merged[key].update(value)
+        else:
+            merged[key] = value
+
+    for section, port_key in (("imap", "port"), ("xampp_mysql", "port")):
+        try:
+            merged[section][port_key] = int(merged[section][port_key])
+        except (TypeError, ValueError):
+            raise ValueError(f"'{section}.{port_key}' must be an integer")
+
+    if not isinstance(merged["mailboxes"], list) or not all(isinstance(m, dict) for m in merged["mailboxes"]):
+        raise ValueError("'mailboxes' must be a list of objects")
+    for index, mailbox in enumerate(merged["mailboxes"]):
+        if "port" in mailbox:
+            try:
+                mailbox["port"] = int(mailbox["port"])
+            except (TypeError, ValueError):
+                raise ValueError(f"'mailboxes[{index}].port' must be an integer")
+
+    for key in ("model_path", "csv_path", "temp_dir", "db_path"):
+        if not isinstance(merged[key], str) or not merged[key]:
+            raise ValueError(f"'{key}' must be a non-empty string")
+
+    if merged["inference_mode"] not in ("fp32", "bf16", "int8"):
+        raise ValueError("'inference_mode' must be 'fp32', 'bf16' or 'int8'")
+
+    if merged["model_load"] not in ("lazy", "eager"):
+        raise ValueError("'model_load' must be 'lazy' or 'eager'")
+
+    retention = merged.get("log_retention_days")
+    if retention is not None and (not isinstance(retention, int) or retention < 0):
+        raise ValueError("'log_retention_days' must be a non-negative integer")
+
+    return merged
+
+
+# Config is read on hot paths (including an asyncio event loop), so change
+# notifications run on a notifier thread in the order the changes happened,
+# never on the thread whose get() or save() noticed the change.
+class ConfigStore:
+    def __init__(self, path=CONFIG_FILE, create_if_missing=False, check_interval=CHECK_INTERVAL):
+        self.path = path
+        self.create_if_missing = create_if_missing
+        self.check_interval = check_interval
+
+        self._lock = threading.RLock()
+        self._config = None
+        self._signature = None
+        self._next_check = 0.0
+        self._subscribers = []
+        self._notifications = queue.Queue()
+        self._notifier = None
+
+    # Returns the cached config. Callers must treat it as read-only; use
+    # save() to change it so subscribers are notified.
+    def get(self):
+        now = time.monotonic()
+        if self._config is not None and now < self._next_check:
+            return self._config
+
+        with self._lock:
+            if self._config is None or now >= self._next_check:
+                self._next_check = now + self.check_interval
+                if self._config is None or self._file_signature() != self._signature:
+                    self._reload()
+            return self._config
+
+    def save(self, new_config):
+        with self._lock:
+            validated = validate_config(new_config)
+            self._write_atomic(validated)
+            self._apply(validated)
+            return self._config
+
+    def subscribe(self, callback):
+        # callback(old_config, new_config) runs on the notifier thread after
+        # every change, whether it came from save() or from an edit to the
+        # file on disk
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _reload(self):
+        if not os.path.exists(self.path):
+            loaded = copy.deepcopy(DEFAULT_CONFIG)
+            if self.create_if_missing:
+                self._write_atomic(loaded)
+            self._apply(loaded)
+            return
+
+        try:
+            with open(self.path, "r") as f:
+                loaded = validate_config(json.load(f))
+        except (OSError, ValueError) as e:
+            # Keep serving the last good config if the file is mid-edit or broken
+            print(f"Error loading configuration from {self.path}: {str(e)}")
+            if self._config is None:
+                self._apply(copy.deepcopy(DEFAULT_CONFIG))
+            self._signature = self._file_signature()
+            return
+
+        self._apply(loaded)
+
+    def _apply(self, new_config):
+        old_config = self._config
+        self._config = new_config
+        self._signature = self._file_signature()
+        if old_config is not None and old_config != new_config:
+            self._notifications.put((old_config, new_config))
+            # Started lazily, and again in a forked worker (threads are not
+            # inherited)
+            if self._notifier is None or not self._notifier.is_alive():
+                self._notifier = threading.Thread(target=self._notify_loop, name="config-notifier")
+                self._notifier.daemon = True
+                self._notifier.start()
+
+    def _notify_loop(self):
+        while True:
+            old_config, new_config = self._notifications.get()
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for callback in subscribers:
+                try:
+                    callback(old_config, new_config)
+                except Exception as e:
+                    print(f"Error in configuration subscriber: {str(e)}")
+            self._notifications.task_done()
+
+    def _write_atomic(self, new_config):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(new_config, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_config_store(path=CONFIG_FILE, create_if_missing=False):
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = ConfigStore(path, create_if_missing=create_if_missing)
+            _stores[path] = store
+        elif create_if_missing:
+            store.create_if_missing = True
+        return store
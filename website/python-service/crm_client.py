@@ -0,0 +1,283 @@
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_ENTITY_TYPE = "Case"
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 30
+# Retries allowed per first attempt, on average; see RetryBudget
+DEFAULT_RETRY_BUDGET_RATIO = 0.2
+# Enough tokens that an isolated failure is always retried
+RETRY_BUDGET_MIN_TOKENS = 10
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Latency samples and recent batches kept for stats
+SAMPLE_WINDOW = 500
+RECENT_BATCHES = 20
+
+# Work order fields mapped to CRM attributes
+CRM_FIELDS = {
+    "title": "name",
+    "description": "description",
+    "priority": "priority",
+    "due_date": "dueDate",
+    "customer": "accountName",
+    "location": "address",
+    "trade": "type",
+    "summary": "summary",
+    "action_items": "actionItems",
+    "email_id": "emailId",
+    "work_order_id": "externalId"
+}
+
+
+class CrmError(Exception):
+    def __init__(self, message, status=None, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def _retry_after_seconds(value):
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+# Caps retries at a fraction of first attempts (plus a small floor), so when
+# the CRM is down the client backs off instead of multiplying its own load.
+# Every first attempt deposits `ratio` tokens and every retry spends one.
+class RetryBudget:
+    def __init__(self, ratio=DEFAULT_RETRY_BUDGET_RATIO, min_tokens=RETRY_BUDGET_MIN_TOKENS):
+        self.ratio = ratio
+        self.min_tokens = min_tokens
+        self._tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.min_tokens + 100 * self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def tokens(self):
+        with self._lock:
+            return round(self._tokens, 2)
+
+
+# Bulk work-order import into EspoCRM. One keep-alive requests.Session (with
+# a connection pool sized to the concurrency cap) is shared by all batches;
+# rows are grouped into payloads of batch_size and at most max_concurrency
+# are in flight. Each payload carries an idempotency key derived from its
+# content, so a retry after a timeout cannot create the records twice.
+class CrmClient:
+    name = "crm"
+    # ExportSink leaves retries to the client
+    handles_retries = True
+
+    def __init__(self, settings):
+        self.settings = dict(settings)
+        self.base_url = settings["base_url"].rstrip("/")
+        self.import_url = self.base_url + "/" + settings.get("import_endpoint", "/api/v1/Import").lstrip("/")
+        self.entity_type = settings.get("entity_type", DEFAULT_ENTITY_TYPE)
+        self.batch_size = max(1, settings.get("batch_size", DEFAULT_BATCH_SIZE))
+        self.max_concurrency = max(1, settings.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        self.timeout = settings.get("timeout_seconds", DEFAULT_TIMEOUT)
+        self.max_retries = settings.get("max_retries", DEFAULT_MAX_RETRIES)
+        self.retry_backoff = settings.get("retry_backoff_seconds", DEFAULT_RETRY_BACKOFF)
+        self.budget = RetryBudget(settings.get("retry_budget_ratio", DEFAULT_RETRY_BUDGET_RATIO))
+
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=SAMPLE_WINDOW)
+        self._recent = deque(maxlen=RECENT_BATCHES)
+        self._stats = {"batches": 0, "records": 0, "failed_batches": 0, "retries": 0, "budget_exhausted": 0}
+
+    def signature(self):
+        return (self.name,) + tuple(sorted((key, json.dumps(value)) for key, value in self.settings.items()))
+
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # Retries are handled here, not by urllib3
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+                if self.settings.get("api_key"):
+                    session.headers["X-Api-Key"] = self.settings["api_key"]
+                elif self.settings.get("username"):
+                    session.auth = (self.settings["username"], self.settings.get("password", ""))
+                self._session = session
+            return self._session
+
+    # Records are matched on externalId (the work order id) and updated if
+    # they exist, so importing a work order again never creates a second one
+    def build_payload(self, rows):
+        records = [
+            {attribute: row.get(field) for field, attribute in CRM_FIELDS.items() if row.get(field) is not None}
+            for row in rows
+        ]
+        return {
+            "entityType": self.entity_type,
+            "action": "createAndUpdate",
+            "updateBy": [CRM_FIELDS["work_order_id"]],
+            "attributeList": list(CRM_FIELDS.values()),
+            "records": records
+        }
+
+    # Derived from the work orders and their content, in work_order_id
+    # order and without the per-submit exported_at, so a row re-submitted
+    # after a restart or replayed from the dead-letter table gets the same key
+    @staticmethod
+    def idempotency_key(rows):
+        digest = hashlib.sha256()
+        for row in sorted(rows, key=lambda row: row["work_order_id"]):
+            content = {column: value for column, value in row.items() if column != "exported_at"}
+            digest.update(json.dumps(content, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _post(self, payload, key):
+        import requests
+        try:
+            response = self._get_session().post(
+                self.import_url, data=json.dumps(payload, default=str),
+                headers={"Idempotency-Key": key}, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise CrmError(f"CRM request failed: {str(e)}")
+        if response.status_code in RETRYABLE_STATUSES:
+            raise CrmError(f"CRM returned {response.status_code}", response.status_code,
+                           retry_after=_retry_after_seconds(response.headers.get("Retry-After")))
+        if response.status_code >= 400:
+            raise CrmError(f"CRM rejected the import ({response.status_code}): {response.text[:200]}",
+                           response.status_code, retryable=False)
+        return response
+
+    def _send_batch(self, rows):
+        payload = self.build_payload(rows)
+        key = self.idempotency_key(rows)
+        self.budget.deposit()
+        started = time.monotonic()
+        attempt = 0
+        error = None
+        try:
+            while True:
+                try:
+                    response = self._post(payload, key)
+                    error = None
+                    return response.status_code
+                except CrmError as e:
+                    error = e
+                    if not e.retryable or attempt >= self.max_retries:
+                        raise
+                    if not self.budget.withdraw():
+                        with self._stats_lock:
+                            self._stats["budget_exhausted"] += 1
+                        raise
+                attempt += 1
+                with self._stats_lock:
+                    self._stats["retries"] += 1
+                # Full jitter, but never sooner than the server asked for
+                delay = random.uniform(0, min(MAX_RETRY_BACKOFF, self.retry_backoff * (2 ** attempt)))
+                time.sleep(max(delay, error.retry_after or 0))
+        finally:
+            elapsed = time.monotonic() - started
+            with self._stats_lock:
+                self._latencies.append(elapsed)
+                self._recent.append({
+                    "records": len(rows),
+                    "attempts": attempt + 1,
+                    "latency_ms": round(elapsed * 1000, 1),
+                    "idempotency_key": key[:16],
+                    "error": str(error) if error is not None else None
+                })
+
+    # Import the rows, raising the first batch error once every batch has
+    # finished, with the rows of every failed batch in its failed_rows.
+    def write(self, rows):
+        # One record per work order (the newest row wins), so batches line up
+        # however the rows were submitted
+        latest = {}
+        for row in rows:
+            latest[row["work_order_id"]] = row
+        rows = sorted(latest.values(), key=lambda row: row["work_order_id"])
+        batches = [rows[start:start + self.batch_size] for start in range(0, len(rows), self.batch_size)]
+        if len(batches) > 1 and self.max_concurrency > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="crm-import")
+            futures = [self._executor.submit(self._send_batch, batch) for batch in batches]
+            outcomes = []
+            for future in futures:
+                try:
+                    future.result()
+                    outcomes.append(None)
+                except Exception as e:
+                    outcomes.append(e)
+        else:
+            outcomes = []
+            for batch in batches:
+                try:
+                    self._send_batch(batch)
+                    outcomes.append(None)
+                except Exception as e:
+                    outcomes.append(e)
+
+        with self._stats_lock:
+            for batch, outcome in zip(batches, outcomes):
+                self._stats["batches"] += 1
+                if outcome is None:
+                    self._stats["records"] += len(batch)
+                else:
+                    self._stats["failed_batches"] += 1
+        errors = [outcome for outcome in outcomes if outcome is not None]
+        if errors:
+            error = errors[0]
+            error.failed_rows = [
+                row for batch, outcome in zip(batches, outcomes) if outcome is not None for row in batch]
+            raise error
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            latencies = list(self._latencies)
+            stats["recent_batches"] = list(self._recent)
+        stats["retry_budget_tokens"] = self.budget.tokens()
+        stats["batch_latency_ms_p50"] = round(_percentile(latencies, 50) * 1000, 1) if latencies else None
+        stats["batch_latency_ms_p95"] = round(_percentile(latencies, 95) * 1000, 1) if latencies else None
+        return stats
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -1,298 +1,384 @@
 #!/usr/bin/env python3
-import os
-import email
-import sqlite3
 import json
-import csv
 import time
 import argparse
+import importlib.util
 import sys
+import uuid
 import threading
 from datetime import datetime
 from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 
+import email_processing
+from bulk_ingest import BulkIngest, bulk_parser_for, iter_body, iter_path, read_chunks
+from chat_sessions import get_chat_sessions
+from config_store import get_config_store
+from email_processing import (create_pipeline, extract_work_order, spool_manual_attachments,
+                              save_manual_work_order, pipeline_settings_changed)
+from export_sink import get_export_sink, configure_export_sink
+from log_store import get_log_store
+from mailbox_pool import MailboxPool, mailbox_settings_changed, RESTART_DELAY
+from model_manager import get_model_manager
+from model_scheduler import get_model_scheduler, QueueTimeout
+from mime_stream import MessageTooLarge
+from message_journal import get_message_journal
+from processing_pipeline import discard_attachments
+from processor_coordinator import get_processor_coordinator
+from processor_events import get_event_broker, event_stream, parse_event_id
+from work_order_search import get_work_order_search
+from work_order_store import get_work_order_store
+
 # Create Flask app
 app = Flask(__name__)
 # Enable CORS for all routes and origins
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
-# Global variables
+# Global variables. The processor runs in whichever process holds the
+# processor lease (see processor_coordinator); these describe this process.
 processor_running = False
 processor_thread = None
-config = None
-model_loaded = False  # Track if the model is loaded
+last_check_time = None
+ingestor_stop_event = None
+processing_pipeline = None
+mailbox_pool = None
+bulk_pipeline = None
+bulk_pipeline_lock = threading.Lock()
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Email Parser Script')
 parser.add_argument('--auto-restart', action='store_true', help='Auto restart on failure')
 parser.add_argument('--port', type=int, default=5000, help='Port for the Flask server')
-args = parser.parse_args()
-
-# Default Configuration
-DEFAULT_CONFIG = {
-    # IMAP Configuration
-    "imap": {
-        "server": "localhost",
-        "port": 993,
-        "username": os.getenv('IMAP_USER') or "espocrm@localhost",
-        "password": os.getenv('IMAP_PASS') or "",
-        "folder": "INBOX"
-    },
-    
-    # XAMPP MySQL Configuration
-    "xampp_mysql": {
-        "host": "localhost",
-        "user": os.getenv('MYSQL_USER') or "root",
-        "password": os.getenv('MYSQL_PASS') or "",
-        "database": "work_orders",
-        "port": 3306
-    },
-    
-    # CRM Configuration
-    "crm": {  
-        "base_url": "http://localhost/espocrm",
-        "username": os.getenv('CRM_USER') or "",
-        "password": os.getenv('CRM_PASS') or "",
-        "import_endpoint": "/api/v1/Import"
-    },
-    
-    # AI Configuration
-    "model_path": "meta-llama/Llama-3.2-1B",
-    
-    # File Handling
-    "csv_path": "/var/data/work_orders.csv",
-    "temp_dir": "/tmp/email_attachments",
-    
-    # Database
-    "db_path": "/var/data/processing_logs.db",
-}
-
-# Sample work orders for demonstration
-SAMPLE_WORK_ORDERS = [
-    {
-        "id": 1,
-        "title": "Fix Leaking Roof",
-        "priority": "HIGH",
-        "description": "Customer reported water damage from roof leak in master bedroom",
-        "due_date": "2025-04-10",
-        "customer": "John Smith",
-        "location": "123 Main St, Anytown, USA",
-        "trade": "Roofing",
-        "created_at": "2025-04-03T12:30:00",
-        "summary": "Urgent roof repair needed due to water damage in master bedroom.",
-        "action_items": "1. Inspect roof\n2. Repair damaged shingles\n3. Check for interior water damage"
-    },
-    {
-        "id": 2,
-        "title": "HVAC Maintenance",
-        "priority": "NORMAL",
-        "description": "Annual HVAC system check and filter replacement",
-        "due_date": "2025-04-15",
-        "customer": "Jane Doe",
-        "location": "456 Oak Ave, Somewhere, USA",
-        "trade": "HVAC",
-        "created_at": "2025-04-02T09:15:00",
-        "summary": "Routine annual HVAC maintenance and filter replacement.",
-        "action_items": "1. Replace air filters\n2. Clean condenser coils\n3. Check refrigerant levels"
-    }
-]
+parser.add_argument('--backfill', metavar='PATH',
+                    help='Process every message of a local mbox file or Maildir directory and exit')
+# Defaults when imported (e.g. by gunicorn, whose command line this is not);
+# main() parses the real arguments
+args = parser.parse_args([])
+
+# Shared, mtime-cached configuration (written with defaults if missing)
+config_store = get_config_store("config.json", create_if_missing=True)
 
 class Logger:
     def __init__(self):
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(config['db_path']), exist_ok=True)
-        
-        self.conn = sqlite3.connect(config['db_path'])
-        self._init_db()
-        
-    def _init_db(self):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS processing_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                email_id TEXT,
-                status TEXT,
-                message TEXT
-            )
-        ''')
-        self.conn.commit()
-        
+        # All Logger instances share one long-lived, batched store per db_path
+        config = load_config()
+        self.store = get_log_store(config['db_path'], config.get('log_retention_days'))
+
     def log_success(self, email_id):
-        self._log(email_id, "SUCCESS", "")
-        
+        self.store.log_success(email_id)
+
     def log_error(self, email_id, message):
-        self._log(email_id, "ERROR", message)
-        
-    def _log(self, email_id, status, message):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO processing_logs (email_id, status, message)
-            VALUES (?, ?, ?)
-        ''', (str(email_id), status, message))
-        self.conn.commit()
-        
+        self.store.log_error(email_id, message)
+
     def get_logs(self, limit=10):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            SELECT timestamp, email_id, status, message 
-            FROM processing_logs 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (limit,))
-        
-        logs = []
-        for row in cursor.fetchall():
-            timestamp, email_id, status, message = row
-            logs.append({
-                "timestamp": timestamp,
-                "message": f"Email {email_id}: {message}" if message else f"Email {email_id} processed",
-                "status": "success" if status == "SUCCESS" else "error"
-            })
-            
-        return logs
+        return self.store.get_logs(limit)
+
+    def query_logs(self, **filters):
+        return self.store.query_logs(**filters)
+
+    def get_rollups(self, since=None, until=None):
+        return self.store.get_rollups(since=since, until=until)
+
+# Progress messages of the processing pipelines go to the console; their
+# results and failures are recorded in the log store
+def log_message(message, level='info'):
+    print(message)
 
 def email_processor():
-    global processor_running
+    global processor_running, ingestor_stop_event, processing_pipeline, mailbox_pool
     
     print(f"Starting email processor at {datetime.now().isoformat()}")
     
     # Initialize logger
     logger = Logger()
     
-    emails_processed = 0
+    def log_mailbox_event(level, message):
+        print(message)
+        if level == 'error':
+            logger.log_error("imap", message)
+    
+    def mark_check(mailbox):
+        global last_check_time
+        last_check_time = datetime.now().isoformat()
+    
+    def flush_exports():
+        get_export_sink(load_config()).flush()
+    
+    # The mailbox pool feeds a bounded queue; submit() blocks while it is
+    # full. Every message is journaled first, so a crash loses or repeats
+    # nothing.
+    journal = get_message_journal(load_config())
+    pipeline = create_pipeline(load_config(), log_message, journal=journal).start()
+    processing_pipeline = pipeline
+    journal.start_checkpoints(flush_exports)
     
     try:
-        # Simulate email processing
         print("Starting email processing loop...")
-        iteration = 0
         
+        # Each pass shards the mailboxes across a pool of processes holding
+        # one IMAP connection per mailbox; a configuration change stops the
+        # pool so the next pass starts one with the new settings
         while processor_running:
-            print(f"Processing iteration {iteration+1}...")
-            time.sleep(2)  # Simulate work
-            
-            # Simulate finding emails
-            email_count = iteration % 3  # 0, 1, or 2 emails
-            if email_count > 0:
-                print(f"Found {email_count} new email(s)")
-                
-                # Simulate processing each email
-                for j in range(email_count):
-                    email_id = f"email_{iteration}_{j}"
-                    print(f"Processing email {email_id}...")
-                    time.sleep(1)  # Simulate processing
-                    
-                    # Simulate success or failure
-                    if (iteration + j) % 4 != 0:  # 75% success rate
-                        print(f"Successfully processed email {email_id}")
-                        logger.log_success(email_id)
-                        emails_processed += 1
-                    else:
-                        error_msg = f"Failed to process email {email_id}"
-                        print(error_msg)
-                        logger.log_error(email_id, error_msg)
-            else:
-                print("No new emails found")
-            
-            print(f"Iteration {iteration+1} complete")
-            iteration += 1
-            time.sleep(3)  # Wait between iterations
-            
+            pool = MailboxPool(load_config(), pipeline.submit, log=log_mailbox_event, on_check=mark_check)
+            mailbox_pool = pool
+            ingestor_stop_event = pool.stop_event
+            # halt_processor() may have run before the event was published
             if not processor_running:
                 break
+            try:
+                pool.start()
+                pool.supervise()
+            finally:
+                # Everything fetched is processed and checkpointed first, so
+                # the next pool resumes only what a crash left unfinished
+                pool.stop()
+                journal.checkpoint(flush_exports)
+            if pool.crashed:
+                time.sleep(RESTART_DELAY)
         
         print("Email processor stopped")
         
     except Exception as e:
         print(f"Error in email processor: {str(e)}")
         processor_running = False
-        if args.auto_restart:
-            print("Auto-restart enabled, restarting in 5 seconds...")
-            time.sleep(5)
-            start_processor()
+        # Without auto-restart the processor stays stopped on every worker;
+        # with it, the coordinator starts it again on its next check
+        get_coordinator().processor_failed()
+    finally:
+        # Let the workers finish whatever was already fetched
+        pipeline.stop()
+        journal.stop_checkpoints(flush_exports)
 
-def start_processor():
+# Run or halt the processor in this process; called by the coordinator when
+# this worker gains or loses the processor lease
+def run_processor():
     global processor_running, processor_thread
     
-    if processor_running:
-        return {"status": "info", "message": "Email processor is already running"}
+    if is_processor_running():
+        return
     
     processor_running = True
     processor_thread = threading.Thread(target=email_processor)
     processor_thread.daemon = True
     processor_thread.start()
+
+def halt_processor():
+    global processor_running
     
+    processor_running = False
+    if ingestor_stop_event:
+        ingestor_stop_event.set()
+    if processor_thread:
+        processor_thread.join(timeout=30)
+
+def is_processor_running():
+    return processor_thread is not None and processor_thread.is_alive()
+
+# This worker's counters; /processor-status adds up those of every worker
+def processor_counters():
+    return email_processing.processor_counters(
+        is_processor_running(), last_check_time, processing_pipeline, bulk_pipeline, mailbox_pool)
+
+# Join the processor election (idempotent). Gunicorn workers call this as
+# soon as they start, so a processor that was running resumes after a
+# restart without waiting for a request.
+def start_coordination():
+    return get_processor_coordinator(load_config()).start(
+        run_processor, halt_processor, is_processor_running, processor_counters)
+
+def get_coordinator():
+    return start_coordination()
+
+# Start and stop requests only record whether the processor should run; the
+# worker holding the lease runs it, whichever worker got the request
+def start_processor(auto_restart=None):
+    if auto_restart is None:
+        auto_restart = args.auto_restart
+    if not get_coordinator().request_start(auto_restart):
+        return {"status": "info", "message": "Email processor is already running"}
     return {"status": "success", "message": "Email processor started"}
 
 def stop_processor():
-    global processor_running, processor_thread
-    
-    if not processor_running:
+    if not get_coordinator().request_stop():
         return {"status": "info", "message": "Email processor is not running"}
-    
-    processor_running = False
-    if processor_thread:
-        processor_thread.join(timeout=5)
-    
+    # Stop at once if it runs here; elsewhere the leader stops on its next check
+    if is_processor_running():
+        halt_processor()
     return {"status": "success", "message": "Email processor stopped"}
 
+# Shared by every /process-emails request, apart from the IMAP processor's
+# pipeline so a backfill never waits behind (or holds up) live mail
+def get_bulk_pipeline():
+    global bulk_pipeline
+    with bulk_pipeline_lock:
+        if bulk_pipeline is None:
+            config = load_config()
+            bulk_pipeline = create_pipeline(
+                config, log_message, source='bulk', parse=bulk_parser_for(config)).start()
+        return bulk_pipeline
+
+# The bulk pipeline binds temp_dir and the size limits; after a change the
+# next request gets a new one. Emails already queued on the old one still
+# finish, while requests still feeding it get an error for the rest.
+def retire_bulk_pipeline():
+    global bulk_pipeline
+    with bulk_pipeline_lock:
+        retired, bulk_pipeline = bulk_pipeline, None
+    if retired:
+        threading.Thread(target=retired.stop, name="bulk-pipeline-retire", daemon=True).start()
+
+# Process every message of a local mbox file or Maildir directory without
+# starting the server, printing one JSON result line per email
+def backfill(path):
+    config = load_config()
+    pipeline = create_pipeline(config, log_message, source='backfill', parse=bulk_parser_for(config)).start()
+    bulk = BulkIngest(pipeline, iter_path(path, config['max_message_size']), uuid.uuid4().hex,
+                      config['processor'].get('bulk_max_in_flight', 32))
+    try:
+        for result in bulk.results():
+            print(json.dumps(result, default=str), flush=True)
+    finally:
+        pipeline.stop()
+        get_export_sink(config).flush()
+
 def load_config():
-    global config
-    
-    config_file = "config.json"
-    if os.path.exists(config_file):
-        with open(config_file, "r") as f:
-            config = json.load(f)
-    else:
-        config = DEFAULT_CONFIG
-        with open(config_file, "w") as f:
-            json.dump(config, f, indent=2)
-    
-    return config
+    return config_store.get()
 
 def save_config(new_config):
-    global config
-    
-    config = new_config
-    with open("config.json", "w") as f:
-        json.dump(config, f, indent=2)
-    
+    config_store.save(new_config)
     return {"status": "success", "message": "Configuration saved successfully"}
 
+def load_model(config, warmup=True):
+    try:
+        print(f"Loading model from {config['model_path']}...")
+        get_model_manager().load(config, warmup=warmup)
+        print("Model loaded successfully")
+    except Exception as e:
+        print(f"Error loading model: {str(e)}")
+
+# Push configuration changes to running components instead of having them
+# re-read config.json
+def on_config_change(old_config, new_config):
+    get_log_store(new_config['db_path'], new_config.get('log_retention_days'))
+    # A new model_path is loaded in the background and swapped in when ready
+    get_model_manager().on_config_change(old_config, new_config)
+    # Export targets pick up new csv_path / MySQL settings
+    configure_export_sink(new_config)
+    # So do the bulk pipeline's temp_dir and size limits
+    if pipeline_settings_changed(old_config, new_config):
+        retire_bulk_pipeline()
+    if processor_running and ingestor_stop_event and mailbox_settings_changed(old_config, new_config):
+        print("Mailbox settings changed, reconnecting email processor")
+        ingestor_stop_event.set()
+
+config_store.subscribe(on_config_change)
+
 # Flask routes
 @app.route('/')
 def index():
     return jsonify({"status": "running", "service": "Email Parser API"})
 
+# Keyset-paginated work orders. priority and trade take comma-separated
+# values; fields limits the columns returned; pass next_cursor back as cursor
+# (with the same sort and order) for the next page.
 @app.route('/work-orders')
 def get_work_orders():
-    return jsonify(SAMPLE_WORK_ORDERS)
+    try:
+        return jsonify(get_work_order_store(load_config()['db_path']).query(
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            sort=request.args.get('sort', 'created_at'),
+            order=request.args.get('order', 'desc'),
+            fields=request.args.get('fields'),
+            priority=request.args.get('priority'),
+            trade=request.args.get('trade'),
+            customer=request.args.get('customer'),
+            source=request.args.get('source'),
+            email_id=request.args.get('email_id'),
+            due_after=request.args.get('due_after'),
+            due_before=request.args.get('due_before'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        ))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+# Keyword (FTS5), semantic (vector similarity) or hybrid search over work orders
+@app.route('/work-orders/search')
+def search_work_orders():
+    query = request.args.get('q', '')
+    mode = request.args.get('mode', 'hybrid')
+    try:
+        results = get_work_order_search(load_config()).search(
+            query, mode=mode, limit=request.args.get('limit', 20, type=int), fields=request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"query": query, "mode": mode, "results": results})
+
+# Orders flagged as possible duplicates of this one when it was saved
+@app.route('/work-orders/<int:work_order_id>/duplicates')
+def get_work_order_duplicates(work_order_id):
+    try:
+        duplicates = get_work_order_search(load_config()).duplicates(work_order_id, fields=request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"duplicates": duplicates})
+
+# Bulk processing: the body is NDJSON (one /process-email style object, or
+# {"raw": "<RFC 822 message>"}, per line) or an mbox file sent as
+# application/mbox. Emails are processed as the body arrives and one NDJSON
+# result line per email is streamed back as each completes (in completion
+# order, with its index in the body), followed by a summary line.
+@app.route('/process-emails', methods=['POST'])
+def process_emails():
+    config = load_config()
+    items = iter_body(read_chunks(request.stream), request.content_type or '', config['max_message_size'])
+    bulk = BulkIngest(get_bulk_pipeline(), items, uuid.uuid4().hex,
+                      config['processor'].get('bulk_max_in_flight', 32))
+    response = Response(stream_with_context(bulk.ndjson()), mimetype='application/x-ndjson')
+    response.headers['X-Batch-Id'] = bulk.batch_id
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/process-email', methods=['POST'])
 def process_email():
     try:
         data = request.json
+        config = load_config()
+        
+        spooled = spool_manual_attachments(config, data.get('attachments') or [])
+        try:
+            extracted_data = extract_work_order(config, data.get('subject', ''), data.get('email_content', ''))
+            work_order_id, stored, duplicates = save_manual_work_order(config, extracted_data, spooled)
+        finally:
+            # Whatever was not adopted is discarded
+            discard_attachments(spooled)
         
-        # Simulate processing an email
         logger = Logger()
         logger.log_success("manual_email")
         
         return jsonify({
             "status": "success",
             "message": "Email processed successfully",
-            "extracted_data": {
-                "title": "Sample Work Order",
-                "priority": "NORMAL",
-                "description": "This is a sample work order extracted from the email",
-                "due_date": "2025-04-20",
-                "customer": "Sample Customer",
-                "location": "Sample Location",
-                "trade": "Sample Trade",
-                "summary": "Sample work order for demonstration purposes.",
-                "action_items": "1. Complete task A\n2. Follow up with customer\n3. Schedule follow-up"
-            }
+            "attachments": [
+                {key: a[key] for key in ("filename", "content_type", "size", "sha256", "duplicate")}
+                for a in stored
+            ],
+            "extracted_data": extracted_data,
+            "work_order_id": work_order_id,
+            "possible_duplicates": duplicates
         })
+    except MessageTooLarge as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Error processing email: {str(e)}"
+        }), 413
+    except QueueTimeout as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 429, {"Retry-After": str(e.retry_after)}
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -302,11 +388,16 @@ def process_email():
 @app.route('/config', methods=['GET', 'POST'])
 def handle_config():
     if request.method == 'GET':
-        return jsonify(config)
+        return jsonify(load_config())
     else:
         try:
             new_config = request.json
             return jsonify(save_config(new_config))
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Invalid configuration: {str(e)}"
+            }), 400
         except Exception as e:
             return jsonify({
                 "status": "error",
@@ -315,63 +406,139 @@ def handle_config():
 
 @app.route('/start-processor', methods=['POST'])
 def handle_start_processor():
-    return jsonify(start_processor())
+    body = request.get_json(silent=True) or {}
+    return jsonify(start_processor(body.get('autoRestart')))
 
 @app.route('/stop-processor', methods=['POST'])
 def handle_stop_processor():
     return jsonify(stop_processor())
 
+# Processor status without the logs, shared by /processor-status and the
+# /processor-events stream
+def processor_status():
+    return email_processing.processor_status(
+        load_config(), get_coordinator(), is_processor_running(),
+        processing_pipeline, bulk_pipeline, mailbox_pool)
+
+get_event_broker().status_source = processor_status
+
 @app.route('/processor-status')
 def get_processor_status():
-    logger = Logger()
-    logs = logger.get_logs(10)
-    
-    return jsonify({
-        "running": processor_running,
-        "last_check": datetime.now().isoformat() if processor_running else None,
-        "emails_processed": 0,  # This would be tracked in a real implementation
-        "logs": logs
-    })
-
-# New endpoint for chat functionality
+    status = processor_status()
+    status["logs"] = Logger().get_logs(10)
+    return jsonify(status)
+
+# Server-Sent Events: a "status" event with the full status on connect and
+# then with just the changed fields, and a "log" event per processing log
+# entry (its id is the log row id). A reconnect with Last-Event-ID (or
+# ?last_event_id=) replays the entries written since from the log store.
+@app.route('/processor-events')
+def get_processor_events():
+    # Each stream holds one of this worker's threads while it is open, so
+    # their number is capped to keep threads for other requests
+    max_streams = load_config()['service'].get('max_event_streams', 16)
+    if get_event_broker().subscriber_count() >= max_streams:
+        return jsonify({"error": "Too many open event streams, try again later"}), 503, {"Retry-After": "5"}
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    response = Response(event_stream(get_event_broker(), Logger().store, last_event_id),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/logs')
+def get_logs_page():
+    try:
+        page = Logger().query_logs(
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+            status=request.args.get('status'),
+            email_id=request.args.get('email_id'),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+        return jsonify(page)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route('/logs/rollups')
+def get_log_rollups():
+    return jsonify(Logger().get_rollups(
+        since=request.args.get('since'),
+        until=request.args.get('until')
+    ))
+
+# Chat with the model, streaming the reply as plain text while it is being
+# generated. Turns sharing a session_id reuse the conversation's KV cache.
 @app.route('/chat', methods=['POST'])
 def chat():
+    data = request.json
+    if not data or 'message' not in data:
+        return jsonify({"error": "No message provided"}), 400
+
+    config = load_config()
     try:
-        data = request.json
-        if not data or 'message' not in data:
-            return jsonify({"error": "No message provided"}), 400
-        
-        user_message = data['message']
-        
-        def generate():
-            # Simulate streaming response
-            response_parts = [
-                "I'm processing your message: '",
-                user_message,
-                "'. This is a simulated response from the Flask server. ",
-                "In a real implementation, this would connect to the Llama model. ",
-                "You can customize this response based on your actual implementation."
-            ]
-            
-            for part in response_parts:
-                time.sleep(0.5)  # Simulate processing time
-                yield part
-            
-        return Response(stream_with_context(generate()), mimetype='text/plain')
-    
+        backend = get_model_manager().backend(config)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        print(f"Error loading model for chat: {str(e)}")
+        return jsonify({"error": f"Model is not available: {str(e)}"}), 503
+
+    # Chat has the lowest priority on the model; when extraction keeps it
+    # busy past the queue timeout the client is asked to retry
+    try:
+        slot = get_model_scheduler(config).slot('chat')
+    except QueueTimeout as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+
+    # Until the response owns it, the slot is released on any error here
+    try:
+        settings = config['chat']
+        sessions = get_chat_sessions(config)
+        session = sessions.get(data.get('session_id') or str(uuid.uuid4()), settings['system_prompt'])
+
+        # Ground the answer in matching work orders; chat still works without
+        context_ids, context = [], None
+        search_settings = config['search']
+        if search_settings.get('chat_context_results'):
+            try:
+                context_ids, context = get_work_order_search(config).chat_context(
+                    data['message'], search_settings['chat_context_results'],
+                    search_settings['chat_min_similarity'])
+            except Exception as e:
+                print(f"Error retrieving chat context: {str(e)}")
+
+        response = Response(
+            stream_with_context(sessions.stream_reply(
+                backend, session, data['message'], settings['max_new_tokens'], context=context)),
+            mimetype='text/plain'
+        )
+    except BaseException:
+        slot.release()
+        raise
+    # Held for the whole generation, released when the stream ends or the
+    # client goes away
+    response.call_on_close(slot.release)
+    response.headers['X-Session-Id'] = session.session_id
+    response.headers['X-Context-Work-Orders'] = ','.join(str(i) for i in context_ids)
+    # Proxies must pass tokens through as they arrive
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # New endpoint to check model status
 @app.route('/model-status', methods=['GET'])
 def model_status():
-    # Simulate model status
+    config = load_config()
     try:
-        return jsonify({
-            "model_loaded": model_loaded,
-            "model_path": config['model_path'],
-            "transformers_available": True
-        })
+        status = get_model_manager().status()
+        status.update(
+            model_loaded=status["state"] == "loaded",
+            model_path=status["model_path"] or config['model_path'],
+            load_mode=config['model_load'],
+            transformers_available=importlib.util.find_spec("transformers") is not None,
+            chat=get_chat_sessions(config).stats()
+        )
+        return jsonify(status)
     except Exception as e:
         print(f"Error in model_status endpoint: {str(e)}")
         return jsonify({
@@ -382,26 +549,25 @@ def model_status():
         })
 
 def main():
-    global config, model_loaded
+    global args
+    args = parser.parse_args()
     
+    if args.backfill:
+        backfill(args.backfill)
+        return
+
     print(f"Starting email parser script at {datetime.now().isoformat()}")
     print(f"Auto-restart: {'Enabled' if args.auto_restart else 'Disabled'}")
     
     # Load configuration
     config = load_config()
     
-    # Simulate model loading (would actually load the model in a real implementation)
-    try:
-        print(f"Simulating model loading from {config['model_path']}...")
-        # In a real implementation, you would load the model here
-        # model = load_model(config['model_path'])
-        model_loaded = True
-        print("Model loaded successfully")
-    except Exception as e:
-        print(f"Error loading model: {str(e)}")
-        model_loaded = False
+    if config['model_load'] == 'eager':
+        load_model(config)
     
     # Start Flask server
+    start_coordination()
+    
     print(f"Starting Flask server on port {args.port}")
     app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
 
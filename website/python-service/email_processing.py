@@ -0,0 +1,241 @@
+from functools import partial
+
+from attachment_store import get_attachment_store
+from export_sink import get_export_sink
+from extraction_cache import get_extraction_cache, cache_key
+from fast_extract import get_tiered_extractor
+from log_store import get_log_store
+from mime_stream import spool_base64_attachment
+from message_journal import get_message_journal, parse_journaled, EXPORTED
+from model_scheduler import get_model_scheduler
+from processing_pipeline import ProcessingPipeline, email_parser_for, discard_attachments
+from work_order_search import get_work_order_search
+from work_order_store import get_work_order_store
+
+# Email to work order processing shared by the Flask (email_parser) and
+# FastAPI (app) services. Each service passes its current config and a
+# log(message, level) callback for its own console or event feed; results
+# and failures are recorded in the log store here.
+
+
+# workload sets the scheduling priority: "processor" or "manual"
+def extract_work_order(config, subject, body, sender="", workload="manual"):
+    # Rules fill what they can; only the remaining fields go to the model,
+    # where concurrent callers are batched together
+    extractor = get_tiered_extractor(config)
+    # Redeliveries, reply-all copies and retries of the same request share
+    # one cached result
+    key = cache_key(subject, body, sender, config["model_path"], extractor.threshold, config["inference_mode"])
+    return get_extraction_cache(config).get_or_compute(
+        key,
+        lambda: extractor.extract(subject, body, sender, config, timeout=config["extraction"].get("timeout_seconds"),
+                                  workload=workload)
+    )
+
+
+# extract_work_order for an event loop: the cache and rule tier run off the
+# loop (through run_io and run_cpu) and the model's answer is awaited
+# without holding a thread
+async def extract_work_order_async(config, subject, body, run_io, run_cpu, sender="", workload="manual"):
+    extractor = get_tiered_extractor(config)
+    key = cache_key(subject, body, sender, config["model_path"], extractor.threshold, config["inference_mode"])
+    cache = await run_io(get_extraction_cache, config)
+    return await cache.get_or_compute_async(
+        key,
+        lambda: extractor.extract_async(subject, body, sender, config,
+                                        timeout=config["extraction"].get("timeout_seconds"),
+                                        workload=workload, run_io=run_io, run_cpu=run_cpu),
+        run_io
+    )
+
+
+# Index a newly saved work order for search and return the existing orders it
+# looks like. The order is already saved, so a search failure is only logged.
+def find_duplicates(search, work_order_id, work_order):
+    try:
+        return search.index_work_order(work_order_id, work_order)
+    except Exception as e:
+        print(f"Error indexing work order {work_order_id}: {str(e)}")
+        return []
+
+
+# The email body as the extractor sees it: text attachments (notes, CSV
+# exports) often carry the work order details, so their text is appended.
+# It comes from the attachment store, so a file resent with every reply is
+# decoded once.
+def body_with_attachments(attachment_store, body, attachments):
+    parts = [body or ""]
+    for attachment in attachments:
+        try:
+            text = attachment_store.text(attachment["sha256"], attachment.get("content_type"))
+        except Exception as e:
+            print(f"Error reading attachment {attachment.get('filename')}: {str(e)}")
+            continue
+        if text and text.strip():
+            parts.append(f"Attachment {attachment.get('filename')}:\n{text.strip()}")
+    return "\n\n".join(parts)
+
+
+# Decode manually submitted attachments straight to temp_dir
+def spool_manual_attachments(config, attachments):
+    return {"attachments": [
+        spool_base64_attachment(attachment, config["temp_dir"], config["max_attachment_size"]).to_dict()
+        for attachment in attachments
+    ]}
+
+
+# Save a manually submitted work order and store its attachments by content
+# hash, so resent files are kept once, referenced by the order they came
+# with. Returns (work_order_id, stored attachments, possible duplicates).
+def save_manual_work_order(config, extracted_data, spooled):
+    work_order_id = get_work_order_store(config["db_path"]).add(extracted_data, source="manual")
+    attachment_store = get_attachment_store(
+        config["temp_dir"], config["db_path"], config["attachment_store_max_bytes"])
+    stored = attachment_store.adopt_all(spooled["attachments"], f"work_order_{work_order_id}")
+    get_export_sink(config).submit(work_order_id, extracted_data, source="manual")
+    return work_order_id, stored, find_duplicates(get_work_order_search(config), work_order_id, extracted_data)
+
+
+# `source` tags the saved work orders; `parse` replaces the raw-message
+# parser (bulk requests also take JSON items). With a message journal, items
+# are (entry_id, uid, raw_message) and each stage is recorded as it completes.
+def create_pipeline(config, log, source="processor", parse=None, journal=None):
+    settings = config["processor"]
+
+    attachment_store = get_attachment_store(
+        config["temp_dir"], config["db_path"], config["attachment_store_max_bytes"])
+    work_orders = get_work_order_store(config["db_path"])
+    search = get_work_order_search(config)
+    export_sink = get_export_sink(config)
+    # Shared with every other user of db_path; writes are batched
+    log_store = get_log_store(config["db_path"], config.get("log_retention_days"))
+
+    def handle_email(parsed):
+        journal_id = parsed.get("journal_id")
+        entry = None
+        if parsed.get("resumed"):
+            # Extracted before a restart: only the export stage is left
+            entry = journal.get(journal_id)
+            parsed["email_id"] = entry["message_id"]
+            parsed["extracted_data"] = entry["extracted_data"]
+            log(f"Resuming email {parsed['email_id']} after a restart...", "info")
+        else:
+            log(f"Processing email {parsed['email_id']} ({parsed['subject']})...", "info")
+            try:
+                attachments = attachment_store.adopt_all(parsed["attachments"], parsed["email_id"])
+            except Exception:
+                discard_attachments(parsed)
+                raise
+            # Attachments flagged as duplicate were already handled for an earlier email
+            parsed["attachments"] = attachments
+            extracted = None
+            if journal_id is not None:
+                journal.mark_parsed(journal_id, parsed["email_id"])
+                # A redelivered copy of an email reuses its extraction
+                extracted = journal.find_extracted(parsed["email_id"], journal_id)
+            if extracted is None:
+                body = body_with_attachments(attachment_store, parsed["body"], attachments)
+                extracted = extract_work_order(config, parsed["subject"], body, parsed["sender"], workload="processor")
+            parsed["extracted_data"] = extracted
+            if journal_id is not None:
+                journal.mark_extracted(journal_id, extracted)
+        if entry is not None and entry["state"] == EXPORTED:
+            # Its row reached the export targets before the restart
+            work_order_id = entry["work_order_id"]
+        else:
+            # Saving is an upsert on email_id, so repeating it after a restart is harmless
+            work_order_id = work_orders.add(parsed["extracted_data"], email_id=parsed["email_id"], source=source)
+            # The entry counts as exported once the sink has written the row;
+            # until then a restart submits it again (the targets are
+            # idempotent on work_order_id)
+            on_written = None
+            if journal_id is not None:
+                on_written = partial(journal.mark_exported, journal_id, work_order_id)
+            export_sink.submit(work_order_id, parsed["extracted_data"], email_id=parsed["email_id"],
+                               source=source, on_written=on_written)
+        duplicates = find_duplicates(search, work_order_id, parsed["extracted_data"])
+        if duplicates:
+            log(f"Email {parsed['email_id']} may duplicate work order "
+                f"{', '.join('#' + str(d['id']) for d in duplicates)}", "info")
+        # Log store rows are what /processor-events replays on reconnect
+        log_store.log_success(parsed["email_id"])
+        return {
+            "email_id": parsed["email_id"],
+            "work_order_id": work_order_id,
+            "extracted_data": parsed["extracted_data"],
+            "possible_duplicates": duplicates
+        }
+
+    def handle_failure(item, error):
+        uid = item[1] if journal else item[0]
+        error_msg = f"Failed to process email uid_{uid}: {str(error)}"
+        print(error_msg)
+        log_store.log_error(f"uid_{uid}", error_msg)
+        if journal:
+            journal.mark_failed(item[0], error)
+
+    if journal:
+        # An email's attachments are kept as long as its journal entries
+        journal.on_prune = attachment_store.release
+
+    parse = parse or email_parser_for(config)
+    return ProcessingPipeline(
+        handle_email,
+        parse=partial(parse_journaled, parse) if journal else parse,
+        workers=settings.get("workers", 4),
+        queue_size=settings.get("queue_size", 100),
+        cpu_workers=settings.get("cpu_workers", 0),
+        on_error=handle_failure
+    )
+
+
+# Whether a pipeline built from old_config no longer matches new_config
+def pipeline_settings_changed(old_config, new_config):
+    keys = ("temp_dir", "db_path", "max_attachment_size", "max_message_size", "attachment_store_max_bytes")
+    processor_keys = ("workers", "queue_size", "cpu_workers")
+    return (any(old_config.get(key) != new_config.get(key) for key in keys)
+            or any(old_config["processor"].get(key) != new_config["processor"].get(key) for key in processor_keys))
+
+
+# A worker's counters; /processor-status adds up those of every worker
+def processor_counters(running, last_check, pipeline, bulk_pipeline, mailbox_pool):
+    pipeline_stats = pipeline.stats() if pipeline else None
+    bulk_stats = bulk_pipeline.stats() if bulk_pipeline else None
+    return {
+        "running": running,
+        "last_check": last_check,
+        "processed": pipeline_stats["processed"] if pipeline_stats else 0,
+        "failed": pipeline_stats["failed"] if pipeline_stats else 0,
+        "mailboxes": mailbox_pool.stats() if mailbox_pool and running else [],
+        "bulk_processed": bulk_stats["processed"] if bulk_stats else 0,
+        "bulk_failed": bulk_stats["failed"] if bulk_stats else 0
+    }
+
+
+# Processor status without the logs, shared by /processor-status and the
+# /processor-events stream. running, last_check and emails_processed
+# describe the processor across all workers; the pipelines and mailbox pool
+# passed in are this worker's, and running_here whether it runs here.
+def processor_status(config, coordinator, running_here, pipeline, bulk_pipeline, mailbox_pool):
+    coordination = coordinator.status()
+    leader = next((worker for worker in coordination["workers"] if worker["leader"]), None)
+    # Per-mailbox throughput and lag, as reported by the leader (or live
+    # when this worker is the leader)
+    if mailbox_pool and running_here:
+        mailboxes = mailbox_pool.stats()
+    else:
+        mailboxes = leader.get("mailboxes", []) if leader else []
+    return {
+        "bulk_pipeline": bulk_pipeline.stats() if bulk_pipeline else None,
+        "running": coordination["desired_running"],
+        "last_check": leader["last_check"] if leader else None,
+        "emails_processed": coordination["totals"].get("processed", 0),
+        "mailboxes": mailboxes,
+        "coordination": coordination,
+        "journal": get_message_journal(config).stats(),
+        "pipeline": pipeline.stats() if pipeline else None,
+        "extraction": get_tiered_extractor(config).stats(),
+        "extraction_cache": get_extraction_cache(config).stats(),
+        "scheduler": get_model_scheduler(config).stats(),
+        "export": get_export_sink(config).stats()
+    }
@@ -0,0 +1,673 @@
+import os
+import io
+import csv
+import json
+import time
+import queue
+import random
+import atexit
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from crm_client import CrmClient
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1.0
+DEFAULT_CSV_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_DEAD_LETTER_RETRY = 300
+DEFAULT_TABLE = "work_orders"
+
+# Connections idle longer than this are pinged before reuse
+POOL_PING_AFTER = 30
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Exported columns, in CSV order. work_order_id is the upsert key.
+EXPORT_COLUMNS = [
+    "work_order_id", "email_id", "source", "title", "priority", "description", "due_date",
+    "customer", "location", "trade", "summary", "action_items", "exported_at"
+]
+KEY_COLUMN = "work_order_id"
+# Columns that make up a row's content; exported_at changes on every submit
+CONTENT_COLUMNS = [column for column in EXPORT_COLUMNS if column != "exported_at"]
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def export_row(work_order_id, work_order, email_id=None, source="processor"):
+    row = {column: work_order.get(column) for column in EXPORT_COLUMNS}
+    row.update(
+        work_order_id=work_order_id,
+        email_id=email_id,
+        source=source,
+        exported_at=datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+    )
+    for column in EXPORT_COLUMNS:
+        if row[column] is not None and not isinstance(row[column], (str, int, float)):
+            row[column] = json.dumps(row[column])
+    return row
+
+
+# Appends rows to csv_path in one buffered write per batch. When the file
+# would grow past max_bytes it is renamed aside (an atomic rename, so readers
+# see either the old or the new file, never a half-rotated one) and a fresh
+# file with a header is started. A row whose work order was last written
+# with the same content (exported_at aside) is skipped, so re-submitting it
+# after a restart does not append it twice.
+class CsvTarget:
+    name = "csv"
+
+    def __init__(self, path, max_bytes=DEFAULT_CSV_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotations = 0
+        # work_order_id -> content digest of its latest row in the current
+        # file; read from the file on the first write
+        self._written = None
+
+    def signature(self):
+        return (self.name, self.path, self.max_bytes)
+
+    # Digest of a row as the CSV writer stores it, without exported_at
+    @staticmethod
+    def _digest(row):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([row.get(column) for column in CONTENT_COLUMNS])
+        return hashlib.sha256(buffer.getvalue().encode("utf-8")).digest()[:16]
+
+    def _load_written(self):
+        written = {}
+        try:
+            with open(self.path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    written[row.get(KEY_COLUMN)] = self._digest(row)
+        except FileNotFoundError:
+            pass
+        return written
+
+    def _rotated_path(self):
+        base, ext = os.path.splitext(self.path)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        candidate = f"{base}-{stamp}{ext}"
+        counter = 1
+        while os.path.exists(candidate):
+            candidate = f"{base}-{stamp}-{counter}{ext}"
+            counter += 1
+        return candidate
+
+    def write(self, rows):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if self._written is None or not size:
+            self._written = self._load_written() if size else {}
+
+        written = dict(self._written)
+        fresh = []
+        for row in rows:
+            key, digest = str(row[KEY_COLUMN]), self._digest(row)
+            if written.get(key) != digest:
+                written[key] = digest
+                fresh.append(row)
+        if not fresh:
+            return
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+        writer.writerows(fresh)
+        chunk = buffer.getvalue()
+
+        if size and self.max_bytes and size + len(chunk) > self.max_bytes:
+            os.replace(self.path, self._rotated_path())
+            self.rotations += 1
+            size = 0
+            # The new file starts with this batch only
+            written = {str(row[KEY_COLUMN]): self._digest(row) for row in fresh}
+        if not size:
+            header = io.StringIO()
+            csv.DictWriter(header, fieldnames=EXPORT_COLUMNS).writeheader()
+            chunk = header.getvalue() + chunk
+
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        self._written = written
+
+    def close(self):
+        pass
+
+
+# PyMySQL against the xampp_mysql settings
+class MySqlDriver:
+    placeholder = "%s"
+    # Keeps a statement well under the default max_allowed_packet
+    max_rows_per_statement = 500
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def signature(self):
+        return ("mysql",) + tuple(sorted(self.settings.items()))
+
+    def connect(self):
+        import pymysql
+        return pymysql.connect(
+            host=self.settings["host"],
+            port=int(self.settings.get("port", 3306)),
+            user=self.settings["user"],
+            password=self.settings.get("password", ""),
+            database=self.settings["database"],
+            charset="utf8mb4",
+            connect_timeout=10,
+            autocommit=False
+        )
+
+    def ping(self, conn):
+        conn.ping(reconnect=False)
+
+    def create_table_sql(self, table):
+        return f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                work_order_id BIGINT PRIMARY KEY,
+                email_id VARCHAR(255) NULL,
+                source VARCHAR(32) NOT NULL,
+                title VARCHAR(512) NULL,
+                priority VARCHAR(16) NULL,
+                description TEXT NULL,
+                due_date VARCHAR(32) NULL,
+                customer VARCHAR(255) NULL,
+                location VARCHAR(512) NULL,
+                trade VARCHAR(128) NULL,
+                summary TEXT NULL,
+                action_items TEXT NULL,
+                exported_at VARCHAR(32) NOT NULL,
+                KEY idx_{table}_email_id (email_id)
+            ) DEFAULT CHARSET=utf8mb4
+        '''
+
+    def upsert_sql(self, table, columns, row_count):
+        row = "(" + ", ".join(self.placeholder for _ in columns) + ")"
+        updates = ", ".join(f"{column} = VALUES({column})" for column in columns if column != KEY_COLUMN)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row] * row_count)} "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+# Stand-in for MySQL in development and tests: the same tables and
+# multi-row upserts, written to a local SQLite file
+class SqliteDriver:
+    placeholder = "?"
+    # SQLite builds before 3.32 allow at most 999 bound parameters
+    max_rows_per_statement = 999 // len(EXPORT_COLUMNS)
+
+    def __init__(self, path):
+        self.path = path
+
+    def signature(self):
+        return ("sqlite", self.path)
+
+    def connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def ping(self, conn):
+        conn.execute("SELECT 1")
+
+    def create_table_sql(self, table):
+        return f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                work_order_id INTEGER PRIMARY KEY,
+                email_id TEXT,
+                source TEXT NOT NULL,
+                title TEXT,
+                priority TEXT,
+                description TEXT,
+                due_date TEXT,
+                customer TEXT,
+                location TEXT,
+                trade TEXT,
+                summary TEXT,
+                action_items TEXT,
+                exported_at TEXT NOT NULL
+            )
+        '''
+
+    def upsert_sql(self, table, columns, row_count):
+        row = "(" + ", ".join(self.placeholder for _ in columns) + ")"
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != KEY_COLUMN)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([row] * row_count)} "
+                f"ON CONFLICT ({KEY_COLUMN}) DO UPDATE SET {updates}")
+
+
+class ConnectionPool:
+    def __init__(self, driver, size=DEFAULT_POOL_SIZE):
+        self.driver = driver
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    # A connection that raised is closed instead of going back to the pool,
+    # so a dropped server connection is replaced on the next acquire
+    @contextmanager
+    def connection(self):
+        try:
+            conn, idle_since = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._count < self.size
+                if can_open:
+                    self._count += 1
+            if can_open:
+                try:
+                    conn, idle_since = self.driver.connect(), time.monotonic()
+                except BaseException:
+                    with self._lock:
+                        self._count -= 1
+                    raise
+            else:
+                conn, idle_since = self._idle.get()
+
+        try:
+            if time.monotonic() - idle_since > POOL_PING_AFTER:
+                self.driver.ping(conn)
+            yield conn
+        except BaseException:
+            self._discard(conn)
+            raise
+        self._idle.put((conn, time.monotonic()))
+
+    def _discard(self, conn):
+        with self._lock:
+            self._count -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+# Bulk upserts through a connection pool. A batch is deduplicated by
+# work_order_id (the newest row wins), split into multi-row statements and,
+# with more than one pooled connection, the statements run concurrently;
+# they touch disjoint keys, so their order does not matter.
+class DatabaseTarget:
+    name = "mysql"
+
+    def __init__(self, driver, table=DEFAULT_TABLE, pool_size=DEFAULT_POOL_SIZE):
+        self.driver = driver
+        self.table = table
+        self.pool = ConnectionPool(driver, max(1, pool_size))
+        self._table_ready = False
+        self._executor = None
+
+    def signature(self):
+        return (self.name, self.driver.signature(), self.table, self.pool.size)
+
+    def _write_chunk(self, rows):
+        sql = self.driver.upsert_sql(self.table, EXPORT_COLUMNS, len(rows))
+        params = [row.get(column) for row in rows for column in EXPORT_COLUMNS]
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if not self._table_ready:
+                    cursor.execute(self.driver.create_table_sql(self.table))
+                    self._table_ready = True
+                cursor.execute(sql, params)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def write(self, rows):
+        latest = {}
+        for row in rows:
+            latest[row[KEY_COLUMN]] = row
+        rows = list(latest.values())
+        step = self.driver.max_rows_per_statement
+        chunks = [rows[start:start + step] for start in range(0, len(rows), step)]
+        if len(chunks) == 1 or self.pool.size == 1:
+            for chunk in chunks:
+                self._write_chunk(chunk)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool.size, thread_name_prefix="export-db")
+        for future in [self._executor.submit(self._write_chunk, chunk) for chunk in chunks]:
+            future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def build_targets(config):
+    settings = config.get("export", {})
+    targets = []
+    if settings.get("csv", True):
+        targets.append(CsvTarget(config["csv_path"], settings.get("csv_max_bytes", DEFAULT_CSV_MAX_BYTES)))
+    if settings.get("mysql", False):
+        if settings.get("mysql_driver", "mysql") == "sqlite":
+            driver = SqliteDriver(settings["sqlite_path"])
+        else:
+            driver = MySqlDriver(config["xampp_mysql"])
+        targets.append(DatabaseTarget(
+            driver, settings.get("table", DEFAULT_TABLE), settings.get("pool_size", DEFAULT_POOL_SIZE)))
+    if settings.get("crm", False):
+        targets.append(CrmClient(config["crm"]))
+    return targets
+
+
+# The process-wide sink. Its targets are built when it is created and
+# rebuilt only by configure_export_sink(), so this is cheap on hot paths.
+def get_export_sink(config):
+    global _sink
+    with _sink_lock:
+        if _sink is None or _sink.closed:
+            _sink = ExportSink(config["db_path"])
+            _apply_settings(_sink, config)
+        return _sink
+
+
+# Config store subscribers call this so new export settings (and csv_path,
+# MySQL or CRM settings) take effect; targets whose settings are unchanged
+# keep their pools and connections
+def configure_export_sink(config):
+    with _sink_lock:
+        if _sink is not None and not _sink.closed:
+            _apply_settings(_sink, config)
+
+
+def _apply_settings(sink, config):
+    settings = config.get("export", {})
+    sink.batch_size = settings.get("batch_size", DEFAULT_BATCH_SIZE)
+    sink.flush_interval = settings.get("flush_interval_seconds", DEFAULT_FLUSH_INTERVAL)
+    sink.max_retries = settings.get("max_retries", DEFAULT_MAX_RETRIES)
+    sink.retry_backoff = settings.get("retry_backoff_seconds", DEFAULT_RETRY_BACKOFF)
+    sink.dead_letter_retry = settings.get("dead_letter_retry_seconds", DEFAULT_DEAD_LETTER_RETRY)
+    sink.configure(build_targets(config))
+
+
+def close_export_sink():
+    with _sink_lock:
+        sink = _sink
+    if sink is not None:
+        sink.close()
+
+
+atexit.register(close_export_sink)
+
+
+# Exports saved work orders to the configured targets (CSV, MySQL, CRM).
+# Rows are queued and a writer thread flushes them in batches once
+# batch_size rows are pending or the oldest has waited flush_interval. A
+# batch that still fails after max_retries (with exponential backoff) goes
+# to a dead-letter table in the local database and is retried from there
+# every dead_letter_retry seconds, so an outage of one target neither
+# blocks ingestion nor loses rows.
+class ExportSink:
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = DEFAULT_MAX_RETRIES
+        self.retry_backoff = DEFAULT_RETRY_BACKOFF
+        self.dead_letter_retry = DEFAULT_DEAD_LETTER_RETRY
+        self.closed = False
+
+        self._targets = {}
+        self._targets_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS export_dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target TEXT NOT NULL,
+                row TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL,
+                created_at TEXT NOT NULL,
+                last_attempt_at TEXT NOT NULL
+            )
+        ''')
+        self._conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_export_dead_letters_target
+            ON export_dead_letters (target, id)
+        ''')
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="export-sink-writer")
+        self._writer.daemon = True
+        self._writer.start()
+
+    # Swap in new targets when their settings change; unchanged targets keep
+    # their pools and open connections
+    def configure(self, targets):
+        retired = []
+        with self._targets_lock:
+            current = {target.name: target for target in targets}
+            for name, target in current.items():
+                existing = self._targets.get(name)
+                if existing is not None and existing.signature() == target.signature():
+                    current[name] = existing
+                    retired.append(target)
+                elif existing is not None:
+                    retired.append(existing)
+            retired.extend(target for name, target in self._targets.items() if name not in current)
+            self._targets = current
+            for name in current:
+                self._stats.setdefault(name, {
+                    "exported": 0, "batches": 0, "retries": 0, "dead_lettered": 0,
+                    "replayed": 0, "last_batch_ms": None, "last_error": None
+                })
+        for target in retired:
+            target.close()
+
+    # on_written (if given) runs on the writer thread once the row has gone
+    # to every target or, for a target that failed, to the dead-letter table
+    def submit(self, work_order_id, work_order, email_id=None, source="processor", on_written=None):
+        if self.closed:
+            raise RuntimeError("Export sink is closed")
+        self._queue.put((export_row(work_order_id, work_order, email_id, source), on_written))
+
+    def flush(self, timeout=None):
+        if self.closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(None)
+        self._writer.join()
+        with self._targets_lock:
+            targets = list(self._targets.values())
+        for target in targets:
+            target.close()
+
+    def _writer_loop(self):
+        pending = []
+        written_callbacks = []
+        waiters = []
+        deadline = None
+        last_replay = time.monotonic()
+        running = True
+
+        while running:
+            # Wake up for the next flush or the next dead-letter replay
+            next_replay = last_replay + self.dead_letter_retry
+            if deadline is not None:
+                next_replay = min(next_replay, deadline)
+            timeout = max(0.0, next_replay - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                running = False
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not False:
+                row, on_written = item
+                pending.append(row)
+                if on_written is not None:
+                    written_callbacks.append(on_written)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            flush_due = (
+                not running
+                or waiters
+                or len(pending) >= self.batch_size
+                or (deadline is not None and time.monotonic() >= deadline)
+            )
+            if flush_due:
+                if pending:
+                    self._export(pending)
+                    pending = []
+                for on_written in written_callbacks:
+                    try:
+                        on_written()
+                    except Exception as e:
+                        print(f"Error in export callback: {str(e)}")
+                written_callbacks = []
+                deadline = None
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+
+            if running and time.monotonic() - last_replay >= self.dead_letter_retry:
+                self._replay_dead_letters()
+                last_replay = time.monotonic()
+
+    def _export(self, rows):
+        with self._targets_lock:
+            targets = list(self._targets.values())
+        for target in targets:
+            error = self._write_with_retries(target, rows)
+            if error is not None:
+                # A target that writes in several parts reports which rows
+                # did not make it; only those are dead-lettered
+                failed = getattr(error, "failed_rows", None) or rows
+                with self._stats_lock:
+                    self._stats[target.name]["exported"] += len(rows) - len(failed)
+                message = str(error) or type(error).__name__
+                print(f"Export of {len(failed)} work orders to {target.name} failed: {message}")
+                self._dead_letter(target.name, failed, message)
+
+    def _write_with_retries(self, target, rows):
+        stats = self._stats[target.name]
+        # Targets with their own retry policy (the CRM client) get one call
+        attempts = 1 if getattr(target, "handles_retries", False) else self.max_retries + 1
+        for attempt in range(attempts):
+            if attempt:
+                # Exponential backoff with jitter, so several workers retrying
+                # against the same server do not do so in lockstep
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+                with self._stats_lock:
+                    stats["retries"] += 1
+            started = time.monotonic()
+            try:
+                target.write(rows)
+            except Exception as e:
+                error = e
+                with self._stats_lock:
+                    stats["last_error"] = str(e) or type(e).__name__
+                continue
+            with self._stats_lock:
+                stats["exported"] += len(rows)
+                stats["batches"] += 1
+                stats["last_batch_ms"] = round((time.monotonic() - started) * 1000, 1)
+            return None
+        return error
+
+    def _dead_letter(self, target_name, rows, error):
+        now = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        with self._db_lock, self._conn:
+            self._conn.executemany('''
+                INSERT INTO export_dead_letters (target, row, error, attempts, created_at, last_attempt_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(target_name, json.dumps(row), error, self.max_retries + 1, now, now) for row in rows])
+        with self._stats_lock:
+            self._stats[target_name]["dead_lettered"] += len(rows)
+
+    # One attempt per dead-lettered batch; rows that go through are deleted,
+    # the rest stay for the next round
+    def _replay_dead_letters(self):
+        with self._targets_lock:
+            targets = list(self._targets.values())
+        for target in targets:
+            with self._db_lock:
+                letters = self._conn.execute('''
+                    SELECT id, row FROM export_dead_letters WHERE target = ? ORDER BY id LIMIT ?
+                ''', (target.name, self.batch_size)).fetchall()
+            if not letters:
+                continue
+            ids = [letter[0] for letter in letters]
+            marks = ", ".join("?" for _ in ids)
+            try:
+                target.write([json.loads(letter[1]) for letter in letters])
+            except Exception as e:
+                with self._db_lock, self._conn:
+                    self._conn.execute(f'''
+                        UPDATE export_dead_letters
+                        SET attempts = attempts + 1, error = ?, last_attempt_at = ?
+                        WHERE id IN ({marks})
+                    ''', [str(e), datetime.utcnow().strftime(TIMESTAMP_FORMAT)] + ids)
+                continue
+            with self._db_lock, self._conn:
+                self._conn.execute(f"DELETE FROM export_dead_letters WHERE id IN ({marks})", ids)
+            with self._stats_lock:
+                self._stats[target.name]["replayed"] += len(ids)
+
+    def stats(self):
+        with self._db_lock:
+            dead_letters = dict(self._conn.execute(
+                "SELECT target, COUNT(*) FROM export_dead_letters GROUP BY target").fetchall())
+        with self._targets_lock, self._stats_lock:
+            targets = {
+                name: dict(self._stats[name], dead_letters=dead_letters.get(name, 0))
+                for name in self._targets
+            }
+            detailed = {name: target for name, target in self._targets.items() if hasattr(target, "stats")}
+        for name, target in detailed.items():
+            targets[name]["client"] = target.stats()
+        return {"pending": self._queue.qsize(), "targets": targets}
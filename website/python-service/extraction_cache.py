@@ -0,0 +1,256 @@
+import re
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+from extraction_engine import PROMPT_VERSION
+from fast_extract import RELATIVE_DATE_RE
+
+DEFAULT_MEMORY_ENTRIES = 1024
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+# The persistent tier is trimmed back to max_entries every this many writes
+PRUNE_EVERY = 500
+
+QUOTE_HEADER_RE = re.compile(
+    r"^(On .+ wrote:|-----\s*Original Message\s*-----|-+\s*Forwarded message\s*-+|From: .+)$", re.I)
+REPLY_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd|aw|sv)\s*:\s*)+", re.I)
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+# Reduce an email to the part that identifies the work order: quoted
+# history, signatures and whitespace differences between reply-all copies,
+# CCs and redeliveries are dropped
+def normalize_email(subject, body):
+    lines = []
+    for line in (body or "").splitlines():
+        stripped = line.strip()
+        if stripped in ("--", "-- ") or QUOTE_HEADER_RE.match(stripped):
+            break
+        if stripped.startswith(">"):
+            continue
+        lines.append(stripped)
+    normalized_body = WHITESPACE_RE.sub(" ", " ".join(lines)).strip().lower()
+    normalized_subject = WHITESPACE_RE.sub(" ", REPLY_PREFIX_RE.sub("", subject or "")).strip().lower()
+    return f"{normalized_subject}\n{normalized_body}"
+
+
+# Results depend on the model, its precision, the prompt and the rule-tier
+# threshold as well as the email and its sender (the rule tier may take the
+# customer from it), so all of them are part of the key. A due date worded
+# "by tomorrow" resolves differently every day, so the day of extraction is
+# part of the key for such emails and their results are reused only that day.
+def cache_key(subject, body, sender, model_path, threshold=None, inference_mode=None, today=None):
+    day = ""
+    if RELATIVE_DATE_RE.search(f"{subject or ''}\n{body or ''}"):
+        day = (today or datetime.now()).strftime("%Y-%m-%d")
+    raw = (f"{model_path}\n{inference_mode}\n{PROMPT_VERSION}\n{threshold}\n{sender or ''}\n{day}\n"
+           f"{normalize_email(subject, body)}")
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Two-tier memoization of extraction results: an in-memory LRU in front of a
+# SQLite table, both with TTL expiry. Concurrent requests for the same key
+# share a single computation.
+class ExtractionCache:
+    def __init__(self, db_path, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "shared": 0, "evictions": 0}
+
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_access
+            ON extraction_cache (last_access)
+        ''')
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, result = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return result
+                del self._memory[key]
+
+        with self._db_lock:
+            row = self.conn.execute(
+                "SELECT result, created_at FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                with self.conn:
+                    self.conn.execute("DELETE FROM extraction_cache WHERE key = ?", (key,))
+                row = None
+            elif row is not None:
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE extraction_cache SET last_access = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            result = json.loads(row[0])
+            self._remember(key, row[1], result)
+            return result
+
+    def put(self, key, result):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, result)
+        with self._db_lock:
+            with self.conn:
+                self.conn.execute('''
+                    INSERT INTO extraction_cache (key, result, created_at, last_access)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        result = excluded.result,
+                        created_at = excluded.created_at,
+                        last_access = excluded.last_access
+                ''', (key, json.dumps(result), now, now))
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._prune(now)
+
+    # Return the cached result for key, or run compute() once no matter how
+    # many threads ask for the same key at the same time
+    def get_or_compute(self, key, compute):
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        future, owner = self._claim(key)
+        if not owner:
+            return future.result()
+
+        try:
+            result = compute()
+            self.put(key, result)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key)
+
+    # asyncio flavour of get_or_compute for the FastAPI service: compute is
+    # a coroutine function and the SQLite tier is reached through run_io.
+    # Callers share one computation with the threaded ones, and waiting on
+    # someone else's holds no thread.
+    async def get_or_compute_async(self, key, compute, run_io):
+        result = await run_io(self.get, key)
+        if result is not None:
+            return result
+
+        future, owner = self._claim(key)
+        if not owner:
+            # Shielded: cancelling this waiter must not cancel the owner's future
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await compute()
+            await run_io(self.put, key, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError("Extraction was cancelled"))
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key)
+
+    # The in-flight future for key, and whether this caller must compute it
+    def _claim(self, key):
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats["shared"] += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            return future, True
+
+    def _release(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _remember(self, key, created_at, result):
+        self._memory[key] = (created_at, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _prune(self, now):
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            count = self.conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self.conn.execute('''
+                    DELETE FROM extraction_cache WHERE key IN (
+                        SELECT key FROM extraction_cache ORDER BY last_access LIMIT ?
+                    )
+                ''', (excess,))
+                self._stats["evictions"] += excess
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0
+        return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_extraction_cache(config):
+    settings = config.get("extraction_cache", {})
+    with _caches_lock:
+        cache = _caches.get(config["db_path"])
+        if cache is None:
+            cache = ExtractionCache(
+                config["db_path"],
+                memory_entries=settings.get("memory_entries", DEFAULT_MEMORY_ENTRIES),
+                max_entries=settings.get("max_entries", DEFAULT_MAX_ENTRIES),
+                ttl_seconds=settings.get("ttl_seconds", DEFAULT_TTL_SECONDS)
+            )
+            _caches[config["db_path"]] = cache
+        return cache
@@ -0,0 +1,365 @@
+import os
+import re
+import json
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+from model_scheduler import PRIORITIES, QueueTimeout
+
+EXTRACTION_FIELDS = [
+    "title", "priority", "description", "due_date", "customer",
+    "location", "trade", "summary", "action_items"
+]
+
+# A batch is dispatched once it holds max_batch_size requests or the oldest
+# request has waited max_wait_ms, whichever comes first
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_MAX_WAIT_MS = 25
+DEFAULT_MAX_NEW_TOKENS = 256
+
+# Prompts are grouped into length buckets this many tokens wide so a batch
+# never pads a short email out to the length of a long one
+DEFAULT_BUCKET_WIDTH = 128
+
+MAX_BODY_CHARS = 4000
+
+PROMPT_TEMPLATE = """Extract the work order from the email below.
+Respond with a single JSON object with these keys: {fields}.
+priority is one of LOW, NORMAL, HIGH, URGENT. due_date is YYYY-MM-DD or null.
+Use null for anything the email does not say.
+
+Subject: {subject}
+
+{body}
+
+JSON:"""
+
+# Changes whenever the prompt or field list does, so results cached under an
+# older prompt are not reused
+PROMPT_VERSION = hashlib.sha256(
+    (PROMPT_TEMPLATE + "|" + ",".join(EXTRACTION_FIELDS)).encode("utf-8")
+).hexdigest()[:12]
+
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.S)
+_FIELD_LINE_RE = re.compile(r'^\s*"?(\w+)"?\s*[:=]\s*"?(.*?)"?,?\s*$')
+
+
+def build_prompt(subject, body, fields=None):
+    return PROMPT_TEMPLATE.format(
+        fields=", ".join(fields or EXTRACTION_FIELDS),
+        subject=subject or "",
+        body=(body or "")[:MAX_BODY_CHARS]
+    )
+
+
+def parse_model_output(text, wanted=None):
+    wanted = wanted or EXTRACTION_FIELDS
+    fields = dict.fromkeys(wanted)
+    match = _JSON_OBJECT_RE.search(text or "")
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            for key in wanted:
+                value = data.get(key)
+                if isinstance(value, list):
+                    value = "\n".join(f"{i + 1}. {item}" for i, item in enumerate(value))
+                fields[key] = value if value not in ("", "null") else None
+            return fields
+        except (ValueError, AttributeError):
+            pass
+
+    # Small models often emit "key: value" lines instead of valid JSON
+    for line in (text or "").splitlines():
+        line_match = _FIELD_LINE_RE.match(line)
+        if line_match and line_match.group(1) in fields and fields[line_match.group(1)] is None:
+            value = line_match.group(2).strip()
+            fields[line_match.group(1)] = value if value and value != "null" else None
+    return fields
+
+
+# CPU inference modes: full precision, bfloat16 weights and activations, or
+# fp32 with Linear layers dynamically quantized to int8
+INFERENCE_MODES = ("fp32", "bf16", "int8")
+DEFAULT_INFERENCE_MODE = "fp32"
+
+
+# Local checkpoints are only forced onto safetensors when they have them; hub
+# IDs are left to transformers, which prefers safetensors when published
+def has_safetensors(model_path):
+    if not os.path.isdir(model_path):
+        return None
+    return any(name.endswith(".safetensors") for name in os.listdir(model_path)) or None
+
+
+# Runs a Hugging Face causal LM on CPU. Imported lazily so the services start
+# without torch/transformers installed.
+class TransformersBackend:
+    def __init__(self, model_path, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                 inference_mode=DEFAULT_INFERENCE_MODE):
+        if inference_mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {inference_mode}")
+        self.model_path = model_path
+        self.max_new_tokens = max_new_tokens
+        self.inference_mode = inference_mode
+        self.tokenizer = None
+        self.model = None
+        self._load_lock = threading.Lock()
+        # Fast tokenizers are not safe to call from several threads at once
+        # (extraction batches and chat turns share this one)
+        self.tokenizer_lock = threading.Lock()
+
+    def load(self):
+        with self._load_lock:
+            if self.model is not None:
+                return
+            import torch
+            from transformers import AutoTokenizer, AutoModelForCausalLM
+
+            tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+            # Decoder-only models must be left-padded for batched generation
+            tokenizer.padding_side = "left"
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            # safetensors checkpoints loaded in their stored dtype stay
+            # memory-mapped, so the weight pages come from the page cache and
+            # are shared by every process that loads (or forks with) them.
+            # Converting (e.g. a bf16 checkpoint to fp32) makes a private copy.
+            dtype = torch.bfloat16 if self.inference_mode == "bf16" else torch.float32
+            model = AutoModelForCausalLM.from_pretrained(
+                self.model_path,
+                torch_dtype=dtype,
+                low_cpu_mem_usage=True,
+                use_safetensors=has_safetensors(self.model_path)
+            )
+            model.eval()
+            if self.inference_mode == "int8":
+                model = torch.ao.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.tokenizer = tokenizer
+            self.model = model
+
+    # Size of the weights, counting the packed int8 weights of dynamically
+    # quantized layers (which are not parameters)
+    def parameter_bytes(self):
+        if self.model is None:
+            return 0
+        total = 0
+        for value in self.model.state_dict().values():
+            # Quantized Linear layers store a (weight, bias) tuple
+            for tensor in value if isinstance(value, tuple) else (value,):
+                if hasattr(tensor, "element_size"):
+                    total += tensor.numel() * tensor.element_size()
+        return total
+
+    def count_tokens(self, prompt):
+        self.load()
+        with self.tokenizer_lock:
+            return len(self.tokenizer(prompt)["input_ids"])
+
+    def generate_batch(self, prompts, max_new_tokens=None):
+        import torch
+
+        self.load()
+        with self.tokenizer_lock:
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        with torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens or self.max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+        new_tokens = output[:, inputs["input_ids"].shape[1]:]
+        with self.tokenizer_lock:
+            return self.tokenizer.batch_decode(new_tokens, skip_special_tokens=True)
+
+
+class _Request:
+    def __init__(self, prompt, fields, workload, queue_timeout):
+        self.prompt = prompt
+        self.fields = fields
+        self.workload = workload
+        self.future = Future()
+        self.enqueued = time.monotonic()
+        self.deadline = None if queue_timeout is None else self.enqueued + queue_timeout
+
+    @property
+    def priority(self):
+        return PRIORITIES[self.workload], self.enqueued
+
+
+# Collects concurrent extraction requests (HTTP and background processor)
+# into dynamic micro-batches and runs one forward pass per batch. With a
+# scheduler, each batch first waits for a model slot at the priority of its
+# most urgent request.
+class ExtractionEngine:
+    def __init__(self, backend, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms=DEFAULT_MAX_WAIT_MS, bucket_width=DEFAULT_BUCKET_WIDTH, scheduler=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.bucket_width = max(1, bucket_width)
+
+        self._queue = queue.Queue()
+        self._running = True
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "failed": 0, "batch_seconds": 0.0}
+
+        self._thread = threading.Thread(target=self._batch_loop, name="extraction-engine")
+        self._thread.daemon = True
+        self._thread.start()
+
+    # `fields` limits the prompt (and the parsed result) to a subset of
+    # EXTRACTION_FIELDS, e.g. the ones the rule-based tier could not fill.
+    # `workload` is "processor" or "manual" (see model_scheduler.PRIORITIES).
+    def submit(self, subject, body, fields=None, workload="manual"):
+        queue_timeout = self.scheduler.queue_timeout(workload) if self.scheduler else None
+        request = _Request(build_prompt(subject, body, fields), fields, workload, queue_timeout)
+        self._queue.put(request)
+        return request.future
+
+    def extract(self, subject, body, fields=None, timeout=None, workload="manual"):
+        return self.submit(subject, body, fields, workload).result(timeout)
+
+    def stop(self):
+        self._running = False
+        self._queue.put(None)
+        self._thread.join()
+        # Requests that raced with stop() would otherwise wait forever
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and not request.future.done():
+                request.future.set_exception(RuntimeError("Extraction engine stopped"))
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        pending = [first]
+        deadline = first.enqueued + self.max_wait
+        # Keep collecting for the wait window; a full window can hold several
+        # batches' worth, which then get split by length bucket
+        while len(pending) < self.max_batch_size * 4:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._running = False
+                break
+            pending.append(request)
+        return pending
+
+    def _batches(self, pending):
+        buckets = {}
+        for request in pending:
+            length = self.backend.count_tokens(request.prompt)
+            buckets.setdefault(length // self.bucket_width, []).append(request)
+        batches = []
+        for bucket in buckets.values():
+            bucket.sort(key=lambda request: request.priority)
+            for start in range(0, len(bucket), self.max_batch_size):
+                batches.append(bucket[start:start + self.max_batch_size])
+        # Batches holding the most urgent requests run first
+        batches.sort(key=lambda batch: batch[0].priority)
+        return batches
+
+    # Wait for a model slot for this batch. Requests whose queue deadline
+    # passes while waiting fail with QueueTimeout; the rest keep their place.
+    def _admit(self, batch):
+        while batch:
+            deadlines = [request.deadline for request in batch if request.deadline is not None]
+            try:
+                slot = self.scheduler.acquire(
+                    batch[0].workload,
+                    timeout=max(0, min(deadlines) - time.monotonic()) if deadlines else None,
+                    enqueued=batch[0].enqueued,
+                    record=False
+                )
+            except QueueTimeout as e:
+                now = time.monotonic()
+                waiting = []
+                for request in batch:
+                    if request.deadline is not None and request.deadline <= now:
+                        self.scheduler.record(request.workload, rejected=True)
+                        if not request.future.done():
+                            request.future.set_exception(QueueTimeout(request.workload, e.retry_after))
+                    else:
+                        waiting.append(request)
+                batch = waiting
+                continue
+            now = time.monotonic()
+            for request in batch:
+                self.scheduler.record(request.workload, now - request.enqueued)
+            return slot, batch
+        return None, batch
+
+    def _batch_loop(self):
+        while self._running:
+            pending = self._collect()
+            if pending is None:
+                break
+            try:
+                for batch in self._batches(pending):
+                    self._run_batch(batch)
+            except Exception as e:
+                for request in pending:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _run_batch(self, batch):
+        slot = None
+        if self.scheduler:
+            slot, batch = self._admit(batch)
+            if not batch:
+                return
+        started = time.monotonic()
+        try:
+            outputs = self.backend.generate_batch([request.prompt for request in batch])
+        except Exception as e:
+            outputs = None
+            with self._stats_lock:
+                self._stats["failed"] += len(batch)
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            if slot:
+                slot.release()
+        # Each request on its own: an unparsable output or a future its
+        # caller already cancelled does not fail the rest of the batch
+        for request, output in zip(batch, outputs or []):
+            try:
+                result = parse_model_output(output, request.fields)
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats["failed"] += 1
+                if not request.future.done():
+                    request.future.set_exception(e)
+                continue
+            try:
+                request.future.set_result(result)
+            except InvalidStateError:
+                # Cancelled by its caller in the meantime
+                pass
+        with self._stats_lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["batch_seconds"] += time.monotonic() - started
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
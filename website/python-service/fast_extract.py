@@ -0,0 +1,316 @@
+import re
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from email.utils import parseaddr
+
+from extraction_engine import EXTRACTION_FIELDS
+from model_manager import get_extraction_engine
+
+# Fields at or above this confidence are taken from the rule-based tier and
+# left out of the LLM prompt
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+# Whole words or phrases (a plural "s"/"es" also matches), so "tree" does
+# not match "street" nor "lock" match "block"
+TRADE_KEYWORDS = {
+    "Plumbing": ["plumbing", "plumber", "leak", "leaking", "leaky", "pipe", "piping", "faucet", "toilet",
+                 "drain", "water heater", "sewer", "clog", "clogged"],
+    "Roofing": ["roof", "roofing", "roofer", "shingle", "gutter", "flashing", "skylight"],
+    "HVAC": ["hvac", "furnace", "air conditioning", "air conditioner", "a/c", "thermostat", "heat pump",
+             "boiler", "ventilation"],
+    "Electrical": ["electric", "electrical", "electrician", "outlet", "breaker", "wiring", "light fixture",
+                   "circuit", "panel", "gfci"],
+    "Carpentry": ["carpentry", "carpenter", "cabinet", "door frame", "trim", "deck", "framing"],
+    "Painting": ["paint", "painting", "painter", "drywall", "plaster"],
+    "Landscaping": ["landscaping", "landscaper", "landscape", "lawn", "irrigation", "sprinkler", "tree"],
+    "Appliance": ["appliance", "dishwasher", "refrigerator", "fridge", "washer", "washing machine", "dryer",
+                  "oven"],
+    "Locksmith": ["lock", "locksmith", "locked out", "key", "deadbolt"],
+    "Pest Control": ["pest", "termite", "rodent", "insect", "bed bug"]
+}
+
+PRIORITY_KEYWORDS = [
+    ("URGENT", ["emergency", "urgent", "asap", "immediately", "flooding", "no heat", "gas leak"]),
+    ("HIGH", ["high priority", "as soon as possible", "leaking", "damage"]),
+    ("LOW", ["low priority", "no rush", "whenever", "when convenient"])
+]
+
+
+def _keyword_re(keyword, plural=False):
+    return re.compile(r"\b" + re.escape(keyword) + (r"(?:e?s)?" if plural else "") + r"\b", re.I)
+
+
+TRADE_PATTERNS = {
+    trade: [_keyword_re(keyword, plural=True) for keyword in keywords]
+    for trade, keywords in TRADE_KEYWORDS.items()
+}
+PRIORITY_PATTERNS = [
+    (priority, [_keyword_re(keyword) for keyword in keywords]) for priority, keywords in PRIORITY_KEYWORDS
+]
+
+PRIORITY_ALIASES = {
+    "emergency": "URGENT", "urgent": "URGENT", "critical": "URGENT",
+    "high": "HIGH", "normal": "NORMAL", "medium": "NORMAL", "routine": "NORMAL", "low": "LOW"
+}
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+
+
+def _label_re(*labels):
+    return re.compile(r"^\s*(?:%s)\s*[:\-]\s*(.+?)\s*$" % "|".join(labels), re.I | re.M)
+
+
+LABELS = {
+    "title": _label_re("title", "work order", "job"),
+    "priority": _label_re("priority", "urgency"),
+    "due_date": _label_re("due date", "due", "deadline", "complete by", "needed by"),
+    "customer": _label_re("customer", "client", "tenant", "customer name", "contact"),
+    "location": _label_re("location", "address", "site", "property", "service address"),
+    "trade": _label_re("trade", "category", "service type")
+}
+
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+US_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})/(\d{2,4})\b")
+TEXT_DATE_RE = re.compile(r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?(?:,?\s+(\d{4}))?", re.I)
+RELATIVE_DATE_RE = re.compile(r"\b(?:by|due|before|on)\s+(today|tomorrow|end of (?:the )?week)\b", re.I)
+STREET_RE = re.compile(
+    r"\b\d{1,6}\s+(?:[A-Z][\w.]*\s+){1,4}"
+    r"(?:St|Street|Ave|Avenue|Rd|Road|Blvd|Boulevard|Dr|Drive|Ln|Lane|Way|Ct|Court|Pl|Place|Pkwy|Hwy|Cir)\b\.?"
+    r"(?:,\s*(?:(?:Apt|Unit|Suite|#)\s*\w+,\s*)?[A-Z][\w ]+)*",
+)
+REPLY_PREFIX_RE = re.compile(r"^\s*((re|fw|fwd)\s*:\s*)+", re.I)
+LIST_ITEM_RE = re.compile(r"^\s*(?:\d+[.)]|[-*\u2022])\s+(.+?)\s*$", re.M)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+LABEL_LINE_RE = re.compile(r"^\s*[A-Za-z ]{2,20}\s*:\s*\S")
+GREETING_RE = re.compile(r"^\s*(hi|hello|hey|dear|good (morning|afternoon|evening))\b[^.!?]{0,40}[,!]?\s*$", re.I)
+
+# Bodies longer than this are summarized by the model rather than copied
+MAX_RULE_DESCRIPTION = 1000
+
+
+def _date(year, month, day):
+    try:
+        return datetime(year, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+# Drop greetings, quoted replies, the signature and labelled lines, leaving
+# the free text
+def body_text(body):
+    lines = []
+    for line in body.splitlines():
+        if line.strip() in ("--", "-- ") or re.match(r"^On .+ wrote:$", line.strip()):
+            break
+        if (line.lstrip().startswith(">") or GREETING_RE.match(line)
+                or LABEL_LINE_RE.match(line) or LIST_ITEM_RE.match(line)):
+            continue
+        lines.append(line.strip())
+    return re.sub(r"\n{2,}", "\n\n", "\n".join(lines)).strip()
+
+
+def parse_date(text, today=None):
+    today = today or datetime.now()
+    match = ISO_DATE_RE.search(text)
+    if match:
+        return _date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    match = US_DATE_RE.search(text)
+    if match:
+        year = int(match.group(3))
+        year = year + 2000 if year < 100 else year
+        return _date(year, int(match.group(1)), int(match.group(2)))
+    match = TEXT_DATE_RE.search(text)
+    if match:
+        year = int(match.group(3)) if match.group(3) else today.year
+        return _date(year, MONTHS[match.group(1).lower()[:3]], int(match.group(2)))
+    return None
+
+
+# First-tier extractor: labelled lines ("Priority: High"), dates, street
+# addresses and trade keywords. Returns {field: (value, confidence)} for
+# the fields it could find.
+def extract_fields(subject, body, sender="", today=None):
+    today = today or datetime.now()
+    subject = subject or ""
+    body = body or ""
+    text = f"{subject}\n{body}"
+    found = {}
+
+    for field, pattern in LABELS.items():
+        match = pattern.search(body)
+        if match:
+            found[field] = (match.group(1).strip(), 0.95)
+
+    if "title" not in found and subject.strip():
+        found["title"] = (REPLY_PREFIX_RE.sub("", subject).strip(), 0.85)
+
+    if "priority" in found:
+        value = found["priority"][0].lower().split()[0] if found["priority"][0] else ""
+        normalized = PRIORITY_ALIASES.get(value)
+        if normalized:
+            found["priority"] = (normalized, 0.95)
+        else:
+            del found["priority"]
+    if "priority" not in found:
+        for priority, patterns in PRIORITY_PATTERNS:
+            if any(pattern.search(text) for pattern in patterns):
+                found["priority"] = (priority, 0.85 if priority == "URGENT" else 0.75)
+                break
+
+    if "due_date" in found:
+        parsed = parse_date(found["due_date"][0], today)
+        if parsed:
+            found["due_date"] = (parsed, 0.95)
+        else:
+            del found["due_date"]
+    if "due_date" not in found:
+        relative = RELATIVE_DATE_RE.search(text)
+        if relative:
+            phrase = relative.group(1).lower()
+            offset = 0 if phrase == "today" else 1 if phrase == "tomorrow" else max(0, 4 - today.weekday())
+            found["due_date"] = ((today + timedelta(days=offset)).strftime("%Y-%m-%d"), 0.85)
+        else:
+            parsed = parse_date(text, today)
+            if parsed:
+                found["due_date"] = (parsed, 0.7)
+
+    if "location" not in found:
+        match = STREET_RE.search(text)
+        if match:
+            found["location"] = (match.group(0).strip().rstrip(","), 0.85)
+
+    if "trade" in found:
+        label = found["trade"][0]
+        for trade, patterns in TRADE_PATTERNS.items():
+            if trade.lower() in label.lower() or any(pattern.search(label) for pattern in patterns):
+                found["trade"] = (trade, 0.95)
+                break
+    else:
+        scores = {
+            trade: sum(len(pattern.findall(text)) for pattern in patterns)
+            for trade, patterns in TRADE_PATTERNS.items()
+        }
+        best = max(scores, key=scores.get)
+        hits = scores[best]
+        runner_up = max(score for trade, score in scores.items() if trade != best)
+        if hits:
+            # Several keyword hits with a clear winner is as good as a label
+            confidence = 0.9 if hits >= 2 and hits > runner_up * 2 else 0.6
+            found["trade"] = (best, confidence)
+
+    items = LIST_ITEM_RE.findall(body)
+    if items:
+        found["action_items"] = ("\n".join(f"{i + 1}. {item}" for i, item in enumerate(items)), 0.9)
+
+    description = body_text(body)
+    if description:
+        confidence = 0.85 if len(description) <= MAX_RULE_DESCRIPTION else 0.5
+        found["description"] = (description, confidence)
+        first_sentence = SENTENCE_END_RE.split(description.replace("\n", " "), 1)[0].strip()
+        found["summary"] = (first_sentence, 0.8 if confidence >= 0.85 else 0.5)
+
+    if "customer" not in found and sender:
+        name, _ = parseaddr(sender)
+        if name:
+            # The sender is often a property manager rather than the customer
+            found["customer"] = (name, 0.6)
+
+    return found
+
+
+# Runs the rule-based tier first and asks the LLM only for the fields it
+# could not fill confidently; if every field is confident the model is
+# skipped entirely. engine_factory(config) returns the extraction engine
+# for the configuration current at the time of the call.
+class TieredExtractor:
+    def __init__(self, engine_factory=get_extraction_engine, threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+        self.engine_factory = engine_factory
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._emails = 0
+        self._llm_skipped = 0
+        self._rule_hits = dict.fromkeys(EXTRACTION_FIELDS, 0)
+        self._llm_fields = dict.fromkeys(EXTRACTION_FIELDS, 0)
+
+    def extract(self, subject, body, sender="", config=None, timeout=None, workload="manual"):
+        result, confident, missing = self._rule_tier(extract_fields(subject, body, sender))
+        llm_fields = None
+        if missing:
+            llm_fields = self.engine_factory(config).extract(
+                subject, body, fields=missing, timeout=timeout, workload=workload)
+        return self._merge(result, confident, missing, llm_fields)
+
+    # asyncio flavour of extract() for the FastAPI service: run_cpu runs the
+    # rule tier off the event loop (in a process pool when there is one),
+    # run_io the engine lookup (which may load the model), and the model's
+    # answer is awaited on the engine's future without holding a thread
+    async def extract_async(self, subject, body, sender="", config=None, timeout=None, workload="manual",
+                            run_io=None, run_cpu=None):
+        found = await run_cpu(extract_fields, subject, body, sender)
+        result, confident, missing = self._rule_tier(found)
+        llm_fields = None
+        if missing:
+            engine = await run_io(self.engine_factory, config)
+            future = engine.submit(subject, body, fields=missing, workload=workload)
+            # Shielded: a cancelled engine future would fail its whole batch
+            llm_fields = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        return self._merge(result, confident, missing, llm_fields)
+
+    def _rule_tier(self, found):
+        result = dict.fromkeys(EXTRACTION_FIELDS)
+        confident = set()
+        for field, (value, confidence) in found.items():
+            result[field] = value
+            if confidence >= self.threshold:
+                confident.add(field)
+        missing = [field for field in EXTRACTION_FIELDS if field not in confident]
+        return result, confident, missing
+
+    def _merge(self, result, confident, missing, llm_fields):
+        # The model's answer replaces the rule tier's guess even when it is
+        # null: a value below the threshold is not trusted on its own
+        for field in missing:
+            result[field] = llm_fields.get(field) if llm_fields else None
+
+        with self._lock:
+            self._emails += 1
+            if not missing:
+                self._llm_skipped += 1
+            for field in confident:
+                self._rule_hits[field] += 1
+            for field in missing:
+                self._llm_fields[field] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            emails = self._emails or 1
+            return {
+                "emails": self._emails,
+                "llm_skipped": self._llm_skipped,
+                "llm_skip_rate": round(self._llm_skipped / emails, 3),
+                "rule_hit_rate": {field: round(hits / emails, 3) for field, hits in self._rule_hits.items()},
+                "llm_fields": dict(self._llm_fields)
+            }
+
+
+_extractors = {}
+_extractors_lock = threading.Lock()
+
+
+# One tiered extractor (and its hit-rate counters) per model_path. The
+# engine is looked up with the config passed to each extract() call, so
+# batching and admission settings changed since are not undone.
+def get_tiered_extractor(config):
+    threshold = config.get("extraction", {}).get("confidence_threshold", DEFAULT_CONFIDENCE_THRESHOLD)
+    with _extractors_lock:
+        extractor = _extractors.get(config["model_path"])
+        if extractor is None:
+            extractor = TieredExtractor(get_extraction_engine, threshold)
+            _extractors[config["model_path"]] = extractor
+        extractor.threshold = threshold
+        return extractor
@@ -0,0 +1,48 @@
+# Gunicorn reads this file from the working directory, so the Procfile's
+# `gunicorn email_parser:app` picks it up without extra flags.
+
+# Import the app once in the master and fork the workers from it. With
+# model_load set to "eager" the weights are loaded here too, so every worker
+# shares the same (memory-mapped) pages instead of loading its own copy.
+preload_app = True
+
+# Loading a model can take longer than gunicorn's default 30 s
+timeout = 120
+
+# Streaming responses (/processor-events, /process-emails, /chat) stay open
+# for as long as the client is connected. A sync worker would be tied up by
+# each one and killed at `timeout`; threaded workers hold just a thread per
+# stream, but that thread is held for the whole connection. Event streams
+# are capped at service.max_event_streams per worker (see email_parser), so
+# open dashboards leave the rest of these threads to ordinary requests. The
+# FastAPI service (app.py) serves streams on its event loop without this limit.
+worker_class = "gthread"
+threads = 64
+
+
+def _load_model(warmup):
+    from email_parser import load_config, load_model
+
+    config = load_config()
+    if config["model_load"] == "eager":
+        load_model(config, warmup=warmup)
+
+
+# Runs in the master after the app is imported and before any worker is
+# forked. No warmup generation here: torch's thread pools do not survive
+# fork, so nothing should run inference in the master.
+def when_ready(server):
+    if preload_app:
+        _load_model(warmup=False)
+
+
+# Without preloading each worker loads (and warms up) its own copy. Every
+# worker then joins the processor election, so exactly one of them runs the
+# ingestion processor while all of them serve requests.
+def post_worker_init(worker):
+    if not preload_app:
+        _load_model(warmup=True)
+
+    from email_parser import start_coordination
+
+    start_coordination()
@@ -0,0 +1,325 @@
+import re
+import time
+import select
+import sqlite3
+import imaplib
+import threading
+
+# Messages are fetched in bulk UID FETCH commands of at most this many UIDs
+FETCH_BATCH_SIZE = 50
+
+# RFC 2177 asks clients to re-issue IDLE at least every 29 minutes
+IDLE_TIMEOUT = 300
+
+# Used instead of IDLE when the server does not advertise it
+POLL_INTERVAL = 60
+
+# How often a blocked IDLE/poll wait re-checks whether it should stop
+STOP_CHECK_INTERVAL = 1.0
+
+RECONNECT_BACKOFF_MAX = 300
+
+UIDVALIDITY_RE = re.compile(rb"UIDVALIDITY (\d+)")
+FETCH_UID_RE = re.compile(rb"UID (\d+)")
+IDLE_NEW_MAIL_RE = re.compile(rb"^\* \d+ (EXISTS|RECENT)")
+
+
+# Yield IMAP sequence sets ("5:9,12") covering `uids` in batches
+def uid_ranges(uids, batch_size=FETCH_BATCH_SIZE):
+    uids = sorted(uids)
+    for start in range(0, len(uids), batch_size):
+        batch = uids[start:start + batch_size]
+        parts = []
+        run_start = run_end = batch[0]
+        for uid in batch[1:]:
+            if uid == run_end + 1:
+                run_end = uid
+                continue
+            parts.append(f"{run_start}:{run_end}" if run_start != run_end else str(run_start))
+            run_start = run_end = uid
+        parts.append(f"{run_start}:{run_end}" if run_start != run_end else str(run_start))
+        yield ",".join(parts)
+
+
+# Identifies a mailbox across restarts (its high-water mark and journal
+# entries are stored under this key)
+def mailbox_key(imap_config):
+    return (f"{imap_config.get('username', '')}@{imap_config.get('server', 'localhost')}:"
+            f"{int(imap_config.get('port', 993))}/{imap_config.get('folder', 'INBOX')}")
+
+
+# Persisted UIDVALIDITY and UID high-water mark per mailbox
+class MailboxState:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS imap_state (
+                mailbox TEXT PRIMARY KEY,
+                uidvalidity INTEGER,
+                last_uid INTEGER NOT NULL DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, mailbox):
+        row = self.conn.execute(
+            "SELECT uidvalidity, last_uid FROM imap_state WHERE mailbox = ?", (mailbox,)
+        ).fetchone()
+        return row if row else (None, 0)
+
+    def set(self, mailbox, uidvalidity, last_uid):
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO imap_state (mailbox, uidvalidity, last_uid, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (mailbox) DO UPDATE SET
+                    uidvalidity = excluded.uidvalidity,
+                    last_uid = excluded.last_uid,
+                    updated_at = excluded.updated_at
+            ''', (mailbox, uidvalidity, last_uid))
+
+    def close(self):
+        self.conn.close()
+
+
+# Keeps one IMAP connection open, waits for new mail with IDLE and
+# fetches only messages above the persisted UID high-water mark
+class ImapIngestor:
+    def __init__(self, imap_config, db_path, stop_event=None):
+        self.server = imap_config.get("server", "localhost")
+        self.port = int(imap_config.get("port", 993))
+        self.username = imap_config.get("username", "")
+        self.password = imap_config.get("password", "")
+        self.folder = imap_config.get("folder", "INBOX")
+        self.use_ssl = imap_config.get("use_ssl", self.port == 993)
+        # "new" starts at the current end of the mailbox on first sync or
+        # after a UIDVALIDITY change; "all" ingests everything already there
+        self.initial_sync = imap_config.get("initial_sync", "new")
+        self.idle_timeout = imap_config.get("idle_timeout", IDLE_TIMEOUT)
+        self.poll_interval = imap_config.get("poll_interval", POLL_INTERVAL)
+
+        self.mailbox_key = mailbox_key(imap_config)
+        self.state = MailboxState(db_path)
+        self.stop_event = stop_event or threading.Event()
+
+        self.conn = None
+        self.uidvalidity = None
+        self.last_uid = 0
+        # Messages above the high-water mark at the last check, not yet fetched
+        self.backlog = 0
+
+    # Connection management
+
+    def connect(self):
+        if self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.server, self.port)
+        else:
+            conn = imaplib.IMAP4(self.server, self.port)
+        conn.login(self.username, self.password)
+
+        status, _ = conn.select(self._quoted_folder(), readonly=True)
+        if status != "OK":
+            conn.logout()
+            raise imaplib.IMAP4.error(f"Cannot select folder {self.folder}")
+
+        self.conn = conn
+        self.uidvalidity = self._read_uidvalidity()
+        self._load_high_water_mark()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.logout()
+            except Exception:
+                pass
+            self.conn = None
+        self.state.close()
+
+    def _quoted_folder(self):
+        return f'"{self.folder}"' if " " in self.folder else self.folder
+
+    def _read_uidvalidity(self):
+        _, data = self.conn.response("UIDVALIDITY")
+        if data and data[0]:
+            return int(data[0])
+        _, data = self.conn.status(self._quoted_folder(), "(UIDVALIDITY)")
+        match = UIDVALIDITY_RE.search(data[0] or b"")
+        return int(match.group(1)) if match else None
+
+    def _load_high_water_mark(self):
+        stored_validity, stored_uid = self.state.get(self.mailbox_key)
+        if stored_validity == self.uidvalidity:
+            self.last_uid = stored_uid
+            return
+
+        # First run, or the server renumbered the mailbox: old UIDs mean nothing
+        if stored_validity is not None:
+            print(f"UIDVALIDITY changed for {self.mailbox_key}, resetting high-water mark")
+        self.last_uid = 0 if self.initial_sync == "all" else self._highest_uid()
+        self.state.set(self.mailbox_key, self.uidvalidity, self.last_uid)
+
+    def _highest_uid(self):
+        status, data = self.conn.uid("SEARCH", None, "ALL")
+        if status != "OK" or not data or not data[0]:
+            return 0
+        return int(data[0].split()[-1])
+
+    # Fetching
+
+    def new_uids(self):
+        # "n:*" always matches the highest UID even when it is below n
+        status, data = self.conn.uid("SEARCH", None, f"UID {self.last_uid + 1}:*")
+        if status != "OK" or not data or not data[0]:
+            return []
+        return [uid for uid in map(int, data[0].split()) if uid > self.last_uid]
+
+    # (uid, raw_message) for the messages of one UID sequence set, in UID order
+    def _fetch_batch(self, sequence_set):
+        status, data = self.conn.uid("FETCH", sequence_set, "(UID BODY.PEEK[])")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"UID FETCH {sequence_set} failed")
+
+        messages = []
+        for item in data:
+            if not isinstance(item, tuple):
+                continue
+            match = FETCH_UID_RE.search(item[0])
+            if match:
+                messages.append((int(match.group(1)), item[1]))
+        messages.sort()
+        return messages
+
+    # Yield (uid, raw_message) for every message above the high-water mark,
+    # advancing and persisting the mark after each fetched batch
+    def fetch_new(self):
+        uids = self.new_uids()
+        self.backlog = len(uids)
+        for sequence_set in uid_ranges(uids):
+            for uid, raw in self._fetch_batch(sequence_set):
+                self.backlog -= 1
+                yield uid, raw
+                self.last_uid = max(self.last_uid, uid)
+            self.state.set(self.mailbox_key, self.uidvalidity, self.last_uid)
+        # Messages expunged before they could be fetched
+        self.backlog = 0
+
+    # Yield (uid, raw_message) for specific UIDs, e.g. messages to process
+    # again after a restart; UIDs no longer in the mailbox are skipped
+    def fetch_uids(self, uids):
+        for sequence_set in uid_ranges(uids):
+            yield from self._fetch_batch(sequence_set)
+
+    # Waiting for new mail
+
+    def supports_idle(self):
+        return "IDLE" in self.conn.capabilities
+
+    # Block until the server reports new mail, the wait times out, or
+    # stop_event is set. Returns True if new mail was announced
+    def wait_for_mail(self):
+        if self.supports_idle():
+            return self._idle(self.idle_timeout)
+
+        deadline = time.monotonic() + self.poll_interval
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            self.stop_event.wait(min(STOP_CHECK_INTERVAL, deadline - time.monotonic()))
+        if self.stop_event.is_set():
+            return False
+        self.conn.noop()
+        return bool(self.new_uids())
+
+    def _idle(self, timeout):
+        conn = self.conn
+        tag = conn._new_tag()
+        conn.send(tag + b" IDLE\r\n")
+
+        # imaplib's buffered reader can hide already-received lines from
+        # select(), so IDLE traffic is read through an unbuffered view of the
+        # socket; imaplib's own buffer is empty between commands
+        reader = conn.sock.makefile("rb", buffering=0)
+        new_mail = False
+        try:
+            line = self._read_line(reader, timeout=30)
+            if line is None or not line.startswith(b"+"):
+                raise imaplib.IMAP4.abort(f"IDLE rejected: {line!r}")
+
+            deadline = time.monotonic() + timeout
+            while not new_mail and not self.stop_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                line = self._read_line(reader, timeout=min(remaining, STOP_CHECK_INTERVAL))
+                if line is None:
+                    continue
+                if line.startswith(b"* BYE"):
+                    raise imaplib.IMAP4.abort(line.decode("utf-8", "replace").strip())
+                if IDLE_NEW_MAIL_RE.match(line):
+                    new_mail = True
+
+            conn.send(b"DONE\r\n")
+            while True:
+                line = self._read_line(reader, timeout=30)
+                if line is None:
+                    raise imaplib.IMAP4.abort("Timed out waiting for IDLE to finish")
+                if line.startswith(tag):
+                    if b" OK" not in line:
+                        raise imaplib.IMAP4.error(line.decode("utf-8", "replace").strip())
+                    break
+                if IDLE_NEW_MAIL_RE.match(line):
+                    new_mail = True
+        finally:
+            reader.close()
+        return new_mail
+
+    def _read_line(self, reader, timeout):
+        sock = self.conn.sock
+        # TLS may already hold decrypted bytes that select() cannot see
+        pending = sock.pending() if hasattr(sock, "pending") else 0
+        if not pending:
+            readable, _, _ = select.select([sock], [], [], timeout)
+            if not readable:
+                return None
+        line = reader.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("Connection closed by server")
+        return line
+
+    # Main loop
+
+    # Call handler(uid, raw_message) for each new message until stop_event
+    # is set, reconnecting with exponential backoff on connection errors.
+    # on_connect() runs after every (re)connect, on_check() before every
+    # mailbox check
+    def run(self, handler, on_error=None, on_check=None, on_connect=None):
+        backoff = 1
+        while not self.stop_event.is_set():
+            try:
+                if self.conn is None:
+                    self.connect()
+                    backoff = 1
+                    if on_connect:
+                        on_connect()
+                if on_check:
+                    on_check()
+                for uid, raw in self.fetch_new():
+                    handler(uid, raw)
+                    if self.stop_event.is_set():
+                        return
+                self.wait_for_mail()
+            except (imaplib.IMAP4.error, OSError) as e:
+                if on_error:
+                    on_error(e)
+                self._drop_connection()
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+    def _drop_connection(self):
+        if self.conn is not None:
+            try:
+                self.conn.shutdown()
+            except Exception:
+                pass
+            self.conn = None
@@ -0,0 +1,435 @@
+import os
+import sqlite3
+import time
+import threading
+import queue
+import atexit
+import base64
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Flush pending log entries once this many are queued or this many seconds
+# have passed since the oldest unflushed entry, whichever comes first
+FLUSH_BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5
+
+# Maximum number of concurrent read connections per store
+READER_POOL_SIZE = 4
+
+# Rows older than the retention window are rolled up into per-hour counts
+DEFAULT_RETENTION_DAYS = 30
+COMPACTION_INTERVAL = 3600
+COMPACTION_CHUNK_SIZE = 5000
+
+MAX_PAGE_SIZE = 500
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# One long-lived store per database file, shared by every caller in the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+# Called from a store's writer thread with the entries of each committed batch
+_listeners = []
+
+
+def get_log_store(db_path, retention_days=None):
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None or store.closed:
+            store = LogStore(db_path)
+            _stores[db_path] = store
+        if retention_days is not None:
+            store.retention_days = retention_days
+        return store
+
+
+def close_all_stores():
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
+
+
+atexit.register(close_all_stores)
+
+
+def add_listener(callback):
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def remove_listener(callback):
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def format_log_row(row):
+    timestamp, email_id, status, message = row
+    return {
+        "timestamp": timestamp,
+        "message": f"Email {email_id}: {message}" if message else f"Email {email_id} processed",
+        "status": "success" if status == "SUCCESS" else "error"
+    }
+
+
+def format_log_entry(row_id, timestamp, email_id, status, message):
+    entry = format_log_row((timestamp, email_id, status, message))
+    entry["id"] = row_id
+    entry["email_id"] = email_id
+    return entry
+
+
+def encode_cursor(timestamp, row_id):
+    raw = f"{timestamp}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def _db_status(status):
+    # Accept both the API spelling ("success") and the stored one ("SUCCESS")
+    return status.upper() if status else None
+
+
+class LogStore:
+    def __init__(self, db_path, batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 retention_days=DEFAULT_RETENTION_DAYS, compaction_interval=COMPACTION_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.compaction_interval = compaction_interval
+        self.closed = False
+        self._stop_event = threading.Event()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        # Flask's threaded server runs each request on a fresh thread, so
+        # readers come from a small pool instead of thread-local connections
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._readers_lock = threading.Lock()
+
+        # The writer connection is created here so schema errors surface to
+        # the caller, then handed over to the writer thread for its lifetime
+        self._writer_conn = self._connect()
+        self._init_db(self._writer_conn)
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name="log-store-writer")
+        self._writer.daemon = True
+        self._writer.start()
+
+        self._maintenance = threading.Thread(target=self._maintenance_loop, name="log-store-maintenance")
+        self._maintenance.daemon = True
+        self._maintenance.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode and only
+        # syncs on checkpoint, instead of on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS processing_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                email_id TEXT,
+                status TEXT,
+                message TEXT
+            )
+        ''')
+        # (timestamp, id) backs the keyset pagination order; the filter
+        # indexes keep status/email_id lookups off a full table scan
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processing_logs_timestamp
+            ON processing_logs (timestamp, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processing_logs_status
+            ON processing_logs (status, timestamp, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_processing_logs_email_id
+            ON processing_logs (email_id, timestamp, id)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS processing_log_rollups (
+                hour TEXT NOT NULL,
+                status TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, status)
+            )
+        ''')
+        conn.commit()
+
+    @contextmanager
+    def _reader(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._readers_lock:
+                can_open = self._reader_count < READER_POOL_SIZE
+                if can_open:
+                    self._reader_count += 1
+            conn = self._connect() if can_open else self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    # Writing
+
+    def log(self, email_id, status, message=""):
+        if self.closed:
+            raise RuntimeError("Log store is closed")
+        # Stamp the entry now rather than at commit time so batching does not
+        # reorder events; the format matches SQLite's CURRENT_TIMESTAMP
+        timestamp = datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        self._queue.put((timestamp, str(email_id), status, message))
+
+    def log_success(self, email_id):
+        self.log(email_id, "SUCCESS", "")
+
+    def log_error(self, email_id, message):
+        self.log(email_id, "ERROR", message)
+
+    def flush(self, timeout=None):
+        if self.closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop_event.set()
+        self._queue.put(None)
+        self._writer.join()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _writer_loop(self):
+        conn = self._writer_conn
+        pending = []
+        waiters = []
+        deadline = None
+        running = True
+
+        while running:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+
+            if item is None:
+                running = False
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not False:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            flush_due = (
+                not running
+                or waiters
+                or len(pending) >= self.batch_size
+                or (deadline is not None and time.monotonic() >= deadline)
+            )
+            if flush_due:
+                if pending:
+                    self._write_batch(conn, pending)
+                    pending = []
+                deadline = None
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+
+        conn.close()
+
+    def _write_batch(self, conn, entries):
+        try:
+            # One statement per row (still one transaction) so listeners get
+            # the row ids, which are the event ids subscribers resume from
+            with conn:
+                row_ids = [
+                    conn.execute('''
+                        INSERT INTO processing_logs (timestamp, email_id, status, message)
+                        VALUES (?, ?, ?, ?)
+                    ''', entry).lastrowid
+                    for entry in entries
+                ]
+        except Exception as e:
+            print(f"Error writing {len(entries)} log entries: {str(e)}")
+            return
+        if _listeners:
+            written = [format_log_entry(row_id, *entry) for row_id, entry in zip(row_ids, entries)]
+            for listener in list(_listeners):
+                try:
+                    listener(written)
+                except Exception as e:
+                    print(f"Error in log listener: {str(e)}")
+
+    # Retention
+
+    def _maintenance_loop(self):
+        while not self._stop_event.wait(self.compaction_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting processing logs: {str(e)}")
+
+    # Roll rows older than the retention window into hourly counts and delete them
+    def compact(self, retention_days=None):
+        if retention_days is None:
+            retention_days = self.retention_days
+        if not retention_days or retention_days <= 0:
+            return 0
+
+        cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime(TIMESTAMP_FORMAT)
+        removed = 0
+        conn = self._connect()
+        try:
+            # Work in bounded chunks so the write lock is never held for long
+            # and the batched writer can interleave its commits
+            while not self._stop_event.is_set():
+                with conn:
+                    conn.execute("DROP TABLE IF EXISTS temp.compaction_chunk")
+                    conn.execute('''
+                        CREATE TEMP TABLE compaction_chunk AS
+                        SELECT id, timestamp, status FROM processing_logs
+                        WHERE timestamp < ?
+                        ORDER BY timestamp, id
+                        LIMIT ?
+                    ''', (cutoff, COMPACTION_CHUNK_SIZE))
+                    count = conn.execute("SELECT COUNT(*) FROM compaction_chunk").fetchone()[0]
+                    if count:
+                        conn.execute('''
+                            INSERT INTO processing_log_rollups (hour, status, count)
+                            SELECT strftime('%Y-%m-%d %H:00:00', timestamp), status, COUNT(*)
+                            FROM compaction_chunk
+                            WHERE true
+                            GROUP BY 1, 2
+                            ON CONFLICT (hour, status) DO UPDATE SET count = count + excluded.count
+                        ''')
+                        conn.execute('''
+                            DELETE FROM processing_logs
+                            WHERE id IN (SELECT id FROM compaction_chunk)
+                        ''')
+                    conn.execute("DROP TABLE compaction_chunk")
+                removed += count
+                if count < COMPACTION_CHUNK_SIZE:
+                    break
+        finally:
+            conn.close()
+        return removed
+
+    # Reading
+
+    def get_logs(self, limit=10):
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT timestamp, email_id, status, message
+                FROM processing_logs
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
+        return [format_log_row(row) for row in rows]
+
+    # Return one page of logs, newest first, plus the cursor for the next page
+    def query_logs(self, limit=50, cursor=None, status=None, email_id=None, since=None, until=None):
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        clauses = []
+        params = []
+
+        if status:
+            clauses.append("status = ?")
+            params.append(_db_status(status))
+        if email_id:
+            clauses.append("email_id = ?")
+            params.append(str(email_id))
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        if cursor:
+            cursor_timestamp, cursor_id = decode_cursor(cursor)
+            clauses.append("(timestamp < ? OR (timestamp = ? AND id < ?))")
+            params.extend([cursor_timestamp, cursor_timestamp, cursor_id])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # Fetch one extra row to learn whether another page exists
+        with self._reader() as conn:
+            rows = conn.execute(f'''
+                SELECT id, timestamp, email_id, status, message
+                FROM processing_logs
+                {where}
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        logs = [format_log_entry(*row) for row in rows]
+
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+        return {"logs": logs, "next_cursor": next_cursor}
+
+    # Entries written after the one with id `after_id`, oldest first
+    def logs_after(self, after_id, limit=MAX_PAGE_SIZE):
+        with self._reader() as conn:
+            rows = conn.execute('''
+                SELECT id, timestamp, email_id, status, message
+                FROM processing_logs
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (after_id, limit)).fetchall()
+        return [format_log_entry(*row) for row in rows]
+
+    def get_rollups(self, since=None, until=None):
+        clauses = []
+        params = []
+        if since:
+            clauses.append("hour >= ?")
+            params.append(since)
+        if until:
+            clauses.append("hour < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._reader() as conn:
+            rows = conn.execute(f'''
+                SELECT hour, status, count
+                FROM processing_log_rollups
+                {where}
+                ORDER BY hour DESC
+            ''', params).fetchall()
+
+        rollups = {}
+        for hour, status, count in rows:
+            bucket = rollups.setdefault(hour, {"hour": hour, "success": 0, "error": 0})
+            bucket["success" if status == "SUCCESS" else "error"] += count
+        return list(rollups.values())
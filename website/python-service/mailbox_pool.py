@@ -0,0 +1,471 @@
+import os
+import time
+import queue
+import signal
+import threading
+import multiprocessing
+from collections import deque
+from datetime import datetime
+from functools import partial
+
+from imap_ingest import ImapIngestor, mailbox_key, STOP_CHECK_INTERVAL
+from message_journal import MessageJournal, DEFAULT_MAX_ATTEMPTS, DEFAULT_RETENTION_DAYS
+
+# Processes the mailboxes are sharded across (never more than there are
+# mailboxes); 0 fetches them on threads of the processor's own process
+DEFAULT_PROCESSES = 2
+# Messages of one mailbox fetched but not yet processed; its fetcher waits
+# above this high-water mark
+DEFAULT_MAX_IN_FLIGHT = 20
+# How often a shard sends the state of its mailboxes (when it changed)
+REPORT_INTERVAL = 1.0
+# Throughput is the rate of messages processed over this many seconds
+THROUGHPUT_WINDOW = 60
+# How often the pool checks that its shards are still alive, how long a
+# stopping shard may take before it is terminated, and how long to wait
+# before replacing a pool whose shard died
+SUPERVISE_INTERVAL = 1.0
+SHARD_STOP_TIMEOUT = 30
+RESTART_DELAY = 5
+# A mailbox whose ingestor fails outside the IMAP reconnect loop (e.g. its
+# database is unavailable) is retried after this long
+RETRY_DELAY = 30
+
+
+# The mailboxes to ingest: each "mailboxes" entry layered over the "imap"
+# settings, or the "imap" mailbox alone when there are none. Duplicates are
+# dropped and every source gets a unique name (its key unless it has one).
+def mailbox_sources(config):
+    sources = []
+    keys = set()
+    names = set()
+    for entry in config.get("mailboxes") or [{}]:
+        source = dict(config["imap"], **entry)
+        source["key"] = mailbox_key(source)
+        if source["key"] in keys:
+            continue
+        name = source.get("name") or source["key"]
+        source["name"] = name if name not in names else source["key"]
+        keys.add(source["key"])
+        names.add(source["name"])
+        sources.append(source)
+    return sources
+
+
+# Whether a running pool must be replaced for the new configuration
+def mailbox_settings_changed(old_config, new_config):
+    return (old_config["imap"] != new_config["imap"]
+            or old_config.get("mailboxes") != new_config.get("mailboxes")
+            or old_config["db_path"] != new_config["db_path"]
+            or old_config["processor"].get("mailbox_processes") != new_config["processor"].get("mailbox_processes"))
+
+
+# Spaces messages at least 60 / per_minute seconds apart (no limit when
+# per_minute is 0 or None)
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute else 0
+        self._next = 0.0
+
+    # False if stop_event was set while waiting
+    def wait(self, stop_event):
+        if not self.interval:
+            return True
+        delay = self._next - time.monotonic()
+        if delay > 0 and stop_event.wait(delay):
+            return False
+        self._next = max(self._next, time.monotonic()) + self.interval
+        return True
+
+
+# Shard side
+
+# Ingests one mailbox on its own thread and IMAP connection. New mail and
+# journal entries left unfinished by an earlier run are journaled and sent
+# to the pool as ("message", name, entry_id, uid, raw, seen_at); each holds
+# one of the mailbox's credits until the pool has processed it.
+class MailboxFetcher:
+    def __init__(self, source, db_path, journal, messages, credits, stop_event):
+        self.source = source
+        self.name = source["name"]
+        self.key = source["key"]
+        self.db_path = db_path
+        self.journal = journal
+        self.messages = messages
+        self.credits = credits
+        self.stop_event = stop_event
+        self.limiter = RateLimiter(source.get("max_per_minute"))
+
+        self.ingestor = None
+        self.fetched = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_check = None
+        self.backlog_since = None
+        # When the check that found the messages being fetched ran
+        self._seen_at = None
+        self._unfinished = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.ingestor = ImapIngestor(self.source, self.db_path, self.stop_event)
+                try:
+                    self.ingestor.run(self._handle, on_error=self._error, on_check=self._check,
+                                      on_connect=self._resume)
+                finally:
+                    self.ingestor.close()
+            except Exception as e:
+                # One broken mailbox must not stop the others
+                self._error(e)
+                self.stop_event.wait(RETRY_DELAY)
+
+    def _send(self, entry_id, uid, raw):
+        while not self.credits.acquire(timeout=STOP_CHECK_INTERVAL):
+            if self.stop_event.is_set():
+                return False
+        self.messages.put(("message", self.name, entry_id, uid, raw, self._seen_at))
+        return True
+
+    def _handle(self, uid, raw):
+        if not self.limiter.wait(self.stop_event):
+            return
+        # A message journaled before is either finished or resumed on connect
+        entry_id = self.journal.record_fetched(self.key, self.ingestor.uidvalidity, uid)
+        if entry_id is not None and self._send(entry_id, uid, raw):
+            self.fetched += 1
+
+    # Unfinished entries are read once per run; after a reconnect, recovery
+    # carries on with whatever is left of them
+    def _resume(self):
+        if self._unfinished is None:
+            self._unfinished = self.journal.resume(self.key)
+            if self._unfinished:
+                self._log("info", f"Resuming {len(self._unfinished)} unfinished emails from {self.name}")
+        self._seen_at = time.time()
+        self.journal.recover(self.ingestor, self._unfinished, self._send)
+
+    def _check(self):
+        self._seen_at = time.time()
+        self.last_check = datetime.now().isoformat()
+        self.messages.put(("check", self.name))
+
+    def _error(self, error):
+        self.errors += 1
+        self.last_error = str(error)
+        self._log("error", f"IMAP connection error ({self.name}): {str(error)}")
+
+    def _log(self, level, message):
+        self.messages.put(("log", level, message))
+
+    def report(self):
+        ingestor = self.ingestor
+        backlog = ingestor.backlog if ingestor else 0
+        if not backlog:
+            self.backlog_since = None
+        elif self.backlog_since is None:
+            self.backlog_since = self._seen_at
+        return {
+            "connected": ingestor is not None and ingestor.conn is not None,
+            "uidvalidity": ingestor.uidvalidity if ingestor else None,
+            "high_water_mark": ingestor.last_uid if ingestor else 0,
+            "backlog": backlog,
+            "backlog_since": self.backlog_since,
+            "fetched": self.fetched,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_check": self.last_check
+        }
+
+
+# Runs the fetchers of one shard until stop_event is set, sending each
+# mailbox's state to the pool as ("report", name, state) whenever it changes.
+# Runs in a shard process, or on a thread when the pool has no processes.
+def run_shard(sources, db_path, journal_settings, messages, credits, stop_event):
+    journal = MessageJournal(db_path, **journal_settings)
+    fetchers = [MailboxFetcher(source, db_path, journal, messages, credits[source["name"]], stop_event)
+                for source in sources]
+    threads = []
+    for fetcher in fetchers:
+        thread = threading.Thread(target=fetcher.run, name=f"mailbox-{fetcher.name}")
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    reported = {}
+
+    def report():
+        for fetcher in fetchers:
+            state = fetcher.report()
+            if reported.get(fetcher.name) != state:
+                reported[fetcher.name] = state
+                messages.put(("report", fetcher.name, state))
+
+    try:
+        while not stop_event.wait(REPORT_INTERVAL):
+            report()
+        for thread in threads:
+            thread.join()
+        report()
+    finally:
+        journal.close()
+
+
+# A shard process stops when the pool raises stop_flag (a shared byte; a
+# multiprocessing Event cannot be set any more once a process waiting on it
+# has been killed) or when the processor's process is gone
+def _shard_process(sources, db_path, journal_settings, messages, credits, stop_flag):
+    # Ctrl+C reaches the whole process group; the pool decides when shards stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parent = os.getppid()
+    stop_event = threading.Event()
+
+    def watch():
+        while not stop_flag.value and os.getppid() == parent:
+            time.sleep(STOP_CHECK_INTERVAL)
+        stop_event.set()
+
+    watcher = threading.Thread(target=watch, name="mailbox-shard-watcher")
+    watcher.daemon = True
+    watcher.start()
+    run_shard(sources, db_path, journal_settings, messages, credits, stop_event)
+
+
+# Pool side
+
+class SourceState:
+    def __init__(self, source, shard):
+        self.name = source["name"]
+        self.mailbox = source["key"]
+        self.shard = shard
+        self.max_per_minute = source.get("max_per_minute") or 0
+        self.max_in_flight = max(1, int(source.get("max_in_flight") or DEFAULT_MAX_IN_FLIGHT))
+        # Released as messages finish; the fetcher takes one per message
+        self.credits = None
+        self.report = {}
+        # Received, waiting for their turn in the pipeline
+        self.queued = deque()
+        self.in_flight = 0
+        # entry_id -> seen_at of every message queued or in the pipeline
+        self.pending = {}
+        self.processed = 0
+        self.failed = 0
+        self.completed = deque()
+
+    def to_dict(self, now, started):
+        cutoff = time.monotonic() - THROUGHPUT_WINDOW
+        while self.completed and self.completed[0] < cutoff:
+            self.completed.popleft()
+        window = min(THROUGHPUT_WINDOW, max(time.monotonic() - started, 1e-6))
+        # Lag is how long the oldest message not yet processed (fetched or
+        # still on the server) has been known
+        waiting_since = [t for t in list(self.pending.values()) + [self.report.get("backlog_since")] if t]
+        return {
+            "name": self.name,
+            "mailbox": self.mailbox,
+            "shard": self.shard,
+            "connected": self.report.get("connected", False),
+            "uidvalidity": self.report.get("uidvalidity"),
+            "high_water_mark": self.report.get("high_water_mark", 0),
+            "backlog": self.report.get("backlog", 0),
+            "queued": len(self.queued),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_per_minute": self.max_per_minute,
+            "fetched": self.report.get("fetched", 0),
+            "processed": self.processed,
+            "failed": self.failed,
+            "throughput_per_min": round(len(self.completed) * 60 / window, 2),
+            "lag_seconds": round(now - min(waiting_since), 1) if waiting_since else 0,
+            "errors": self.report.get("errors", 0),
+            "last_error": self.report.get("last_error"),
+            "last_check": self.report.get("last_check")
+        }
+
+
+# Ingests every configured mailbox into one pipeline. The mailboxes are
+# sharded across a pool of processes, each keeping one IMAP connection per
+# mailbox of its shard, and the fetched messages come back here, where they
+# enter the pipeline round-robin by mailbox so a busy one cannot starve the
+# rest. Each mailbox has its own rate limit (max_per_minute) and high-water
+# mark (max_in_flight messages fetched but not yet processed), and its UID
+# high-water mark and journal entries are kept as for a single mailbox.
+# submit(entry_id, uid, raw, callback=...) is the pipeline's submit().
+class MailboxPool:
+    def __init__(self, config, submit, log=None, on_check=None):
+        settings = config["processor"]
+        self.sources = mailbox_sources(config)
+        self.db_path = config["db_path"]
+        self.journal_settings = {
+            "max_attempts": settings.get("max_attempts", DEFAULT_MAX_ATTEMPTS),
+            "retention_days": settings.get("journal_retention_days", DEFAULT_RETENTION_DAYS)
+        }
+        self.processes = min(settings.get("mailbox_processes", DEFAULT_PROCESSES), len(self.sources))
+        self.submit = submit
+        self.log = log or (lambda level, message: print(message))
+        self.on_check = on_check
+        self.crashed = False
+
+        # Processes are spawned rather than forked: the processor's process
+        # runs many threads and may hold the model
+        self._context = multiprocessing.get_context("spawn") if self.processes > 0 else None
+        primitives = self._context or threading
+        self.stop_event = threading.Event()
+        self._stop_flag = self._context.RawValue("b", 0) if self._context else None
+        self.messages = self._context.Queue() if self._context else queue.Queue()
+
+        shard_count = max(self.processes, 1)
+        self._states = {}
+        for index, source in enumerate(self.sources):
+            state = SourceState(source, index % shard_count)
+            state.credits = primitives.Semaphore(state.max_in_flight)
+            self._states[source["name"]] = state
+        self._shards = []
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._received_all = False
+        self._abandoned = False
+        self._receiver = None
+        self._dispatcher = None
+        self._started = time.monotonic()
+
+    def start(self):
+        shard_count = max(self.processes, 1)
+        for index in range(shard_count):
+            sources = self.sources[index::shard_count]
+            credits = {source["name"]: self._states[source["name"]].credits for source in sources}
+            args = (sources, self.db_path, self.journal_settings, self.messages, credits)
+            if self._context:
+                shard = self._context.Process(target=_shard_process, args=args + (self._stop_flag,),
+                                              name=f"mailbox-shard-{index + 1}")
+            else:
+                shard = threading.Thread(target=run_shard, args=args + (self.stop_event,),
+                                         name=f"mailbox-shard-{index + 1}")
+            shard.daemon = True
+            shard.start()
+            self._shards.append(shard)
+
+        self._receiver = threading.Thread(target=self._receive_loop, name="mailbox-receiver")
+        self._receiver.daemon = True
+        self._receiver.start()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="mailbox-dispatcher")
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+        return self
+
+    # False, with `crashed` set, once a shard has exited on its own
+    def check(self):
+        for shard in self._shards:
+            if not shard.is_alive() and not self.stop_event.is_set():
+                self.crashed = True
+                self.log("error", f"Mailbox shard {shard.name} exited unexpectedly "
+                                  f"(exit code {getattr(shard, 'exitcode', None)})")
+                return False
+        return True
+
+    # Block until the pool is stopped (stop_event is set) or a shard exits
+    # on its own; an event loop polls check() instead
+    def supervise(self):
+        while not self.stop_event.wait(SUPERVISE_INTERVAL):
+            if not self.check():
+                return
+
+    # Stop the shards, then let every message they fetched go through the
+    # pipeline, so nothing is left for the journal to resume but what a
+    # crash interrupted
+    def stop(self):
+        self.stop_event.set()
+        if self._stop_flag is not None:
+            self._stop_flag.value = 1
+        for shard in self._shards:
+            shard.join(SHARD_STOP_TIMEOUT)
+            if shard.is_alive() and hasattr(shard, "terminate"):
+                shard.terminate()
+                shard.join()
+        # A shard thread stuck on a dead connection cannot be terminated; its
+        # fetched messages are journaled and resumed by the next pool
+        self._abandoned = True
+        if self._receiver is not None:
+            self._receiver.join()
+            self._dispatcher.join()
+        with self._cond:
+            while any(state.in_flight for state in self._states.values()):
+                self._cond.wait()
+
+    def _shards_done(self):
+        return self.stop_event.is_set() and (self._abandoned or not any(s.is_alive() for s in self._shards))
+
+    def _receive_loop(self):
+        while True:
+            try:
+                item = self.messages.get(timeout=STOP_CHECK_INTERVAL)
+            except queue.Empty:
+                if self._shards_done():
+                    break
+                continue
+            try:
+                self._receive(item)
+            except Exception as e:
+                print(f"Error handling mailbox shard message: {str(e)}")
+        with self._cond:
+            self._received_all = True
+            self._cond.notify_all()
+
+    def _receive(self, item):
+        kind = item[0]
+        if kind == "message":
+            _, name, entry_id, uid, raw, seen_at = item
+            with self._cond:
+                state = self._states[name]
+                if not state.queued:
+                    self._ready.append(name)
+                state.queued.append((entry_id, uid, raw))
+                state.pending[entry_id] = seen_at or time.time()
+                self._cond.notify_all()
+        elif kind == "report":
+            with self._cond:
+                self._states[item[1]].report = item[2]
+        elif kind == "check":
+            if self.on_check:
+                self.on_check(item[1])
+        elif kind == "log":
+            self.log(item[1], item[2])
+
+    # One message per mailbox in turn; submit() blocks while the pipeline is full
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._received_all:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                name = self._ready.popleft()
+                state = self._states[name]
+                entry_id, uid, raw = state.queued.popleft()
+                if state.queued:
+                    self._ready.append(name)
+                state.in_flight += 1
+            try:
+                self.submit(entry_id, uid, raw, callback=partial(self._finished, state, entry_id))
+            except Exception as e:
+                print(f"Error submitting email uid_{uid} from {name}: {str(e)}")
+                self._finished(state, entry_id, None, e)
+
+    # Pipeline callback: the message is done and its credit goes back to the
+    # mailbox's fetcher
+    def _finished(self, state, entry_id, result, error):
+        with self._cond:
+            state.in_flight -= 1
+            state.pending.pop(entry_id, None)
+            if error is None:
+                state.processed += 1
+            else:
+                state.failed += 1
+            state.completed.append(time.monotonic())
+            self._cond.notify_all()
+        state.credits.release()
+
+    def stats(self):
+        now = time.time()
+        with self._cond:
+            return [state.to_dict(now, self._started) for state in self._states.values()]
@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Each fetched message moves forward through these states; the last two are final
+FETCHED = "fetched"
+PARSED = "parsed"
+EXTRACTED = "extracted"
+EXPORTED = "exported"
+ACKNOWLEDGED = "acknowledged"
+FAILED = "failed"
+
+UNFINISHED = (FETCHED, PARSED, EXTRACTED, EXPORTED)
+
+# A message in flight during this many restarts is given up on, so one that
+# crashes the processor cannot do so forever
+DEFAULT_MAX_ATTEMPTS = 3
+# How often exported messages are confirmed (the export sink flushed) and
+# marked acknowledged
+CHECKPOINT_INTERVAL = 5
+# Finished entries are kept this long, for Message-ID deduplication
+DEFAULT_RETENTION_DAYS = 30
+PRUNE_CHUNK_SIZE = 5000
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_message_journal(config):
+    global _journal
+    settings = config.get("processor", {})
+    with _journal_lock:
+        if _journal is None or _journal.db_path != config["db_path"]:
+            _journal = MessageJournal(config["db_path"])
+        _journal.max_attempts = settings.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+        _journal.retention_days = settings.get("journal_retention_days", DEFAULT_RETENTION_DAYS)
+        return _journal
+
+
+# Pipeline parse stage for journaled messages, whose items are
+# (entry_id, uid, raw_message). A resumed entry that already got past
+# extraction has no raw message and skips parsing.
+def parse_journaled(parse, entry_id, uid, raw):
+    if raw is None:
+        return {"journal_id": entry_id, "uid": uid, "resumed": True}
+    parsed = parse(uid, raw)
+    parsed["journal_id"] = entry_id
+    return parsed
+
+
+# Durable record of every message the processor has taken from a mailbox
+# and how far it got: fetched -> parsed -> extracted -> exported ->
+# acknowledged (or failed). Each transition is its own small commit in
+# SQLite's write-ahead log, so after a crash the unfinished entries say
+# exactly what is left to do: resume() returns only those, and extraction
+# results are kept so a resumed message never runs inference twice.
+# Entries are keyed by mailbox, UIDVALIDITY and UID; the Message-ID found
+# at parse time lets a redelivered copy reuse an earlier extraction.
+class MessageJournal:
+    def __init__(self, db_path, max_attempts=DEFAULT_MAX_ATTEMPTS, retention_days=DEFAULT_RETENTION_DAYS):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retention_days = retention_days
+        self.on_prune = None
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS message_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                message_id TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                extracted_data TEXT,
+                work_order_id INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (mailbox, uidvalidity, uid)
+            )
+        ''')
+        # Unfinished entries are found through the state index, so recovery
+        # reads only the in-flight messages however long the journal is
+        self._conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_message_journal_state
+            ON message_journal (state, updated_at)
+        ''')
+        self._conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_message_journal_message_id
+            ON message_journal (message_id)
+        ''')
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+        self._checkpointer = None
+        self._checkpoint_stop = None
+
+    # Journal a message before it enters the pipeline. Returns its entry id,
+    # or None if this message was journaled before (it is either finished or
+    # will be resumed, so must not be processed again)
+    def record_fetched(self, mailbox, uidvalidity, uid):
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute('''
+                INSERT INTO message_journal (mailbox, uidvalidity, uid, state, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (mailbox, uidvalidity, uid) DO NOTHING
+            ''', (mailbox, uidvalidity or 0, uid, FETCHED, now, now))
+        return cursor.lastrowid if cursor.rowcount == 1 else None
+
+    def _advance(self, entry_id, state, **fields):
+        assignments = "".join(f", {name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f'''
+                UPDATE message_journal SET state = ?, updated_at = ?{assignments}
+                WHERE id = ? AND state NOT IN (?, ?)
+            ''', [state, time.time()] + list(fields.values()) + [entry_id, ACKNOWLEDGED, FAILED])
+
+    def mark_parsed(self, entry_id, message_id):
+        self._advance(entry_id, PARSED, message_id=message_id)
+
+    def mark_extracted(self, entry_id, extracted_data):
+        self._advance(entry_id, EXTRACTED, extracted_data=json.dumps(extracted_data, default=str))
+
+    def mark_exported(self, entry_id, work_order_id):
+        self._advance(entry_id, EXPORTED, work_order_id=work_order_id)
+
+    def mark_failed(self, entry_id, error):
+        self._advance(entry_id, FAILED, error=str(error))
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT id, mailbox, uidvalidity, uid, message_id, state, attempts, extracted_data, work_order_id
+                FROM message_journal WHERE id = ?
+            ''', (entry_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    @staticmethod
+    def _entry(row):
+        entry_id, mailbox, uidvalidity, uid, message_id, state, attempts, extracted_data, work_order_id = row
+        return {
+            "id": entry_id,
+            "mailbox": mailbox,
+            "uidvalidity": uidvalidity,
+            "uid": uid,
+            "message_id": message_id,
+            "state": state,
+            "attempts": attempts,
+            "extracted_data": json.loads(extracted_data) if extracted_data else None,
+            "work_order_id": work_order_id
+        }
+
+    # Extraction already done for this Message-ID under another entry
+    def find_extracted(self, message_id, exclude_id=None):
+        with self._lock:
+            row = self._conn.execute('''
+                SELECT extracted_data FROM message_journal
+                WHERE message_id = ? AND id != ? AND extracted_data IS NOT NULL AND state != ?
+                ORDER BY id DESC LIMIT 1
+            ''', (message_id, exclude_id or 0, FAILED)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Unfinished entries of `mailbox`, counting this as another attempt;
+    # entries past max_attempts are marked failed instead
+    def resume(self, mailbox):
+        placeholders = ", ".join("?" for _ in UNFINISHED)
+        with self._lock, self._conn:
+            rows = self._conn.execute(f'''
+                SELECT id, mailbox, uidvalidity, uid, message_id, state, attempts, extracted_data, work_order_id
+                FROM message_journal
+                WHERE state IN ({placeholders}) AND mailbox = ?
+                ORDER BY id
+            ''', list(UNFINISHED) + [mailbox]).fetchall()
+            entries = [self._entry(row) for row in rows]
+            now = time.time()
+            for entry in entries:
+                entry["attempts"] += 1
+                if entry["attempts"] > self.max_attempts:
+                    entry["state"] = FAILED
+                    self._conn.execute(
+                        "UPDATE message_journal SET state = ?, error = ?, attempts = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, f"Interrupted {entry['attempts'] - 1} times, giving up", entry["attempts"], now,
+                         entry["id"]))
+                else:
+                    self._conn.execute(
+                        "UPDATE message_journal SET attempts = ? WHERE id = ?", (entry["attempts"], entry["id"]))
+        return [entry for entry in entries if entry["state"] != FAILED]
+
+    # Resubmit `entries` (from resume() for the ingestor's mailbox): those
+    # past extraction go straight to the export stage, earlier ones are
+    # fetched again by UID. submit(entry_id, uid, raw_message) feeds the
+    # pipeline. Entries leave the list as they are submitted, so after a
+    # connection error another call with the same list carries on.
+    def recover(self, ingestor, entries, submit):
+        refetch = {}
+        for entry in list(entries):
+            if entry["state"] in (EXTRACTED, EXPORTED):
+                submit(entry["id"], entry["uid"], None)
+                entries.remove(entry)
+            elif entry["uidvalidity"] == (ingestor.uidvalidity or 0):
+                refetch[entry["uid"]] = entry
+            else:
+                self.mark_failed(entry["id"], "Mailbox was renumbered (UIDVALIDITY changed)")
+                entries.remove(entry)
+        for uid, raw in ingestor.fetch_uids(list(refetch)):
+            entry = refetch.pop(uid, None)
+            if entry is not None:
+                submit(entry["id"], uid, raw)
+                entries.remove(entry)
+        for entry in refetch.values():
+            self.mark_failed(entry["id"], "Message is no longer in the mailbox")
+            entries.remove(entry)
+
+    # Checkpointing
+
+    # The export sink marks an entry exported once its row is written (or
+    # dead-lettered), and exported entries are acknowledged here. flush()
+    # (which returns once everything submitted so far is written) runs first,
+    # so rows still waiting in the sink's memory are acknowledged as well.
+    def checkpoint(self, flush):
+        with self._lock:
+            pending = self._conn.execute(
+                "SELECT 1 FROM message_journal WHERE state IN (?, ?) LIMIT 1", (EXTRACTED, EXPORTED)).fetchone()
+        acknowledged = 0
+        if pending:
+            flush()
+            with self._lock, self._conn:
+                acknowledged = self._conn.execute(
+                    "UPDATE message_journal SET state = ?, updated_at = ? WHERE state = ?",
+                    (ACKNOWLEDGED, time.time(), EXPORTED)).rowcount
+        self.prune()
+        return acknowledged
+
+    # Entries finished more than retention_days ago are deleted; on_prune
+    # (if set) is then called with each Message-ID left without an entry,
+    # so whatever the email held (its attachments) can be released
+    def prune(self, retention_days=None):
+        if retention_days is None:
+            retention_days = self.retention_days
+        if not retention_days or retention_days <= 0:
+            return 0
+        cutoff = time.time() - retention_days * 86400
+        removed = 0
+        message_ids = set()
+        # Bounded chunks, so the write lock is never held for long
+        while True:
+            with self._lock, self._conn:
+                rows = self._conn.execute('''
+                    SELECT id, message_id FROM message_journal
+                    WHERE state IN (?, ?) AND updated_at < ?
+                    LIMIT ?
+                ''', (ACKNOWLEDGED, FAILED, cutoff, PRUNE_CHUNK_SIZE)).fetchall()
+                self._conn.executemany("DELETE FROM message_journal WHERE id = ?", [(row[0],) for row in rows])
+            removed += len(rows)
+            message_ids.update(row[1] for row in rows if row[1])
+            if len(rows) < PRUNE_CHUNK_SIZE:
+                break
+        if self.on_prune is not None:
+            for message_id in message_ids:
+                with self._lock:
+                    kept = self._conn.execute(
+                        "SELECT 1 FROM message_journal WHERE message_id = ? LIMIT 1", (message_id,)).fetchone()
+                if kept:
+                    continue
+                try:
+                    self.on_prune(message_id)
+                except Exception as e:
+                    print(f"Error releasing pruned email {message_id}: {str(e)}")
+        return removed
+
+    # Checkpoint every `interval` seconds on a background thread while the
+    # processor runs in this process (flush must reach the export sink the
+    # processor submits to)
+    def start_checkpoints(self, flush, interval=CHECKPOINT_INTERVAL):
+        if self._checkpointer is not None:
+            return
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.checkpoint(flush)
+                except Exception as e:
+                    print(f"Error checkpointing message journal: {str(e)}")
+
+        self._checkpoint_stop = stop
+        self._checkpointer = threading.Thread(target=loop, name="message-journal-checkpoint")
+        self._checkpointer.daemon = True
+        self._checkpointer.start()
+
+    # Stop checkpointing, after a last checkpoint once the pipeline has drained
+    def stop_checkpoints(self, flush=None):
+        if self._checkpointer is not None:
+            self._checkpoint_stop.set()
+            self._checkpointer.join()
+            self._checkpointer = None
+        if flush is not None:
+            self.checkpoint(flush)
+
+    # Entries per unfinished state; reads only the in-flight part of the index
+    def stats(self):
+        placeholders = ", ".join("?" for _ in UNFINISHED)
+        with self._lock:
+            rows = self._conn.execute(f'''
+                SELECT state, COUNT(*) FROM message_journal
+                WHERE state IN ({placeholders})
+                GROUP BY state
+            ''', UNFINISHED).fetchall()
+        counts = dict(rows)
+        stats = {state: counts.get(state, 0) for state in UNFINISHED}
+        stats["in_flight"] = sum(stats.values())
+        return stats
+
+    def close(self):
+        self.stop_checkpoints()
+        with self._lock:
+            self._conn.close()
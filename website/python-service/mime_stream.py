@@ -0,0 +1,349 @@
+import os
+import mmap
+import hashlib
+import binascii
+import tempfile
+from email.parser import BytesHeaderParser
+from email.policy import default as default_policy
+
+# Decoded size caps; attachments from field techs are mostly photos and PDFs
+MAX_PART_SIZE = 25 * 1024 * 1024
+MAX_MESSAGE_SIZE = 50 * 1024 * 1024
+
+# Inline text/plain and text/html bodies are kept in memory up to this size
+MAX_TEXT_SIZE = 256 * 1024
+
+# Chunk size used when feeding an in-memory message or a file through the parser
+FEED_CHUNK_SIZE = 64 * 1024
+
+_header_parser = BytesHeaderParser(policy=default_policy)
+
+
+class MessageTooLarge(ValueError):
+    pass
+
+
+class Attachment:
+    def __init__(self, filename, content_type, path, size, sha256=None):
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.size = size
+        # Hash of the decoded content, computed while spooling
+        self.sha256 = sha256
+
+    # Map the spooled file instead of reading it, so consumers get a
+    # memoryview over the page cache rather than a copy
+    def open_memoryview(self):
+        with open(self.path, "rb") as f:
+            if self.size == 0:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def remove(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def to_dict(self):
+        return {
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "path": self.path,
+            "size": self.size,
+            "sha256": self.sha256
+        }
+
+
+class ParsedEmail:
+    def __init__(self, headers):
+        self.headers = headers
+        self.text = ""
+        self.html = ""
+        self.text_truncated = False
+        self.attachments = []
+
+    def get(self, name, default=""):
+        value = self.headers.get(name) if self.headers is not None else None
+        return str(value) if value is not None else default
+
+    def cleanup(self):
+        for attachment in self.attachments:
+            attachment.remove()
+
+
+class _Base64Decoder:
+    def __init__(self):
+        self._pending = b""
+
+    def feed(self, line):
+        data = self._pending + b"".join(line.split())
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b""
+
+    def flush(self):
+        data, self._pending = self._pending, b""
+        if not data:
+            return b""
+        return binascii.a2b_base64(data + b"=" * (-len(data) % 4))
+
+
+class _QuotedPrintableDecoder:
+    def feed(self, line):
+        return binascii.a2b_qp(line)
+
+    def flush(self):
+        return b""
+
+
+class _IdentityDecoder:
+    def feed(self, line):
+        return line
+
+    def flush(self):
+        return b""
+
+
+def _decoder_for(encoding):
+    encoding = (encoding or "7bit").lower()
+    if encoding == "base64":
+        return _Base64Decoder()
+    if encoding == "quoted-printable":
+        return _QuotedPrintableDecoder()
+    return _IdentityDecoder()
+
+
+class _Part:
+    def __init__(self, headers, parser):
+        self.headers = headers
+        self.content_type = headers.get_content_type()
+        self.boundary = headers.get_param("boundary") if headers.get_content_maintype() == "multipart" else None
+        self.decoder = _decoder_for(headers.get("Content-Transfer-Encoding"))
+        self.size = 0
+        self.parser = parser
+        self.file = None
+        self.path = None
+        self.text = None
+        self.digest = None
+
+        filename = headers.get_filename()
+        disposition = headers.get_content_disposition()
+        is_inline_text = self.content_type in ("text/plain", "text/html") and disposition != "attachment" and not filename
+        if self.boundary is None and not is_inline_text:
+            self.filename = filename or f"part{len(parser.result.attachments) + 1}"
+            fd, self.path = tempfile.mkstemp(prefix="att-", dir=parser.temp_dir)
+            self.file = os.fdopen(fd, "wb")
+            self.digest = hashlib.sha256()
+        elif is_inline_text:
+            self.text = bytearray()
+
+    def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.size > self.parser.max_part_size:
+            raise MessageTooLarge(f"Part exceeds {self.parser.max_part_size} bytes")
+        if self.file is not None:
+            self.file.write(data)
+            self.digest.update(data)
+        elif self.text is not None:
+            room = self.parser.max_text_size - len(self.text)
+            if len(data) > room:
+                self.parser.result.text_truncated = True
+            self.text += data[:max(room, 0)]
+
+    def finish(self):
+        self.write(self.decoder.flush())
+        result = self.parser.result
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            result.attachments.append(Attachment(
+                self.filename, self.content_type, self.path, self.size, self.digest.hexdigest()))
+        elif self.text is not None:
+            charset = self.headers.get_content_charset() or "utf-8"
+            try:
+                decoded = self.text.decode(charset, "replace")
+            except LookupError:
+                decoded = self.text.decode("utf-8", "replace")
+            if self.content_type == "text/plain" and not result.text:
+                result.text = decoded
+            elif self.content_type == "text/html" and not result.html:
+                result.html = decoded
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Incremental MIME parser. Bytes are fed in arbitrary chunks; each leaf
+# part is transfer-decoded line by line and written straight to a file in
+# temp_dir (attachments) or a size-capped buffer (inline text), so neither
+# the raw message nor its decoded parts have to fit in memory.
+class StreamingMimeParser:
+    def __init__(self, temp_dir, max_part_size=MAX_PART_SIZE,
+                 max_message_size=MAX_MESSAGE_SIZE, max_text_size=MAX_TEXT_SIZE):
+        os.makedirs(temp_dir, exist_ok=True)
+        self.temp_dir = temp_dir
+        self.max_part_size = max_part_size
+        self.max_message_size = max_message_size
+        self.max_text_size = max_text_size
+
+        self.result = None
+        self._buffer = b""
+        self._received = 0
+        self._header_lines = []
+        self._in_headers = True
+        # Stack of enclosing multipart boundaries, innermost last
+        self._boundaries = []
+        self._part = None
+        self._held_newline = b""
+        self._closed = False
+
+    def feed(self, chunk):
+        self._received += len(chunk)
+        if self._received > self.max_message_size:
+            self._abort()
+            raise MessageTooLarge(f"Message exceeds {self.max_message_size} bytes")
+
+        data = self._buffer + bytes(chunk)
+        start = 0
+        try:
+            while True:
+                end = data.find(b"\n", start)
+                if end == -1:
+                    break
+                self._line(data[start:end + 1])
+                start = end + 1
+        except Exception:
+            self._abort()
+            raise
+        self._buffer = data[start:]
+
+    def close(self):
+        if self._closed:
+            return self.result
+        try:
+            if self._buffer:
+                self._line(self._buffer)
+                self._buffer = b""
+            if self._in_headers:
+                self._end_headers()
+            self._finish_part()
+        except Exception:
+            self._abort()
+            raise
+        self._closed = True
+        return self.result
+
+    def _line(self, line):
+        if self._in_headers:
+            if line in (b"\r\n", b"\n"):
+                self._end_headers()
+            else:
+                self._header_lines.append(line)
+            return
+
+        stripped = line.rstrip(b"\r\n")
+        if stripped.startswith(b"--") and self._boundaries:
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                boundary = self._boundaries[depth]
+                if stripped == b"--" + boundary or stripped == b"--" + boundary + b"--":
+                    # The newline before a boundary belongs to the boundary
+                    self._held_newline = b""
+                    self._finish_part()
+                    del self._boundaries[depth + 1:]
+                    if stripped.endswith(b"--") and stripped != b"--" + boundary:
+                        self._boundaries.pop()
+                    else:
+                        self._in_headers = True
+                    return
+
+        if self._part is None:
+            return  # preamble/epilogue text around multipart bodies
+
+        if isinstance(self._part.decoder, _IdentityDecoder):
+            self._part.write(self._held_newline + stripped)
+            self._held_newline = line[len(stripped):]
+        else:
+            self._part.write(self._part.decoder.feed(line))
+
+    def _end_headers(self):
+        headers = _header_parser.parsebytes(b"".join(self._header_lines))
+        self._header_lines = []
+        self._in_headers = False
+        self._held_newline = b""
+        if self.result is None:
+            self.result = ParsedEmail(headers)
+
+        part = _Part(headers, self)
+        if part.boundary:
+            self._boundaries.append(part.boundary.encode("utf-8"))
+            self._part = None
+        else:
+            self._part = part
+
+    def _finish_part(self):
+        if self._part is not None:
+            part, self._part = self._part, None
+            part.finish()
+
+    def _abort(self):
+        if self._part is not None:
+            self._part.abort()
+            self._part = None
+        if self.result is not None:
+            self.result.cleanup()
+
+
+def parse_bytes(raw_email, temp_dir, **limits):
+    parser = StreamingMimeParser(temp_dir, **limits)
+    view = memoryview(raw_email)
+    for start in range(0, len(view), FEED_CHUNK_SIZE):
+        parser.feed(view[start:start + FEED_CHUNK_SIZE])
+    return parser.close()
+
+
+def parse_file(path, temp_dir, **limits):
+    parser = StreamingMimeParser(temp_dir, **limits)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(FEED_CHUNK_SIZE), b""):
+            parser.feed(chunk)
+    return parser.close()
+
+
+# Decode a base64 attachment supplied as JSON ({"filename", "content_type",
+# "content"}) to a file in temp_dir without materializing the decoded bytes
+def spool_base64_attachment(attachment, temp_dir, max_part_size=MAX_PART_SIZE):
+    os.makedirs(temp_dir, exist_ok=True)
+    content = attachment.get("content") or ""
+    decoder = _Base64Decoder()
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="att-", dir=temp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for start in range(0, len(content), FEED_CHUNK_SIZE):
+                chunk = decoder.feed(content[start:start + FEED_CHUNK_SIZE].encode("ascii"))
+                size += len(chunk)
+                if size > max_part_size:
+                    raise MessageTooLarge(f"Attachment exceeds {max_part_size} bytes")
+                f.write(chunk)
+                digest.update(chunk)
+            tail = decoder.flush()
+            size += len(tail)
+            f.write(tail)
+            digest.update(tail)
+    except Exception:
+        os.remove(path)
+        raise
+    return Attachment(
+        attachment.get("filename") or os.path.basename(path),
+        attachment.get("content_type") or "application/octet-stream",
+        path,
+        size,
+        digest.hexdigest()
+    )
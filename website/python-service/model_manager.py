@@ -0,0 +1,257 @@
+import os
+import time
+import threading
+from datetime import datetime
+
+from extraction_engine import (
+    TransformersBackend, ExtractionEngine, build_prompt, DEFAULT_INFERENCE_MODE,
+    DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, DEFAULT_MAX_NEW_TOKENS, DEFAULT_BUCKET_WIDTH
+)
+from model_scheduler import get_model_scheduler
+
+# "lazy" loads the weights on the first extraction; "eager" loads and warms
+# them up at startup (in the gunicorn master when preload_app is on)
+LOAD_MODES = ("lazy", "eager")
+DEFAULT_LOAD_MODE = "lazy"
+
+WARMUP_NEW_TOKENS = 8
+
+
+# A change to either means loading a different set of weights
+def _model_key(config):
+    return config["model_path"], config.get("inference_mode", DEFAULT_INFERENCE_MODE)
+
+
+# Resident memory of this process in bytes. file_backed_bytes is the part
+# mapped from files, i.e. memory-mapped weights shared with other processes.
+def process_memory():
+    memory = {"rss_bytes": None, "file_backed_bytes": None}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_bytes"] = int(line.split()[1]) * 1024
+                elif line.startswith("RssFile:"):
+                    memory["file_backed_bytes"] = int(line.split()[1]) * 1024
+    except OSError:
+        import resource
+        # Peak rather than current RSS, but better than nothing off Linux
+        memory["rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return memory
+
+
+# Owns the model for this process: when its weights are loaded, the
+# micro-batching engine in front of it, and swapping to a new model_path or
+# inference_mode without a restart. Weights loaded before a fork are
+# inherited by the children; the engine's batch thread is not, so it is
+# created per process.
+class ModelManager:
+    def __init__(self, backend_factory=TransformersBackend):
+        self.backend_factory = backend_factory
+        self.model_path = None
+        self.inference_mode = None
+        self.load_mode = DEFAULT_LOAD_MODE
+
+        self._lock = threading.RLock()
+        self._backend = None
+        self._engine = None
+        self._swap_thread = None
+        self._status = self._initial_status()
+
+    def _initial_status(self):
+        return {
+            "state": "unloaded",
+            "error": None,
+            "load_seconds": None,
+            "loaded_at": None,
+            "loaded_in_pid": None,
+            "parameter_bytes": None,
+            "rss_delta_bytes": None
+        }
+
+    def configure(self, config):
+        with self._lock:
+            self.load_mode = config.get("model_load", DEFAULT_LOAD_MODE)
+            if self.model_path is None:
+                self.model_path = config["model_path"]
+                self.inference_mode = config.get("inference_mode", DEFAULT_INFERENCE_MODE)
+                self._backend = self._new_backend(config)
+
+    def _new_backend(self, config):
+        settings = config.get("extraction", {})
+        return self.backend_factory(
+            config["model_path"],
+            settings.get("max_new_tokens", DEFAULT_MAX_NEW_TOKENS),
+            config.get("inference_mode", DEFAULT_INFERENCE_MODE)
+        )
+
+    # Load (and optionally warm up) a backend, returning its status fields
+    def _load_backend(self, backend, warmup):
+        before = process_memory()["rss_bytes"]
+        started = time.monotonic()
+        backend.load()
+        if warmup:
+            # One short generation so the first real request does not pay for
+            # allocator and kernel setup
+            backend.generate_batch([build_prompt("Warmup", "Warmup")], max_new_tokens=WARMUP_NEW_TOKENS)
+        after = process_memory()["rss_bytes"]
+        parameter_bytes = backend.parameter_bytes() if hasattr(backend, "parameter_bytes") else None
+        return {
+            "state": "loaded",
+            "error": None,
+            "load_seconds": round(time.monotonic() - started, 3),
+            "loaded_at": datetime.now().isoformat(),
+            "loaded_in_pid": os.getpid(),
+            "parameter_bytes": parameter_bytes,
+            "rss_delta_bytes": after - before if before is not None and after is not None else None
+        }
+
+    # Load the configured model now rather than on the first request
+    def load(self, config, warmup=True):
+        self.configure(config)
+        with self._lock:
+            if self._status["state"] == "loaded":
+                return
+            backend = self._backend
+            waiting = self._status["state"] == "loading"
+            if not waiting:
+                self._status.update(state="loading", error=None)
+        if waiting:
+            # Another thread is loading it; the backend's load lock makes
+            # this wait until the weights are in (or loads them if that failed)
+            backend.load()
+            return
+        try:
+            status = self._load_backend(backend, warmup)
+        except Exception as e:
+            with self._lock:
+                self._status.update(state="failed", error=str(e))
+            raise
+        with self._lock:
+            if self._backend is backend:
+                self._status = status
+
+    # The loaded backend for direct use (e.g. chat generation), loading it
+    # first in lazy mode
+    def backend(self, config):
+        self.configure(config)
+        with self._lock:
+            backend = self._backend
+            needs_load = self._status["state"] != "loaded"
+        if needs_load:
+            self.load(config, warmup=False)
+        return backend
+
+    def engine(self, config):
+        self.configure(config)
+        settings = config.get("extraction", {})
+        with self._lock:
+            if self._engine is None:
+                self._engine = ExtractionEngine(
+                    self._backend,
+                    max_batch_size=settings.get("max_batch_size", DEFAULT_MAX_BATCH_SIZE),
+                    max_wait_ms=settings.get("max_wait_ms", DEFAULT_MAX_WAIT_MS),
+                    bucket_width=settings.get("bucket_width", DEFAULT_BUCKET_WIDTH),
+                    scheduler=get_model_scheduler(config)
+                )
+            engine = self._engine
+            needs_load = self._status["state"] != "loaded"
+        # Batching settings apply to the running engine without a rebuild
+        engine.max_batch_size = max(1, settings.get("max_batch_size", DEFAULT_MAX_BATCH_SIZE))
+        engine.max_wait = settings.get("max_wait_ms", DEFAULT_MAX_WAIT_MS) / 1000.0
+        if needs_load:
+            # Lazy mode: the first caller pays for the load, the rest wait on
+            # the backend's load lock
+            self.load(config, warmup=False)
+        return engine
+
+    # Load the new model next to the current one and switch over once it is
+    # ready; extractions keep using the old model in the meantime
+    def swap(self, config):
+        with self._lock:
+            if _model_key(config) == (self.model_path, self.inference_mode):
+                return
+            loaded = self._status["state"] == "loaded"
+        backend = self._new_backend(config)
+
+        if loaded:
+            with self._lock:
+                self._status["swapping_to"] = config["model_path"]
+            try:
+                status = self._load_backend(backend, warmup=True)
+            except Exception as e:
+                print(f"Error loading model {config['model_path']}, keeping {self.model_path}: {str(e)}")
+                with self._lock:
+                    self._status.pop("swapping_to", None)
+                    self._status["error"] = str(e)
+                return
+        else:
+            status = self._initial_status()
+
+        with self._lock:
+            old_engine = self._engine
+            self.model_path = config["model_path"]
+            self.inference_mode = config.get("inference_mode", DEFAULT_INFERENCE_MODE)
+            self._backend = backend
+            self._engine = None
+            self._status = status
+        if old_engine:
+            old_engine.stop()
+        print(f"Switched model to {config['model_path']} ({self.inference_mode})")
+
+    def on_config_change(self, old_config, new_config):
+        self.load_mode = new_config.get("model_load", DEFAULT_LOAD_MODE)
+        if _model_key(old_config) == _model_key(new_config) or self.model_path is None:
+            return
+        self._swap_thread = threading.Thread(target=self.swap, args=(new_config,), name="model-swap")
+        self._swap_thread.daemon = True
+        self._swap_thread.start()
+
+    # Threads do not survive fork, so a child that inherited a running
+    # engine (but not its batch thread) starts a fresh one on first use.
+    # Loaded weights are kept: that is the point of preloading.
+    def _after_fork(self):
+        self._lock = threading.RLock()
+        self._engine = None
+        self._swap_thread = None
+
+    def status(self):
+        with self._lock:
+            status = dict(self._status)
+            engine = self._engine
+        status.update(
+            model_path=self.model_path,
+            inference_mode=self.inference_mode,
+            load_mode=self.load_mode,
+            pid=os.getpid(),
+            memory=process_memory(),
+            engine=engine.stats() if engine else None
+        )
+        return status
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_model_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ModelManager()
+        return _manager
+
+
+def get_extraction_engine(config):
+    return get_model_manager().engine(config)
+
+
+def _after_fork_in_child():
+    global _manager_lock
+    _manager_lock = threading.Lock()
+    if _manager is not None:
+        _manager._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,210 @@
+import os
+import math
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+
+# Lower runs first: the background processor's extractions, then manual
+# /process-email requests, then chat turns
+PRIORITIES = {"processor": 0, "manual": 1, "chat": 2}
+
+DEFAULT_MAX_CONCURRENT = 1
+# Seconds a request may wait for the model before it is turned away with a
+# 429; None waits indefinitely (the processor is throttled by its own queue)
+DEFAULT_QUEUE_TIMEOUTS = {"processor": None, "manual": 30, "chat": 10}
+
+# Wait and service times kept per workload for the percentiles
+SAMPLE_WINDOW = 500
+
+MAX_RETRY_AFTER = 60
+
+
+class QueueTimeout(Exception):
+    def __init__(self, workload, retry_after):
+        super().__init__(f"Model is busy; {workload} request waited too long in the queue")
+        self.workload = workload
+        self.retry_after = retry_after
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+class _WorkloadStats:
+    def __init__(self):
+        self.waiting = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.waits = deque(maxlen=SAMPLE_WINDOW)
+        self.service_times = deque(maxlen=SAMPLE_WINDOW)
+
+    def to_dict(self):
+        waits = list(self.waits)
+        service = list(self.service_times)
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+            "wait_ms_p50": round(_percentile(waits, 50) * 1000, 1) if waits else None,
+            "wait_ms_p95": round(_percentile(waits, 95) * 1000, 1) if waits else None,
+            "wait_ms_max": round(max(waits) * 1000, 1) if waits else None,
+            "service_ms_avg": round(sum(service) / len(service) * 1000, 1) if service else None
+        }
+
+
+# A held slot on the model; release() is safe to call more than once
+class Slot:
+    def __init__(self, scheduler, workload):
+        self.scheduler = scheduler
+        self.workload = workload
+        self.started = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.scheduler._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Admission control in front of the model. At most max_concurrent callers
+# (extraction batches or chat generations) use it at once; the rest wait in
+# one priority queue ordered by workload and then arrival, so a burst of
+# chat turns can never hold back work-order extraction.
+class ModelScheduler:
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, queue_timeouts=None):
+        self.max_concurrent = max_concurrent
+        self.queue_timeouts = dict(DEFAULT_QUEUE_TIMEOUTS, **(queue_timeouts or {}))
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = []
+        self._ids = itertools.count()
+        self._stats = {workload: _WorkloadStats() for workload in PRIORITIES}
+
+    def queue_timeout(self, workload):
+        return self.queue_timeouts.get(workload)
+
+    # Block until a slot is free and this caller is first in line. `enqueued`
+    # lets a caller that retries keep its original place in the queue; with
+    # record=False the caller reports waits and rejections itself (see
+    # record()), e.g. per request for a batch.
+    def acquire(self, workload, timeout=None, enqueued=None, record=True):
+        if workload not in PRIORITIES:
+            raise ValueError(f"Unknown workload: {workload}")
+        now = time.monotonic()
+        enqueued = enqueued or now
+        entry = (PRIORITIES[workload], enqueued, next(self._ids))
+        deadline = None if timeout is None else now + timeout
+        stats = self._stats[workload]
+
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            stats.waiting += 1
+            try:
+                while self._running >= self.max_concurrent or self._waiting[0] is not entry:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        if record:
+                            stats.rejected += 1
+                        raise QueueTimeout(workload, self._retry_after(workload))
+                    self._cond.wait(remaining)
+                heapq.heappop(self._waiting)
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+                raise
+            finally:
+                stats.waiting -= 1
+
+            self._running += 1
+            stats.running += 1
+            if record:
+                stats.admitted += 1
+                stats.waits.append(time.monotonic() - enqueued)
+        return Slot(self, workload)
+
+    def slot(self, workload, enqueued=None):
+        return self.acquire(workload, self.queue_timeout(workload), enqueued)
+
+    def record(self, workload, waited=None, rejected=False):
+        with self._cond:
+            stats = self._stats[workload]
+            if rejected:
+                stats.rejected += 1
+            else:
+                stats.admitted += 1
+                stats.waits.append(waited)
+
+    def _release(self, slot):
+        with self._cond:
+            self._running -= 1
+            stats = self._stats[slot.workload]
+            stats.running -= 1
+            stats.service_times.append(time.monotonic() - slot.started)
+            self._cond.notify_all()
+
+    # Rough time until a newly queued request of this workload would run:
+    # everything ahead of it, at the average service time, spread over the
+    # available slots
+    def _retry_after(self, workload):
+        priority = PRIORITIES[workload]
+        ahead = sum(1 for entry in self._waiting if entry[0] <= priority) + self._running
+        service = [t for stats in self._stats.values() for t in stats.service_times]
+        average = sum(service) / len(service) if service else 1.0
+        estimate = math.ceil(average * ahead / max(1, self.max_concurrent))
+        return min(MAX_RETRY_AFTER, max(1, estimate))
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "running": self._running,
+                "waiting": len(self._waiting),
+                "queues": {workload: stats.to_dict() for workload, stats in self._stats.items()}
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_model_scheduler(config=None):
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ModelScheduler()
+        if config is not None:
+            settings = config.get("scheduler", {})
+            _scheduler.max_concurrent = max(1, settings.get("max_concurrent", DEFAULT_MAX_CONCURRENT))
+            _scheduler.queue_timeouts = dict(DEFAULT_QUEUE_TIMEOUTS, **settings.get("queue_timeout_seconds", {}))
+        return _scheduler
+
+
+# Slots held in the parent are meaningless in a forked child
+def _after_fork_in_child():
+    global _scheduler, _scheduler_lock
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
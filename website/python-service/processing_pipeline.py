@@ -0,0 +1,177 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from mime_stream import parse_bytes, MAX_PART_SIZE, MAX_MESSAGE_SIZE
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_TEMP_DIR = "/tmp/email_attachments"
+
+_STOP = object()
+
+
+# CPU-bound first stage; module-level so it can run in a worker process.
+# Attachments are decoded straight to files in temp_dir and only their
+# paths travel down the pipeline.
+def parse_email(uid, raw_email, temp_dir=DEFAULT_TEMP_DIR, max_part_size=MAX_PART_SIZE,
+                max_message_size=MAX_MESSAGE_SIZE):
+    parsed = parse_bytes(raw_email, temp_dir, max_part_size=max_part_size,
+                         max_message_size=max_message_size)
+    return {
+        "uid": uid,
+        "email_id": parsed.get("Message-ID").strip() or f"uid_{uid}",
+        "subject": parsed.get("Subject"),
+        "sender": parsed.get("From"),
+        "body": parsed.text,
+        "attachments": [attachment.to_dict() for attachment in parsed.attachments]
+    }
+
+
+def email_parser_for(config):
+    return partial(
+        parse_email,
+        temp_dir=config["temp_dir"],
+        max_part_size=config["max_attachment_size"],
+        max_message_size=config["max_message_size"]
+    )
+
+
+def discard_attachments(parsed):
+    for attachment in parsed.get("attachments", []):
+        if os.path.exists(attachment["path"]):
+            os.remove(attachment["path"])
+
+
+class WorkerStats:
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.failed = 0
+        self.busy = False
+        self.started = time.monotonic()
+
+    def to_dict(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            "name": self.name,
+            "processed": self.processed,
+            "failed": self.failed,
+            "busy": self.busy,
+            "throughput_per_min": round((self.processed + self.failed) * 60 / elapsed, 2)
+        }
+
+
+# Bounded producer/consumer pipeline. The fetcher calls submit(), which blocks
+# while the queue is full so a burst of mail cannot outrun the workers. Each
+# item runs through `parse` (in a process pool when cpu_workers > 0, inline
+# otherwise) and then `handle` on one of the I/O worker threads.
+class ProcessingPipeline:
+    def __init__(self, handle, parse=parse_email, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, cpu_workers=0, on_error=None):
+        self.handle = handle
+        self.parse = parse
+        self.on_error = on_error
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.worker_count = max(1, workers)
+        self.cpu_workers = cpu_workers
+
+        self._threads = []
+        self._stats = []
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._process_pool = None
+        self.accepting = False
+
+    def start(self):
+        if self.cpu_workers > 0:
+            # Spawned, not forked: this process runs threads and may hold the model
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.cpu_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.accepting = True
+        for i in range(self.worker_count):
+            stats = WorkerStats(f"worker-{i + 1}")
+            thread = threading.Thread(target=self._worker_loop, args=(stats,), name=stats.name)
+            thread.daemon = True
+            thread.start()
+            self._stats.append(stats)
+            self._threads.append(thread)
+        return self
+
+    # callback(result, error) runs on the worker thread once the item is done,
+    # with whatever `handle` returned or the exception that stopped it
+    def submit(self, *args, timeout=None, callback=None):
+        if not self.accepting:
+            raise RuntimeError("Pipeline is not accepting work")
+        self.queue.put((args, callback), timeout=timeout)
+
+    # Stop accepting work, let the workers finish everything already queued,
+    # then shut them down
+    def stop(self, timeout=None):
+        self.accepting = False
+        for _ in self._threads:
+            self.queue.put(_STOP)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+        if self._process_pool:
+            self._process_pool.shutdown(wait=True)
+            self._process_pool = None
+
+    def _worker_loop(self, stats):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            item, callback = item
+
+            with self._lock:
+                self._in_flight += 1
+            stats.busy = True
+            result = error = None
+            try:
+                if self._process_pool:
+                    parsed = self._process_pool.submit(self.parse, *item).result()
+                else:
+                    parsed = self.parse(*item)
+                result = self.handle(parsed)
+                stats.processed += 1
+            except Exception as e:
+                error = e
+                stats.failed += 1
+                if self.on_error:
+                    # A failing handler (e.g. a locked database) must not
+                    # take the worker thread down with it
+                    try:
+                        self.on_error(item, e)
+                    except Exception as handler_error:
+                        print(f"Error in pipeline error handler: {str(handler_error)} "
+                              f"(while handling: {str(e)})")
+                else:
+                    print(f"Error processing queued email: {str(e)}")
+            finally:
+                stats.busy = False
+                with self._lock:
+                    self._in_flight -= 1
+
+            if callback:
+                try:
+                    callback(result, error)
+                except Exception as e:
+                    print(f"Error in pipeline callback: {str(e)}")
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "in_flight": self._in_flight,
+            "processed": sum(s.processed for s in self._stats),
+            "failed": sum(s.failed for s in self._stats),
+            "workers": [s.to_dict() for s in self._stats]
+        }
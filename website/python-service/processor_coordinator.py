@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import atexit
+import uuid
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+
+LEASE_NAME = "email-processor"
+# A leader that has not renewed its lease for this long is presumed dead
+DEFAULT_LEASE_TTL = 15
+# How often each worker checks the shared state, renews or bids for the
+# lease and reports its counters
+DEFAULT_INTERVAL = 2.0
+# Worker rows not refreshed for this many intervals are left out of the totals
+STALE_INTERVALS = 3
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_processor_coordinator(config):
+    global _coordinator
+    settings = config.get("processor", {})
+    with _coordinator_lock:
+        if _coordinator is None or _coordinator.db_path != config["db_path"]:
+            previous = _coordinator
+            _coordinator = ProcessorCoordinator(config["db_path"])
+            # Moved to another database: hand over to the new one
+            if previous is not None:
+                previous.close()
+                if previous.started:
+                    _coordinator.start(*previous.callbacks)
+        _coordinator.lease_ttl = settings.get("lease_ttl_seconds", DEFAULT_LEASE_TTL)
+        _coordinator.interval = settings.get("coordination_interval_seconds", DEFAULT_INTERVAL)
+        return _coordinator
+
+
+def close_processor_coordinator():
+    with _coordinator_lock:
+        coordinator = _coordinator
+    if coordinator is not None:
+        coordinator.close()
+
+
+atexit.register(close_processor_coordinator)
+
+
+# A forked worker must not inherit the parent's identity, lease or thread
+def _after_fork_in_child():
+    global _coordinator, _coordinator_lock
+    _coordinator = None
+    _coordinator_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# Runs the ingestion processor in exactly one process among every worker and
+# host sharing the database. Whether the processor should run is shared state
+# (so /start-processor and /stop-processor work on any worker), and a lease
+# row elects the process that runs it: the leader renews the lease every
+# interval, and once it expires (the leader crashed or hung) any worker may
+# take it over. Each new leader gets a higher term. Every worker also
+# reports its counters, which status() adds up.
+class ProcessorCoordinator:
+    def __init__(self, db_path, lease_ttl=DEFAULT_LEASE_TTL, interval=DEFAULT_INTERVAL):
+        self.db_path = db_path
+        self.lease_ttl = lease_ttl
+        self.interval = interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.term = None
+        self.closed = False
+        self._renewed_at = None
+
+        self._start_processor = None
+        self._stop_processor = None
+        self._is_running = None
+        self._counters = None
+        self.callbacks = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS processor_control (
+                name TEXT PRIMARY KEY,
+                desired_running INTEGER NOT NULL DEFAULT 0,
+                auto_restart INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT,
+                updated_by TEXT
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS processor_lease (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                term INTEGER NOT NULL,
+                acquired_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS processor_workers (
+                worker_id TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                leader INTEGER NOT NULL DEFAULT 0,
+                counters TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+
+    # Begin coordinating in this process: start_processor()/stop_processor()
+    # run the local processor when this worker wins or loses the lease,
+    # is_running() reports whether it is running here, and counters() returns
+    # this worker's counters for the aggregated status
+    def start(self, start_processor, stop_processor, is_running, counters):
+        self.callbacks = (start_processor, stop_processor, is_running, counters)
+        self._start_processor = start_processor
+        self._stop_processor = stop_processor
+        self._is_running = is_running
+        self._counters = counters
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="processor-coordinator")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def wake(self):
+        self._wake.set()
+
+    def _set_desired(self, running, auto_restart=None):
+        now = datetime.utcnow().isoformat()
+        with self._db_lock, self._conn:
+            row = self._conn.execute(
+                "SELECT desired_running, auto_restart FROM processor_control WHERE name = ?",
+                (LEASE_NAME,)).fetchone()
+            was_running = bool(row and row[0])
+            if auto_restart is None:
+                auto_restart = bool(row and row[1])
+            self._conn.execute('''
+                INSERT INTO processor_control (name, desired_running, auto_restart, updated_at, updated_by)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    desired_running = excluded.desired_running,
+                    auto_restart = excluded.auto_restart,
+                    updated_at = excluded.updated_at,
+                    updated_by = excluded.updated_by
+            ''', (LEASE_NAME, int(running), int(auto_restart), now, self.worker_id))
+        self.wake()
+        return was_running != running
+
+    # Both return whether the shared state changed
+    def request_start(self, auto_restart=None):
+        return self._set_desired(True, auto_restart)
+
+    def request_stop(self):
+        return self._set_desired(False)
+
+    def desired(self):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT desired_running, auto_restart FROM processor_control WHERE name = ?",
+                (LEASE_NAME,)).fetchone()
+        return (bool(row[0]), bool(row[1])) if row else (False, False)
+
+    # Take the lease if it is free or expired, or renew it if already ours,
+    # in a single statement so two workers can never both succeed
+    def _acquire(self):
+        now = time.time()
+        with self._db_lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO processor_lease (name, holder, term, acquired_at, expires_at)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    holder = excluded.holder,
+                    term = CASE WHEN processor_lease.holder = excluded.holder
+                                THEN processor_lease.term ELSE processor_lease.term + 1 END,
+                    acquired_at = CASE WHEN processor_lease.holder = excluded.holder
+                                       THEN processor_lease.acquired_at ELSE excluded.acquired_at END,
+                    expires_at = excluded.expires_at
+                WHERE processor_lease.holder = excluded.holder OR processor_lease.expires_at < ?
+            ''', (LEASE_NAME, self.worker_id, now, now + self.lease_ttl, now))
+            row = self._conn.execute(
+                "SELECT holder, term FROM processor_lease WHERE name = ?", (LEASE_NAME,)).fetchone()
+        self.is_leader = row is not None and row[0] == self.worker_id
+        self.term = row[1] if self.is_leader else None
+        if self.is_leader:
+            self._renewed_at = time.monotonic()
+        return self.is_leader
+
+    # Expire the lease rather than delete it, so terms keep increasing
+    def _release(self):
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                "UPDATE processor_lease SET expires_at = 0 WHERE name = ? AND holder = ?",
+                (LEASE_NAME, self.worker_id))
+        self.is_leader = False
+        self.term = None
+
+    def _report(self):
+        counters = self._counters() if self._counters else {}
+        with self._db_lock, self._conn:
+            self._conn.execute('''
+                INSERT INTO processor_workers (worker_id, host, pid, leader, counters, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (worker_id) DO UPDATE SET
+                    leader = excluded.leader,
+                    counters = excluded.counters,
+                    updated_at = excluded.updated_at
+            ''', (self.worker_id, socket.gethostname(), os.getpid(), int(self.is_leader),
+                  json.dumps(counters, default=str), time.time()))
+            # Rows of workers that went away without deregistering
+            self._conn.execute(
+                "DELETE FROM processor_workers WHERE updated_at < ?", (time.time() - 100 * self.interval,))
+
+    def _tick(self):
+        desired, auto_restart = self.desired()
+        leader = self._acquire() if desired else False
+        running = self._is_running()
+        if leader and not running:
+            self._start_processor()
+        elif running and not leader:
+            # Stopped on request, or the lease was lost (e.g. this process
+            # stalled past the TTL and another worker has taken over)
+            self._stop_processor()
+        if not desired and self.is_leader:
+            self._release()
+        self._report()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self._tick()
+            except Exception as e:
+                print(f"Error coordinating email processor: {str(e)}")
+                self._check_lease_expiry()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # A leader that cannot reach the database to renew must assume its lease
+    # lapsed once the TTL has passed, as another worker may then take over
+    def _check_lease_expiry(self):
+        if self.is_leader and time.monotonic() - self._renewed_at > self.lease_ttl:
+            self.is_leader = False
+            self.term = None
+            try:
+                if self._is_running():
+                    self._stop_processor()
+            except Exception as e:
+                print(f"Error stopping email processor: {str(e)}")
+
+    # The processor ended with an error: without auto-restart it stays
+    # stopped on every worker; with it, the next tick starts it again
+    def processor_failed(self):
+        desired, auto_restart = self.desired()
+        if desired and not auto_restart:
+            self.request_stop()
+
+    def status(self):
+        now = time.time()
+        with self._db_lock:
+            lease = self._conn.execute(
+                "SELECT holder, term, acquired_at, expires_at FROM processor_lease WHERE name = ?",
+                (LEASE_NAME,)).fetchone()
+            rows = self._conn.execute('''
+                SELECT worker_id, host, pid, leader, counters, updated_at
+                FROM processor_workers
+                WHERE updated_at >= ?
+                ORDER BY worker_id
+            ''', (now - STALE_INTERVALS * max(self.interval, 1),)).fetchall()
+            control = self._conn.execute(
+                "SELECT desired_running, auto_restart FROM processor_control WHERE name = ?",
+                (LEASE_NAME,)).fetchone()
+
+        leader = None
+        if lease is not None and lease[3] >= now:
+            leader = {
+                "worker_id": lease[0],
+                "term": lease[1],
+                "held_seconds": round(now - lease[2], 1),
+                "expires_in_seconds": round(lease[3] - now, 1)
+            }
+        workers = []
+        totals = {}
+        for worker_id, host, pid, is_leader, counters, updated_at in rows:
+            counters = json.loads(counters)
+            workers.append(dict(counters, worker_id=worker_id, host=host, pid=pid, leader=bool(is_leader),
+                                seen_seconds_ago=round(now - updated_at, 1)))
+            for key, value in counters.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] = totals.get(key, 0) + value
+        return {
+            "desired_running": bool(control and control[0]),
+            "auto_restart": bool(control and control[1]),
+            "leader": leader,
+            "worker_id": self.worker_id,
+            "is_leader": self.is_leader,
+            "workers": workers,
+            "totals": totals
+        }
+
+    # Stop coordinating: stop the local processor and hand the lease over at
+    # once instead of letting it expire
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+        try:
+            if self._is_running and self._is_running():
+                self._stop_processor()
+            if self.is_leader:
+                self._release()
+            with self._db_lock, self._conn:
+                self._conn.execute("DELETE FROM processor_workers WHERE worker_id = ?", (self.worker_id,))
+        except Exception as e:
+            print(f"Error closing processor coordinator: {str(e)}")
+        self._conn.close()
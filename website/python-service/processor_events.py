@@ -0,0 +1,248 @@
+import json
+import time
+import queue
+import asyncio
+import threading
+
+import log_store
+
+# Seconds between status snapshots while anyone is subscribed
+STATUS_INTERVAL = 1.0
+# An idle stream sends a comment this often so proxies keep it open and
+# dead clients are noticed
+HEARTBEAT_INTERVAL = 15
+# Reconnect delay the browser is told to use, in milliseconds
+RETRY_MS = 3000
+# Events buffered per subscriber; one that falls further behind is dropped
+# and resumes from the log store when it reconnects
+SUBSCRIBER_BUFFER = 1000
+# Log entries replayed for a Last-Event-ID reconnect, and sent to a new client
+REPLAY_LIMIT = 500
+INITIAL_LOGS = 10
+
+HEARTBEAT = ": heartbeat\n\n"
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+# The process-wide broker; committed log store batches are published to it
+def get_event_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = EventBroker()
+            log_store.add_listener(_broker.publish_logs)
+        return _broker
+
+
+def format_event(data, event=None, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+def parse_event_id(value):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+class Subscription:
+    def __init__(self, maxsize=SUBSCRIBER_BUFFER):
+        self._queue = queue.Queue(maxsize)
+        self.lagged = False
+        # Log events up to this id were already sent by the replay
+        self.skip_through = 0
+
+    # Called on publishing threads; never blocks
+    def push(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.lagged = True
+
+    def _accept(self, item):
+        event_id, frame = item
+        return frame if event_id is None or event_id > self.skip_through else False
+
+    # The next frame, or None once `timeout` passes without one
+    def next_frame(self, timeout):
+        while True:
+            try:
+                frame = self._accept(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                return None
+            if frame is not False:
+                return frame
+
+
+# Subscription for a client served on an asyncio event loop
+class AsyncSubscription(Subscription):
+    def __init__(self, loop, maxsize=SUBSCRIBER_BUFFER):
+        super().__init__(maxsize)
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize)
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    def push(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:
+            # Event loop already closed
+            self.lagged = True
+
+    async def next_frame(self, timeout):
+        while True:
+            try:
+                frame = self._accept(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                return None
+            if frame is not False:
+                return frame
+
+
+# In-process pub/sub for the processor event stream. Every event is encoded
+# once and handed to each subscriber's buffer, and one producer thread (run
+# only while someone is subscribed) snapshots the processor status and
+# publishes the fields that changed, so N open dashboards cost the same as
+# one.
+class EventBroker:
+    def __init__(self, status_interval=STATUS_INTERVAL):
+        self.status_interval = status_interval
+        # Returns the processor status (without logs); set by the service
+        self.status_source = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._last_status = None
+        self._producer = None
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscribers.add(subscription)
+            start = self._producer is None
+            if start:
+                self._producer = threading.Thread(target=self._producer_loop, name="processor-events")
+                self._producer.daemon = True
+        if start:
+            self._producer.start()
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data, event_id=None):
+        with self._lock:
+            if not self._subscribers:
+                return
+            subscribers = list(self._subscribers)
+        item = (event_id, format_event(data, event, event_id))
+        lagged = []
+        for subscription in subscribers:
+            subscription.push(item)
+            if subscription.lagged:
+                lagged.append(subscription)
+        if lagged:
+            with self._lock:
+                self._subscribers.difference_update(lagged)
+
+    # Log store entries carry their row id, which becomes the event id
+    def publish_logs(self, entries):
+        for entry in entries:
+            self.publish("log", entry, entry.get("id"))
+
+    def _snapshot(self):
+        try:
+            return self.status_source() if self.status_source else {}
+        except Exception as e:
+            print(f"Error building processor status: {str(e)}")
+            return self._last_status or {}
+
+    def current_status(self):
+        with self._status_lock:
+            if self._last_status is None:
+                self._last_status = self._snapshot()
+            return self._last_status
+
+    def _producer_loop(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._producer = None
+                    break
+            # Deltas carry whole top-level fields, so one that crosses a new
+            # subscriber's full snapshot is harmless. Until a snapshot has
+            # been taken nobody has seen one, so there is nothing to diff.
+            with self._status_lock:
+                previous = self._last_status
+                status = self._snapshot()
+                self._last_status = status
+                delta = {key: value for key, value in status.items() if previous and previous.get(key) != value}
+                if delta:
+                    self.publish("status", delta)
+            time.sleep(self.status_interval)
+        with self._status_lock:
+            self._last_status = None
+
+
+# Frames every stream starts with: the reconnect delay, the full status, then
+# either the log entries after last_event_id (read from the store) or the
+# newest ones from initial_logs (newest first; defaults to the store's).
+# Subscribing comes first so nothing published meanwhile is lost.
+def _open(broker, subscription, store, last_event_id, initial_logs):
+    broker.subscribe(subscription)
+    frames = [f"retry: {RETRY_MS}\n\n", format_event(broker.current_status(), "status")]
+    if last_event_id is not None:
+        entries = store.logs_after(last_event_id, REPLAY_LIMIT)
+    elif initial_logs is not None:
+        entries = list(reversed(initial_logs()))
+    else:
+        entries = list(reversed(store.query_logs(limit=INITIAL_LOGS)["logs"]))
+    for entry in entries:
+        frames.append(format_event(entry, "log", entry.get("id")))
+        if entry.get("id") is not None:
+            subscription.skip_through = max(subscription.skip_through, entry["id"])
+    return frames
+
+
+# Server-Sent Events for one client, as text frames. Ends when the client
+# falls too far behind; it then reconnects with Last-Event-ID.
+def event_stream(broker, store, last_event_id=None, initial_logs=None, heartbeat=HEARTBEAT_INTERVAL):
+    subscription = Subscription()
+    try:
+        for frame in _open(broker, subscription, store, last_event_id, initial_logs):
+            yield frame
+        while not subscription.lagged:
+            frame = subscription.next_frame(heartbeat)
+            yield HEARTBEAT if frame is None else frame
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def async_event_stream(broker, store, last_event_id=None, initial_logs=None, heartbeat=HEARTBEAT_INTERVAL):
+    loop = asyncio.get_running_loop()
+    subscription = AsyncSubscription(loop)
+    try:
+        frames = await loop.run_in_executor(None, _open, broker, subscription, store, last_event_id, initial_logs)
+        for frame in frames:
+            yield frame
+        while not subscription.lagged:
+            frame = await subscription.next_frame(heartbeat)
+            yield HEARTBEAT if frame is None else frame
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,52 @@
+import heapq
+import itertools
+import threading
+from collections import deque
+from datetime import datetime
+
+DEFAULT_CAPACITY = 500
+
+
+def _timestamp_key(entry):
+    # In-memory events use isoformat ("2025-04-03T12:30:00.123") while the
+    # log store uses SQLite's "2025-04-03 12:30:00"; compare them uniformly
+    return entry["timestamp"].replace("T", " ")
+
+
+# Merge already newest-first log lists, stopping after the first `limit` entries
+def merge_latest(limit, *newest_first_sources):
+    merged = heapq.merge(*newest_first_sources, key=_timestamp_key, reverse=True)
+    return list(itertools.islice(merged, limit))
+
+
+# Fixed-capacity, thread-safe ring buffer of processor log events;
+# on_append (if set) is called with each new event
+class RecentEvents:
+    def __init__(self, capacity=DEFAULT_CAPACITY, on_append=None):
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.on_append = on_append
+
+    def append(self, message, status="info"):
+        event = {
+            "timestamp": datetime.now().isoformat(),
+            "message": message,
+            "status": status
+        }
+        with self._lock:
+            self._events.append(event)
+        if self.on_append is not None:
+            self.on_append(event)
+        return event
+
+    def latest(self, limit):
+        # Walks only the newest `limit` entries from the right end
+        with self._lock:
+            return list(itertools.islice(reversed(self._events), limit))
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def __len__(self):
+        return len(self._events)
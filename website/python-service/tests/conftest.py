@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The service modules import each other by bare name, as they do when run
+# from website/python-service
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
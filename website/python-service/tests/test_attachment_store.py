@@ -0,0 +1,50 @@
+import os
+
+from attachment_store import AttachmentStore
+
+
+def spool(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def make_store(tmp_path, max_bytes):
+    return AttachmentStore(str(tmp_path / "store"), str(tmp_path / "store.db"), max_bytes=max_bytes)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = make_store(tmp_path, 1024)
+    first = store.adopt(spool(tmp_path, "a", b"same"), "<one>", "a.txt")
+    second = store.adopt(spool(tmp_path, "b", b"same"), "<two>", "b.txt")
+    assert not first["duplicate"] and second["duplicate"]
+    assert store.stats()["blobs"] == 1 and store.stats()["references"] == 2
+
+
+def test_referenced_blobs_are_never_evicted(tmp_path):
+    store = make_store(tmp_path, 10)
+    kept = store.adopt(spool(tmp_path, "a", b"x" * 8), "<one>", "a")
+    store.adopt(spool(tmp_path, "b", b"y" * 8), "<two>", "b")
+    assert os.path.exists(kept["path"])
+    assert store.stats()["over_cap"]
+
+    store.release("<one>")
+    store.adopt(spool(tmp_path, "c", b"z" * 1), "<three>", "c")
+    assert not os.path.exists(kept["path"])
+    assert not store.stats()["over_cap"]
+
+
+def test_text_artifact_is_built_once_and_evicted_with_its_blob(tmp_path):
+    store = make_store(tmp_path, 1024)
+    adopted = store.adopt(spool(tmp_path, "a", b"Replace the boiler"), "<one>", "note.txt", "text/plain")
+    assert store.text(adopted["sha256"], "text/plain") == "Replace the boiler"
+    assert store.text(adopted["sha256"], "application/pdf") is None
+
+    builds = []
+    store.get_derived(adopted["sha256"], "text", lambda source, output: builds.append(source))
+    assert builds == []
+
+    store.release("<one>")
+    store.max_bytes = 0
+    store.evict()
+    assert not os.path.exists(store.derived_path(adopted["sha256"], "text"))
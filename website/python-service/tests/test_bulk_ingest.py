@@ -0,0 +1,83 @@
+import json
+import threading
+
+from bulk_ingest import BulkIngest, iter_body, iter_mbox
+
+
+class StubPipeline:
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.accepting = True
+
+    def submit(self, uid, item, callback=None):
+        if not self.accepting or item.get("subject") in self.fail_on:
+            raise RuntimeError("Pipeline is not accepting work")
+        threading.Thread(target=callback, args=({"email_id": uid}, None)).start()
+
+
+# Collect every result, failing instead of hanging if the stream never ends
+def collect(bulk, timeout=5):
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(bulk.results()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "results() did not finish"
+    return results
+
+
+def test_results_then_summary():
+    items = [{"subject": str(i)} for i in range(5)]
+    results = collect(BulkIngest(StubPipeline(), iter(items), "batch", max_in_flight=2))
+    assert sorted(r["index"] for r in results[:-1]) == list(range(5))
+    assert results[-1]["summary"]["succeeded"] == 5
+
+
+def test_failed_submit_reports_that_item():
+    items = [{"subject": "0"}, {"subject": "1"}, {"subject": "2"}]
+    results = collect(BulkIngest(StubPipeline(fail_on={"1"}), iter(items), "batch"))
+    errors = [r for r in results[:-1] if r["status"] == "error"]
+    assert [r["index"] for r in errors] == [1]
+    assert "not accepting" in errors[0]["error"]
+    assert results[-1]["summary"] == dict(results[-1]["summary"], total=3, succeeded=2, failed=1)
+
+
+def test_pipeline_stopped_before_any_submit():
+    pipeline = StubPipeline()
+    pipeline.accepting = False
+    results = collect(BulkIngest(pipeline, iter([{"subject": "a"}, {"subject": "b"}]), "batch"))
+    assert [r["status"] for r in results[:-1]] == ["error", "error"]
+    assert results[-1]["summary"]["failed"] == 2
+
+
+def test_unreadable_body_reports_once_and_finishes():
+    def items():
+        yield {"subject": "a"}
+        raise ValueError("upload dropped")
+
+    results = collect(BulkIngest(StubPipeline(), items(), "batch"))
+    assert results[-1]["summary"]["total"] == 2
+    assert any(r["index"] is None and "upload dropped" in r["error"] for r in results[:-1])
+
+
+def test_invalid_ndjson_line_is_its_own_result():
+    body = [b'{"subject": "a"}\nnot json\n', b'{"subject": "b"}\n']
+    items = list(iter_body(body))
+    assert isinstance(items[1], ValueError)
+    results = collect(BulkIngest(StubPipeline(), iter(items), "batch"))
+    assert results[-1]["summary"] == dict(results[-1]["summary"], total=3, succeeded=2, failed=1)
+
+
+def test_stop_ends_reading():
+    items = ({"subject": str(i)} for i in range(1000))
+    bulk = BulkIngest(StubPipeline(), items, "batch", max_in_flight=1)
+    lines = bulk.ndjson()
+    json.loads(next(lines))
+    lines.close()
+    assert bulk.stopped()
+
+
+def test_mbox_split_and_unquote():
+    mbox = b"From a\nSubject: one\n\n>From here\n\nFrom b\nSubject: two\n\nbody\n"
+    messages = list(iter_mbox([mbox]))
+    assert len(messages) == 2
+    assert b"From here" in messages[0] and b">From" not in messages[0]
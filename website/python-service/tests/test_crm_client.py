@@ -0,0 +1,117 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from crm_client import CrmClient, CrmError, RetryBudget
+
+
+# Local stand-in for the CRM import endpoint. It answers with the queued
+# (status, headers) responses in order, then 200, and records every request.
+class FakeCrmHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append({"headers": dict(self.headers), "body": body, "at": time.monotonic()})
+            status, headers = server.responses.pop(0) if server.responses else (200, {})
+        payload = b"{}"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def crm_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCrmHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.responses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, **settings):
+    return CrmClient(dict({"base_url": f"http://127.0.0.1:{server.server_address[1]}",
+                           "retry_backoff_seconds": 0.01}, **settings))
+
+
+def rows(*ids, exported_at="2026-01-01T00:00:00"):
+    return [{"work_order_id": work_order_id, "title": f"Order {work_order_id}", "exported_at": exported_at}
+            for work_order_id in ids]
+
+
+def test_retryable_status_is_retried_with_the_same_key(crm_server):
+    crm_server.responses = [(503, {}), (502, {})]
+    client = make_client(crm_server)
+    client.write(rows(1, 2))
+    assert len(crm_server.requests) == 3
+    assert len({request["headers"]["Idempotency-Key"] for request in crm_server.requests}) == 1
+    assert client.stats()["retries"] == 2
+    client.close()
+
+
+def test_retry_waits_at_least_retry_after(crm_server):
+    crm_server.responses = [(429, {"Retry-After": "0.3"})]
+    client = make_client(crm_server)
+    client.write(rows(1))
+    first, second = crm_server.requests
+    assert second["at"] - first["at"] >= 0.3
+    client.close()
+
+
+def test_client_error_is_not_retried(crm_server):
+    crm_server.responses = [(400, {})]
+    client = make_client(crm_server)
+    with pytest.raises(CrmError) as raised:
+        client.write(rows(1))
+    assert not raised.value.retryable and raised.value.failed_rows == rows(1)
+    assert len(crm_server.requests) == 1
+    client.close()
+
+
+def test_exhausted_budget_stops_retrying(crm_server):
+    crm_server.responses = [(503, {})] * 10
+    client = make_client(crm_server)
+    client.budget = RetryBudget(ratio=0, min_tokens=1)
+    with pytest.raises(CrmError):
+        client.write(rows(1))
+    # The one token paid for a single retry
+    assert len(crm_server.requests) == 2
+    assert client.stats()["budget_exhausted"] == 1
+    client.close()
+
+
+def test_budget_refills_with_first_attempts():
+    budget = RetryBudget(ratio=0.5, min_tokens=1)
+    assert budget.withdraw() and not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_idempotency_key_ignores_exported_at_and_row_order():
+    key = CrmClient.idempotency_key(rows(1, 2))
+    assert CrmClient.idempotency_key(rows(2, 1, exported_at="2026-02-01T00:00:00")) == key
+    changed = rows(1, 2)
+    changed[0]["title"] = "Boiler leak"
+    assert CrmClient.idempotency_key(changed) != key
+
+
+def test_rows_are_split_into_batches(crm_server):
+    client = make_client(crm_server, batch_size=2, max_concurrency=2)
+    client.write(rows(5, 1, 4, 2, 3))
+    batches = sorted([record["externalId"] for record in request["body"]["records"]]
+                     for request in crm_server.requests)
+    assert batches == [[1, 2], [3, 4], [5]]
+    client.close()
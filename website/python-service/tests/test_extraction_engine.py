@@ -0,0 +1,104 @@
+import json
+import threading
+
+import pytest
+
+from extraction_engine import ExtractionEngine
+
+
+# Stands in for TransformersBackend: a "token" is a character, and each
+# prompt is answered with its subject as the title
+class StubBackend:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def count_tokens(self, prompt):
+        return len(prompt)
+
+    def generate_batch(self, prompts, max_new_tokens=None):
+        self.release.wait(5)
+        self.batches.append(len(prompts))
+        if self.fail:
+            raise RuntimeError("backend failed")
+        outputs = []
+        for prompt in prompts:
+            subject = prompt.split("Subject: ", 1)[1].split("\n", 1)[0] if "Subject: " in prompt else ""
+            # Not text at all, so parsing it fails
+            outputs.append(42 if subject == "garbled" else json.dumps({"title": subject, "priority": "High"}))
+        return outputs
+
+
+@pytest.fixture
+def make_engine():
+    engines = []
+
+    def make(backend, **kwargs):
+        kwargs.setdefault("max_wait_ms", 200)
+        engine = ExtractionEngine(backend, **kwargs)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.stop()
+
+
+def test_concurrent_requests_share_a_batch(make_engine):
+    backend = StubBackend()
+    engine = make_engine(backend, max_batch_size=8)
+    futures = [engine.submit(f"order {i}", "same body") for i in range(5)]
+    assert [f.result(5)["title"] for f in futures] == [f"order {i}" for i in range(5)]
+    assert backend.batches == [5]
+
+
+def test_batches_are_capped_at_max_batch_size(make_engine):
+    backend = StubBackend()
+    engine = make_engine(backend, max_batch_size=2)
+    futures = [engine.submit(f"order {i}", "same body") for i in range(5)]
+    for future in futures:
+        future.result(5)
+    assert sorted(backend.batches) == [1, 2, 2]
+
+
+def test_prompts_of_different_length_go_to_different_buckets(make_engine):
+    backend = StubBackend()
+    engine = make_engine(backend, max_batch_size=8, bucket_width=500)
+    futures = [engine.submit("short", "x" * 10) for _ in range(2)]
+    futures += [engine.submit("long", "x" * 3000) for _ in range(2)]
+    for future in futures:
+        future.result(5)
+    assert backend.batches == [2, 2]
+
+
+def test_one_bad_output_does_not_fail_the_batch(make_engine):
+    backend = StubBackend()
+    engine = make_engine(backend)
+    futures = [engine.submit(subject, "body") for subject in ("first", "garbled", "last")]
+    assert futures[0].result(5)["title"] == "first"
+    with pytest.raises(TypeError):
+        futures[1].result(5)
+    assert futures[2].result(5)["title"] == "last"
+    assert engine.stats()["failed"] == 1
+
+
+def test_cancelled_request_does_not_fail_the_batch(make_engine):
+    backend = StubBackend()
+    backend.release.clear()
+    engine = make_engine(backend, max_wait_ms=50)
+    futures = [engine.submit(f"order {i}", "body") for i in range(3)]
+    assert futures[0].cancel()
+    backend.release.set()
+    assert futures[1].result(5)["title"] == "order 1"
+    assert futures[2].result(5)["title"] == "order 2"
+
+
+def test_backend_failure_fails_every_request_of_the_batch(make_engine):
+    engine = make_engine(StubBackend(fail=True))
+    futures = [engine.submit(f"order {i}", "body") for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(5)
+    assert engine.stats()["failed"] == 3
@@ -0,0 +1,175 @@
+import re
+import select
+import socketserver
+import threading
+
+import pytest
+
+from imap_ingest import ImapIngestor, uid_ranges
+
+
+# Just enough of an IMAP server for ImapIngestor: LOGIN, EXAMINE, UID SEARCH,
+# UID FETCH and IDLE over a mailbox of {uid: raw_message}
+class FakeMailbox:
+    def __init__(self, uidvalidity=1, messages=None):
+        self.uidvalidity = uidvalidity
+        self.messages = dict(messages or {})
+        self.new_mail = threading.Event()
+
+    def deliver(self, uid, raw):
+        self.messages[uid] = raw
+        self.new_mail.set()
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode())
+        self.wfile.flush()
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.send("* OK fake IMAP ready\r\n")
+        for line in self.rfile:
+            tag, command, *rest = line.decode().strip().split(" ", 2)
+            args = rest[0] if rest else ""
+            command = command.upper()
+            if command == "CAPABILITY":
+                self.send(f"* CAPABILITY IMAP4rev1 IDLE\r\n{tag} OK done\r\n")
+            elif command in ("LOGIN", "NOOP"):
+                self.send(f"{tag} OK done\r\n")
+            elif command == "EXAMINE":
+                self.send(f"* {len(mailbox.messages)} EXISTS\r\n"
+                          f"* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid\r\n{tag} OK [READ-ONLY] done\r\n")
+            elif command == "LOGOUT":
+                self.send(f"* BYE\r\n{tag} OK done\r\n")
+                return
+            elif command == "UID" and args.upper().startswith("SEARCH"):
+                match = re.search(r"UID (\d+):\*", args)
+                uids = sorted(mailbox.messages)
+                if match:
+                    # "n:*" always matches the highest UID
+                    uids = [uid for uid in uids if uid >= int(match.group(1))] or uids[-1:]
+                self.send(f"* SEARCH {' '.join(map(str, uids))}\r\n{tag} OK done\r\n")
+            elif command == "UID" and args.upper().startswith("FETCH"):
+                wanted = set()
+                for part in args.split(" ")[1].split(","):
+                    low, _, high = part.partition(":")
+                    wanted.update(range(int(low), int(high or low) + 1))
+                for number, uid in enumerate(sorted(mailbox.messages), 1):
+                    if uid in wanted:
+                        raw = mailbox.messages[uid]
+                        self.send(f"* {number} FETCH (UID {uid} BODY[] {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+                self.send(f"{tag} OK done\r\n")
+            elif command == "IDLE":
+                self._idle(tag, mailbox)
+            else:
+                self.send(f"{tag} BAD unknown command\r\n")
+
+    def _idle(self, tag, mailbox):
+        self.send("+ idling\r\n")
+        while True:
+            if mailbox.new_mail.is_set():
+                mailbox.new_mail.clear()
+                self.send(f"* {len(mailbox.messages)} EXISTS\r\n")
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                self.rfile.readline()
+                self.send(f"{tag} OK IDLE terminated\r\n")
+                return
+
+
+@pytest.fixture
+def imap_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeImapHandler)
+    server.daemon_threads = True
+    server.mailbox = FakeMailbox()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_ingestor(server, tmp_path, **settings):
+    imap_config = dict({"server": "127.0.0.1", "port": server.server_address[1], "use_ssl": False,
+                        "username": "dispatch"}, **settings)
+    ingestor = ImapIngestor(imap_config, str(tmp_path / "imap.db"))
+    ingestor.connect()
+    return ingestor
+
+
+def message(uid):
+    return f"Subject: order {uid}\r\n\r\nbody {uid}\r\n".encode()
+
+
+def test_uid_ranges_collapse_runs_in_batches():
+    assert list(uid_ranges([9, 1, 2, 3, 5], batch_size=3)) == ["1:3", "5,9"]
+
+
+def test_first_sync_starts_at_the_end_of_the_mailbox(imap_server, tmp_path):
+    imap_server.mailbox.messages = {uid: message(uid) for uid in (1, 2, 3)}
+    ingestor = make_ingestor(imap_server, tmp_path)
+    assert ingestor.last_uid == 3
+    assert list(ingestor.fetch_new()) == []
+
+    imap_server.mailbox.deliver(4, message(4))
+    assert list(ingestor.fetch_new()) == [(4, message(4))]
+    # Nothing above the high-water mark, even though "4:*" matches UID 4
+    assert list(ingestor.fetch_new()) == []
+    ingestor.close()
+
+
+def test_initial_sync_all_ingests_existing_mail(imap_server, tmp_path):
+    imap_server.mailbox.messages = {uid: message(uid) for uid in (1, 2, 7)}
+    ingestor = make_ingestor(imap_server, tmp_path, initial_sync="all")
+    assert [uid for uid, _ in ingestor.fetch_new()] == [1, 2, 7]
+    assert ingestor.backlog == 0
+    ingestor.close()
+
+
+def test_high_water_mark_survives_a_restart(imap_server, tmp_path):
+    ingestor = make_ingestor(imap_server, tmp_path)
+    imap_server.mailbox.deliver(1, message(1))
+    imap_server.mailbox.deliver(2, message(2))
+    assert [uid for uid, _ in ingestor.fetch_new()] == [1, 2]
+    ingestor.close()
+
+    imap_server.mailbox.deliver(3, message(3))
+    restarted = make_ingestor(imap_server, tmp_path)
+    assert restarted.last_uid == 2
+    assert [uid for uid, _ in restarted.fetch_new()] == [3]
+    restarted.close()
+
+
+def test_mark_only_advances_past_handled_messages(imap_server, tmp_path):
+    ingestor = make_ingestor(imap_server, tmp_path)
+    for uid in (1, 2, 3):
+        imap_server.mailbox.deliver(uid, message(uid))
+    messages = ingestor.fetch_new()
+    next(messages)
+    next(messages)
+    # UID 2 was handed out but its handler has not returned yet
+    assert ingestor.last_uid == 1
+    ingestor.close()
+
+
+def test_uidvalidity_change_resets_the_high_water_mark(imap_server, tmp_path):
+    imap_server.mailbox.messages = {uid: message(uid) for uid in (1, 2, 3, 4, 5)}
+    ingestor = make_ingestor(imap_server, tmp_path, initial_sync="all")
+    assert len(list(ingestor.fetch_new())) == 5
+    ingestor.close()
+
+    # The mailbox was rebuilt: UIDs restart at 1 under a new UIDVALIDITY
+    imap_server.mailbox.uidvalidity = 2
+    imap_server.mailbox.messages = {uid: message(uid) for uid in (1, 2)}
+    renumbered = make_ingestor(imap_server, tmp_path, initial_sync="all")
+    assert renumbered.uidvalidity == 2 and renumbered.last_uid == 0
+    assert [uid for uid, _ in renumbered.fetch_new()] == [1, 2]
+    renumbered.close()
+
+
+def test_idle_reports_new_mail(imap_server, tmp_path):
+    ingestor = make_ingestor(imap_server, tmp_path, idle_timeout=5)
+    threading.Timer(0.2, imap_server.mailbox.deliver, (1, message(1))).start()
+    assert ingestor.wait_for_mail()
+    assert [uid for uid, _ in ingestor.fetch_new()] == [1]
+    ingestor.close()
@@ -0,0 +1,62 @@
+from work_order_search import HashingEmbedder, WorkOrderSearch, work_order_text
+from work_order_store import get_work_order_store
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def embed(self, texts):
+        self.texts.extend(texts)
+        return super().embed(texts)
+
+
+BOILER = {"title": "Boiler leak", "description": "Water under the boiler", "location": "12 Elm St",
+          "customer": "Acme"}
+
+
+def make_search(tmp_path):
+    embedder = CountingEmbedder()
+    return WorkOrderSearch(str(tmp_path / "orders.db"), embedder), embedder
+
+
+def test_new_order_is_embedded_once(tmp_path):
+    search, embedder = make_search(tmp_path)
+    work_order_id = search.store.add(BOILER, email_id="<one>")
+    search.index_work_order(work_order_id, BOILER)
+    assert embedder.texts == [work_order_text(BOILER)]
+
+    search.index_work_order(search.store.add(BOILER, email_id="<one>"), BOILER)
+    assert len(embedder.texts) == 1
+
+
+def test_upsert_that_changes_the_text_is_reembedded(tmp_path):
+    search, embedder = make_search(tmp_path)
+    work_order_id = search.store.add(BOILER, email_id="<one>")
+    search.index_work_order(work_order_id, BOILER)
+
+    moved = dict(BOILER, location="98 Oak Ave")
+    assert search.store.add(moved, email_id="<one>") == work_order_id
+    search.index_work_order(work_order_id, moved)
+    assert embedder.texts == [work_order_text(BOILER), work_order_text(moved)]
+    assert search.semantic_search("98 Oak Ave", 1)[0][0] == work_order_id
+
+
+def test_changes_from_another_process_are_picked_up(tmp_path):
+    search, embedder = make_search(tmp_path)
+    other, other_embedder = make_search(tmp_path)
+    work_order_id = search.store.add(BOILER, email_id="<one>")
+    search.index_work_order(work_order_id, BOILER)
+    other.index_work_order(work_order_id, BOILER)
+    # Its embedding was persisted, so the other index loads rather than recomputes it
+    assert other_embedder.texts == []
+
+    moved = dict(BOILER, location="98 Oak Ave")
+    get_work_order_store(search.db_path).add(moved, email_id="<one>")
+    other.index_work_order(work_order_id, moved)
+    assert other_embedder.texts == [work_order_text(moved)]
+
+    search.index_work_order(work_order_id, moved)
+    assert embedder.texts == [work_order_text(BOILER)]
+    assert search._index.get(work_order_id).tolist() == other._index.get(work_order_id).tolist()
@@ -0,0 +1,515 @@
+import re
+import queue
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from work_order_store import get_work_order_store
+
+READER_POOL_SIZE = 4
+
+DEFAULT_DIMENSIONS = 256
+DEFAULT_DUPLICATE_THRESHOLD = 0.6
+DEFAULT_CHAT_CONTEXT_RESULTS = 3
+DEFAULT_CHAT_MIN_SIMILARITY = 0.35
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+SEARCH_MODES = ("hybrid", "keyword", "semantic")
+
+# Candidates taken from each ranking before they are fused
+CANDIDATES = 50
+# Reciprocal rank fusion constant; larger values flatten the rank weights
+RRF_K = 60
+EMBED_BATCH_SIZE = 64
+# Entries kept in work_order_changes; a process that falls further behind
+# reloads its whole vector index
+MAX_CHANGES = 100000
+
+# Fields a work order is embedded and keyword-searched by
+TEXT_FIELDS = ("title", "description", "location", "customer")
+# bm25 column weights, in TEXT_FIELDS order
+BM25_WEIGHTS = (3.0, 1.0, 2.0, 2.0)
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Dropped from keyword queries so a question such as "do we have a ticket for
+# this address" only matches on the words that carry meaning
+STOPWORDS = frozenset("""
+    a an and any are as at be by can do does for from had has have i in is it
+    its me my no not of on or our please that the their there this to us was
+    we were what when where which who will with you your already got ticket
+    tickets work order orders
+""".split())
+
+_searches = {}
+_searches_lock = threading.Lock()
+
+
+def _tokens(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def work_order_text(work_order):
+    return "\n".join(str(work_order.get(field) or "") for field in TEXT_FIELDS)
+
+
+# Free text to an FTS5 query: every meaningful word quoted (so punctuation
+# and FTS operators in user input are literal) and OR-ed, leaving bm25 to
+# rank orders that match more of them first
+def fts_query(text):
+    words = []
+    for word in _tokens(text):
+        if word not in STOPWORDS and word not in words:
+            words.append(word)
+    return " OR ".join(f'"{word}"' for word in words)
+
+
+# Feature-hashing embedder: words, word pairs and character trigrams hashed
+# into a fixed number of signed buckets. No model to load, deterministic, and
+# good at the near-duplicates dispatchers care about (same address, same
+# fault, different wording).
+class HashingEmbedder:
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def _features(self, text):
+        words = _tokens(text)
+        for word in words:
+            yield word, 1.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+        for first, second in zip(words, words[1:]):
+            yield f"{first} {second}", 1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vectors[row, h % self.dimensions] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+# Sentence embeddings from a Hugging Face encoder (e.g.
+# sentence-transformers/all-MiniLM-L6-v2), mean-pooled over the tokens.
+# Loaded on first use; separate from the extraction model.
+class TransformerEmbedder:
+    def __init__(self, model_name, batch_size=32):
+        self.name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                from transformers import AutoModel, AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.name)
+                self._model = AutoModel.from_pretrained(self.name)
+                self._model.eval()
+        return self._tokenizer, self._model
+
+    def embed(self, texts):
+        import torch
+        tokenizer, model = self._load()
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            with self._lock:
+                encoded = tokenizer(list(texts[start:start + self.batch_size]), padding=True,
+                                    truncation=True, max_length=256, return_tensors="pt")
+            with torch.inference_mode():
+                hidden = model(**encoded).last_hidden_state
+            mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            batches.append(torch.nn.functional.normalize(pooled, dim=1).float().numpy())
+        if not batches:
+            return np.zeros((0, model.config.hidden_size), dtype=np.float32)
+        return np.concatenate(batches)
+
+
+def make_embedder(settings):
+    model_name = settings.get("embedding_model")
+    if model_name:
+        return TransformerEmbedder(model_name)
+    return HashingEmbedder(settings.get("dimensions", DEFAULT_DIMENSIONS))
+
+
+# Unit vectors in one contiguous matrix, so a search is a single
+# matrix-vector product. Capacity doubles as orders arrive; re-adding an id
+# replaces its vector.
+class VectorIndex:
+    def __init__(self):
+        self._vectors = None
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((max(1024, len(ids)), vectors.shape[1]), dtype=np.float32)
+                self._ids = np.zeros(len(self._vectors), dtype=np.int64)
+            for work_order_id, vector in zip(ids, vectors):
+                row = self._rows.get(work_order_id)
+                if row is None:
+                    if self._size == len(self._vectors):
+                        self._grow()
+                    row = self._size
+                    self._size += 1
+                    self._rows[work_order_id] = row
+                    self._ids[row] = work_order_id
+                self._vectors[row] = vector
+
+    def get(self, work_order_id):
+        with self._lock:
+            row = self._rows.get(work_order_id)
+            return None if row is None else self._vectors[row].copy()
+
+    def _grow(self):
+        vectors = np.zeros((len(self._vectors) * 2, self._vectors.shape[1]), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        ids = np.zeros(len(vectors), dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._vectors, self._ids = vectors, ids
+
+    # The k most similar ids as (id, cosine similarity), best first
+    def search(self, vector, k, exclude=None):
+        with self._lock:
+            if not self._size:
+                return []
+            scores = self._vectors[:self._size] @ np.asarray(vector, dtype=np.float32)
+            ids = self._ids[:self._size]
+            if exclude is not None and exclude in self._rows:
+                scores[self._rows[exclude]] = -np.inf
+            k = min(k, self._size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+def get_work_order_search(config):
+    settings = config.get("search", {})
+    db_path = config["db_path"]
+    with _searches_lock:
+        search = _searches.get(db_path)
+        if search is None:
+            search = WorkOrderSearch(db_path, make_embedder(settings))
+            _searches[db_path] = search
+        elif search.embedder.name != make_embedder(settings).name:
+            search.set_embedder(make_embedder(settings))
+        search.duplicate_threshold = settings.get("duplicate_threshold", DEFAULT_DUPLICATE_THRESHOLD)
+        return search
+
+
+# Keyword and similarity search over the work order store. Keyword search is
+# an FTS5 index kept in sync with work_orders by triggers; similarity search
+# is an in-process vector index whose embeddings are persisted next to the
+# orders, so a restart only embeds orders it has not seen. Triggers also log
+# every new order, and every update that changes an order's text (dropping
+# its now stale embedding), in work_order_changes; each process catches up
+# on that log, including changes made by other processes, before it searches.
+class WorkOrderSearch:
+    def __init__(self, db_path, embedder):
+        self.db_path = db_path
+        self.store = get_work_order_store(db_path)
+        self.embedder = embedder
+        self.duplicate_threshold = DEFAULT_DUPLICATE_THRESHOLD
+
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._readers_lock = threading.Lock()
+
+        self._write_lock = threading.Lock()
+        self._writer_conn = self._connect()
+        self._init_db(self._writer_conn)
+
+        self._index_lock = threading.RLock()
+        self._index = VectorIndex()
+        self._loaded = False
+        self._seen_change = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self, conn):
+        columns = ", ".join(TEXT_FIELDS)
+        new_columns = ", ".join(f"new.{field}" for field in TEXT_FIELDS)
+        old_columns = ", ".join(f"old.{field}" for field in TEXT_FIELDS)
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'work_orders_fts'").fetchone()
+        conn.execute(f'''
+            CREATE VIRTUAL TABLE IF NOT EXISTS work_orders_fts USING fts5(
+                {columns}, content='work_orders', content_rowid='id', tokenize='porter unicode61'
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS work_orders_fts_insert AFTER INSERT ON work_orders BEGIN
+                INSERT INTO work_orders_fts (rowid, {columns}) VALUES (new.id, {new_columns});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS work_orders_fts_update AFTER UPDATE ON work_orders BEGIN
+                INSERT INTO work_orders_fts (work_orders_fts, rowid, {columns})
+                VALUES ('delete', old.id, {old_columns});
+                INSERT INTO work_orders_fts (rowid, {columns}) VALUES (new.id, {new_columns});
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS work_orders_fts_delete AFTER DELETE ON work_orders BEGIN
+                INSERT INTO work_orders_fts (work_orders_fts, rowid, {columns})
+                VALUES ('delete', old.id, {old_columns});
+            END
+        ''')
+        if not exists:
+            # Index the orders stored before search existed
+            conn.execute("INSERT INTO work_orders_fts (work_orders_fts) VALUES ('rebuild')")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_order_embeddings (
+                work_order_id INTEGER PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+        ''')
+        changed = " OR ".join(f"old.{field} IS NOT new.{field}" for field in TEXT_FIELDS)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_order_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                work_order_id INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS work_order_changes_insert AFTER INSERT ON work_orders BEGIN
+                INSERT INTO work_order_changes (work_order_id) VALUES (new.id);
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS work_order_changes_update AFTER UPDATE ON work_orders
+            WHEN {changed} BEGIN
+                DELETE FROM work_order_embeddings WHERE work_order_id = new.id;
+                INSERT INTO work_order_changes (work_order_id) VALUES (new.id);
+            END
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_order_duplicates (
+                work_order_id INTEGER NOT NULL,
+                duplicate_of INTEGER NOT NULL,
+                similarity REAL NOT NULL,
+                PRIMARY KEY (work_order_id, duplicate_of)
+            )
+        ''')
+        conn.commit()
+
+    @contextmanager
+    def _reader(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._readers_lock:
+                can_open = self._reader_count < READER_POOL_SIZE
+                if can_open:
+                    self._reader_count += 1
+            conn = self._connect() if can_open else self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def set_embedder(self, embedder):
+        with self._index_lock:
+            self.embedder = embedder
+            self._index = VectorIndex()
+            self._loaded = False
+            self._seen_change = 0
+
+    def _store_embeddings(self, ids, vectors):
+        rows = [(work_order_id, self.embedder.name, vector.tobytes())
+                for work_order_id, vector in zip(ids, vectors)]
+        with self._write_lock, self._writer_conn:
+            self._writer_conn.executemany('''
+                INSERT OR REPLACE INTO work_order_embeddings (work_order_id, model, vector)
+                VALUES (?, ?, ?)
+            ''', rows)
+
+    def _embed_rows(self, rows):
+        for start in range(0, len(rows), EMBED_BATCH_SIZE):
+            batch = rows[start:start + EMBED_BATCH_SIZE]
+            ids = [row[0] for row in batch]
+            vectors = self.embedder.embed([work_order_text(dict(zip(TEXT_FIELDS, row[1:]))) for row in batch])
+            self._store_embeddings(ids, vectors)
+            self._index.add(ids, vectors)
+
+    # Load persisted embeddings on first use, then embed whatever has no
+    # embedding for the current model yet; afterwards only orders logged in
+    # work_order_changes since the last catch-up are looked at. Their
+    # embedding is read back if another process already made it, and
+    # computed otherwise.
+    def _ensure_indexed(self):
+        with self._index_lock:
+            columns = ", ".join(f"w.{field}" for field in TEXT_FIELDS)
+            with self._reader() as conn:
+                latest, oldest = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0), MIN(seq) FROM work_order_changes").fetchone()
+                if self._loaded and oldest is not None and oldest > self._seen_change + 1:
+                    # Changes this process has not seen were already trimmed
+                    self._index = VectorIndex()
+                    self._loaded = False
+                if not self._loaded:
+                    cursor = conn.execute(
+                        "SELECT work_order_id, vector FROM work_order_embeddings WHERE model = ?",
+                        (self.embedder.name,))
+                    while True:
+                        rows = cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        ids = [row[0] for row in rows]
+                        self._index.add(ids, np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows]))
+                    missing = conn.execute(f'''
+                        SELECT w.id, {columns} FROM work_orders w
+                        LEFT JOIN work_order_embeddings e ON e.work_order_id = w.id AND e.model = ?
+                        WHERE e.work_order_id IS NULL
+                        ORDER BY w.id
+                    ''', (self.embedder.name,)).fetchall()
+                    self._loaded = True
+                elif latest > self._seen_change:
+                    rows = conn.execute(f'''
+                        SELECT w.id, e.vector, {columns} FROM work_orders w
+                        LEFT JOIN work_order_embeddings e ON e.work_order_id = w.id AND e.model = ?
+                        WHERE w.id IN (SELECT work_order_id FROM work_order_changes WHERE seq > ? AND seq <= ?)
+                        ORDER BY w.id
+                    ''', (self.embedder.name, self._seen_change, latest)).fetchall()
+                    stored = [row for row in rows if row[1] is not None]
+                    if stored:
+                        self._index.add([row[0] for row in stored],
+                                        np.stack([np.frombuffer(row[1], dtype=np.float32) for row in stored]))
+                    missing = [(row[0],) + tuple(row[2:]) for row in rows if row[1] is None]
+                else:
+                    missing = []
+            if missing:
+                self._embed_rows(missing)
+            self._seen_change = latest
+
+    # (Re-)embed one order as it is saved and return the existing orders it
+    # looks like a duplicate of, most similar first. The matches are also
+    # recorded so duplicates() can list them later.
+    def index_work_order(self, work_order_id, work_order, limit=5):
+        # The order was saved first, so catching up has normally embedded it
+        # already (or kept its embedding, if its text did not change)
+        self._ensure_indexed()
+        with self._index_lock:
+            vector = self._index.get(work_order_id)
+            if vector is None:
+                vector = self.embedder.embed([work_order_text(work_order)])[0]
+                self._store_embeddings([work_order_id], [vector])
+                self._index.add([work_order_id], [vector])
+            matches = [
+                (other_id, similarity)
+                for other_id, similarity in self._index.search(vector, limit, exclude=work_order_id)
+                if similarity >= self.duplicate_threshold
+            ]
+
+        with self._write_lock, self._writer_conn:
+            self._writer_conn.execute(
+                "DELETE FROM work_order_changes WHERE seq <= (SELECT MAX(seq) FROM work_order_changes) - ?",
+                (MAX_CHANGES,))
+            self._writer_conn.execute(
+                "DELETE FROM work_order_duplicates WHERE work_order_id = ?", (work_order_id,))
+            self._writer_conn.executemany('''
+                INSERT INTO work_order_duplicates (work_order_id, duplicate_of, similarity)
+                VALUES (?, ?, ?)
+            ''', [(work_order_id, other_id, similarity) for other_id, similarity in matches])
+        return self._with_scores(matches, "similarity", fields="id,title,customer,location,created_at")
+
+    def duplicates(self, work_order_id, fields=None):
+        with self._reader() as conn:
+            matches = conn.execute('''
+                SELECT duplicate_of, similarity FROM work_order_duplicates
+                WHERE work_order_id = ? ORDER BY similarity DESC
+            ''', (work_order_id,)).fetchall()
+        return self._with_scores(matches, "similarity", fields)
+
+    def _with_scores(self, scored, key, fields=None):
+        scores = dict(scored)
+        rows = self.store.get_many([work_order_id for work_order_id, _ in scored], fields)
+        for row in rows:
+            row[key] = round(scores[row["id"]], 4)
+        return rows
+
+    def keyword_search(self, text, limit):
+        match = fts_query(text)
+        if not match:
+            return []
+        with self._reader() as conn:
+            rows = conn.execute(f'''
+                SELECT rowid, bm25(work_orders_fts, {', '.join(str(w) for w in BM25_WEIGHTS)}) AS rank
+                FROM work_orders_fts WHERE work_orders_fts MATCH ?
+                ORDER BY rank LIMIT ?
+            ''', (match, limit)).fetchall()
+        # bm25 is lower-is-better; flip it so every score is higher-is-better
+        return [(work_order_id, -rank) for work_order_id, rank in rows]
+
+    def semantic_search(self, text, limit):
+        self._ensure_indexed()
+        vector = self.embedder.embed([text])[0]
+        with self._index_lock:
+            return self._index.search(vector, limit)
+
+    # Search by free text. hybrid fuses the keyword and similarity rankings
+    # with reciprocal rank fusion, so orders found by both come first.
+    def search(self, text, mode="hybrid", limit=DEFAULT_LIMIT, fields=None):
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}; expected one of {', '.join(SEARCH_MODES)}")
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        if not (text or "").strip():
+            return []
+
+        keyword = self.keyword_search(text, max(limit, CANDIDATES)) if mode != "semantic" else []
+        semantic = self.semantic_search(text, max(limit, CANDIDATES)) if mode != "keyword" else []
+
+        scores = {}
+        for ranking in (keyword, semantic):
+            for rank, (work_order_id, _) in enumerate(ranking):
+                scores[work_order_id] = scores.get(work_order_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+        rows = self._with_scores(ranked, "score", fields)
+        keyword_ids = {work_order_id for work_order_id, _ in keyword}
+        similarities = dict(semantic)
+        for row in rows:
+            row["keyword_match"] = row["id"] in keyword_ids
+            if row["id"] in similarities:
+                row["similarity"] = round(similarities[row["id"]], 4)
+        return rows
+
+    # Work orders relevant to a chat message, formatted for the prompt. Only
+    # keyword matches or close semantic matches are used, so small talk gets
+    # no context at all.
+    def chat_context(self, message, limit=DEFAULT_CHAT_CONTEXT_RESULTS,
+                     min_similarity=DEFAULT_CHAT_MIN_SIMILARITY):
+        rows = [
+            row for row in self.search(message, limit=limit)
+            if row["keyword_match"] or row.get("similarity", 0) >= min_similarity
+        ]
+        if not rows:
+            return [], ""
+        lines = ["Work orders on file that may be relevant:"]
+        for row in rows:
+            details = ", ".join(
+                str(row[field]) for field in ("priority", "customer", "location") if row.get(field))
+            due = f", due {row['due_date']}" if row.get("due_date") else ""
+            lines.append(f"- #{row['id']} {row['title'] or 'Untitled'} ({details}{due}): {row['description'] or ''}")
+        return [row["id"] for row in rows], "\n".join(lines)
@@ -0,0 +1,308 @@
+import os
+import json
+import queue
+import base64
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from fast_extract import parse_date
+
+READER_POOL_SIZE = 4
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+PRIORITY_RANKS = {"URGENT": 0, "HIGH": 1, "NORMAL": 2, "LOW": 3}
+DEFAULT_PRIORITY = "NORMAL"
+
+FIELDS = [
+    "id", "title", "priority", "description", "due_date", "customer", "location",
+    "trade", "summary", "action_items", "email_id", "source", "created_at"
+]
+
+# Columns each sort orders by, most significant first; the trailing id
+# makes the order total so keyset cursors never skip or repeat a row. Every
+# sort (and every filter combined with the default sort) has an index with
+# the same column order.
+SORTS = {
+    "created_at": ("created_at", "id"),
+    "due_date": ("due_date", "id"),
+    "priority": ("priority_rank", "created_at", "id")
+}
+NULLABLE_SORT_COLUMNS = {"due_date"}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_work_order_store(db_path):
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = WorkOrderStore(db_path)
+            _stores[db_path] = store
+        return store
+
+
+def encode_cursor(sort, values):
+    raw = json.dumps([sort] + list(values)).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor, sort):
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    if not isinstance(decoded, list) or decoded[:1] != [sort] or len(decoded) != len(SORTS[sort]) + 1:
+        raise ValueError("Cursor does not match the requested sort")
+    return decoded[1:]
+
+
+def normalize_priority(priority):
+    priority = str(priority or "").strip().upper()
+    return priority if priority in PRIORITY_RANKS else DEFAULT_PRIORITY
+
+
+def _split(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if v]
+    return [part.strip() for part in str(value).split(",") if part.strip()]
+
+
+# Rows after (descending: before) the cursor position in the sort order.
+# Row values keep the comparison on the index; NULL due dates, which SQLite
+# sorts first, are handled separately because they never compare.
+def _keyset_clause(columns, values, descending):
+    op = "<" if descending else ">"
+    nullable = columns[0] in NULLABLE_SORT_COLUMNS
+    rest = ", ".join(columns[1:])
+    rest_marks = ", ".join("?" for _ in columns[1:])
+
+    if values[0] is None:
+        clause = f"({columns[0]} IS NULL AND ({rest}) {op} ({rest_marks}))"
+        if not descending:
+            clause = f"({clause} OR {columns[0]} IS NOT NULL)"
+        return clause, list(values[1:])
+
+    clause = f"(({', '.join(columns)}) {op} ({', '.join('?' for _ in columns)}))"
+    if descending and nullable:
+        clause = f"({clause} OR {columns[0]} IS NULL)"
+    return clause, list(values)
+
+
+# Work orders extracted from email, in the same SQLite database as the logs.
+# Writes go through one connection; list queries use a small reader pool and
+# keyset pagination, so a page costs the same at row 100 as at row 500,000.
+class WorkOrderStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._readers_lock = threading.Lock()
+
+        self._write_lock = threading.Lock()
+        self._writer_conn = self._connect()
+        self._init_db(self._writer_conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_db(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_id TEXT UNIQUE,
+                source TEXT NOT NULL,
+                title TEXT,
+                priority TEXT NOT NULL,
+                priority_rank INTEGER NOT NULL,
+                description TEXT,
+                due_date TEXT,
+                customer TEXT COLLATE NOCASE,
+                location TEXT,
+                trade TEXT COLLATE NOCASE,
+                summary TEXT,
+                action_items TEXT,
+                created_at TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_work_orders_created_at
+            ON work_orders (created_at, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_work_orders_priority
+            ON work_orders (priority_rank, created_at, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_work_orders_trade
+            ON work_orders (trade, created_at, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_work_orders_due_date
+            ON work_orders (due_date, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_work_orders_customer
+            ON work_orders (customer, created_at, id)
+        ''')
+        conn.commit()
+
+    @contextmanager
+    def _reader(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._readers_lock:
+                can_open = self._reader_count < READER_POOL_SIZE
+                if can_open:
+                    self._reader_count += 1
+            conn = self._connect() if can_open else self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    # Save an extracted work order and return its id. Orders are keyed by
+    # email_id, so reprocessing an email updates its order instead of adding
+    # a second one; orders without an email_id (manual) are always added.
+    def add(self, work_order, email_id=None, source="processor"):
+        priority = normalize_priority(work_order.get("priority"))
+        due_date = work_order.get("due_date")
+        row = {
+            "email_id": email_id,
+            "source": source,
+            "title": work_order.get("title"),
+            "priority": priority,
+            "priority_rank": PRIORITY_RANKS[priority],
+            "description": work_order.get("description"),
+            # Only ISO dates sort and filter correctly
+            "due_date": parse_date(str(due_date)) if due_date else None,
+            "customer": work_order.get("customer"),
+            "location": work_order.get("location"),
+            "trade": work_order.get("trade"),
+            "summary": work_order.get("summary"),
+            "action_items": work_order.get("action_items"),
+            "created_at": datetime.utcnow().strftime(TIMESTAMP_FORMAT)
+        }
+        columns = ", ".join(row)
+        marks = ", ".join(f":{column}" for column in row)
+        updates = ", ".join(
+            f"{column} = excluded.{column}" for column in row if column not in ("email_id", "created_at"))
+
+        with self._write_lock, self._writer_conn:
+            cursor = self._writer_conn.execute(f'''
+                INSERT INTO work_orders ({columns}) VALUES ({marks})
+                ON CONFLICT (email_id) DO UPDATE SET {updates}
+            ''', row)
+            if email_id is None:
+                return cursor.lastrowid
+            return self._writer_conn.execute(
+                "SELECT id FROM work_orders WHERE email_id = ?", (email_id,)).fetchone()[0]
+
+    def get(self, work_order_id):
+        with self._reader() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(FIELDS)} FROM work_orders WHERE id = ?", (work_order_id,)
+            ).fetchone()
+        return dict(zip(FIELDS, row)) if row else None
+
+    # Work orders by id, in the order given; ids that do not exist are skipped
+    def get_many(self, work_order_ids, fields=None):
+        wanted = _split(fields) or FIELDS
+        unknown = [field for field in wanted if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        wanted = ["id"] + [field for field in wanted if field != "id"]
+        work_order_ids = list(work_order_ids)
+        if not work_order_ids:
+            return []
+
+        with self._reader() as conn:
+            rows = conn.execute(f'''
+                SELECT {', '.join(wanted)} FROM work_orders
+                WHERE id IN ({', '.join('?' for _ in work_order_ids)})
+            ''', work_order_ids).fetchall()
+        by_id = {row[0]: dict(zip(wanted, row)) for row in rows}
+        return [by_id[work_order_id] for work_order_id in work_order_ids if work_order_id in by_id]
+
+    # One page of work orders. Filters combine with AND; priority and trade
+    # accept several comma-separated values. `fields` limits the columns
+    # returned (id is always included). Pass the returned next_cursor back
+    # with the same sort and order to get the following page.
+    def query(self, limit=DEFAULT_PAGE_SIZE, cursor=None, sort="created_at", order="desc", fields=None,
+              priority=None, trade=None, customer=None, source=None, email_id=None,
+              due_after=None, due_before=None, since=None, until=None):
+        if sort not in SORTS:
+            raise ValueError(f"Unknown sort: {sort}; expected one of {', '.join(SORTS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        wanted = _split(fields) or FIELDS
+        unknown = [field for field in wanted if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        wanted = ["id"] + [field for field in wanted if field != "id"]
+
+        clauses = []
+        params = []
+        priorities = [normalize_priority(p) for p in _split(priority)]
+        if priorities:
+            clauses.append(f"priority_rank IN ({', '.join('?' for _ in priorities)})")
+            params.extend(PRIORITY_RANKS[p] for p in priorities)
+        trades = _split(trade)
+        if trades:
+            clauses.append(f"trade IN ({', '.join('?' for _ in trades)})")
+            params.extend(trades)
+        for column, value in (("customer", customer), ("source", source), ("email_id", email_id)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        for condition, value in (("due_date >= ?", due_after), ("due_date < ?", due_before),
+                                 ("created_at >= ?", since), ("created_at < ?", until)):
+            if value:
+                clauses.append(condition)
+                params.append(value)
+
+        columns = SORTS[sort]
+        descending = order == "desc"
+        if cursor:
+            clause, cursor_params = _keyset_clause(columns, decode_cursor(cursor, sort), descending)
+            clauses.append(clause)
+            params.extend(cursor_params)
+
+        direction = "DESC" if descending else "ASC"
+        selected = wanted + [column for column in columns if column not in wanted]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # Fetch one extra row to learn whether another page exists
+        with self._reader() as conn:
+            rows = conn.execute(f'''
+                SELECT {', '.join(selected)}
+                FROM work_orders
+                {where}
+                ORDER BY {', '.join(f"{column} {direction}" for column in columns)}
+                LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+
+        has_more = len(rows) > limit
+        rows = [dict(zip(selected, row)) for row in rows[:limit]]
+        next_cursor = encode_cursor(sort, [rows[-1][column] for column in columns]) if has_more else None
+        return {
+            "work_orders": [{field: row[field] for field in wanted} for row in rows],
+            "next_cursor": next_cursor
+        }